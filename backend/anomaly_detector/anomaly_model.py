@@ -4,6 +4,11 @@ from sklearn.ensemble import IsolationForest
 import joblib
 import os
 
+try:
+    from anomaly_detector.features import FEATURES, LEGACY_FEATURES, feature_vector
+except ImportError:  # run as a script from inside anomaly_detector/
+    from features import FEATURES, LEGACY_FEATURES, feature_vector
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # go up to backup_tracker/
 csv_path = os.path.join(BASE_DIR, "sample_metrics.csv")
 MODEL_PATH = os.path.join(os.path.dirname(__file__), "isolation_model.pkl")
@@ -26,8 +31,12 @@ def train_model(csv_path="sample_metrics.csv"):
     if df.empty:
         raise ValueError("Metrics CSV is empty!")
 
-    features = ["cpu_percent", "ram_percent", "disk_percent"]
-    X = df[features]
+    # Extended I/O features are used only when the collector has recorded them
+    if all(c in df.columns for c in FEATURES) and df[FEATURES].notna().any().all():
+        features = list(FEATURES)
+    else:
+        features = list(LEGACY_FEATURES)
+    X = df[features].fillna(0.0)
 
     model = IsolationForest(contamination=0.05, random_state=42)
     model.fit(X)
@@ -42,12 +51,13 @@ def load_model():
         train_model()
     return joblib.load(MODEL_PATH)
 
-def detect_anomaly(cpu, ram, disk):
+def detect_anomaly_sample(sample):
+    """Classify a sample dict using whichever feature set the model was trained on."""
     model = load_model()
-    import pandas as pd
-    input_df = pd.DataFrame(
-        [[cpu, ram, disk]],
-        columns=["cpu_percent", "ram_percent", "disk_percent"]
-    )
+    features = list(getattr(model, "feature_names_in_", LEGACY_FEATURES))
+    input_df = pd.DataFrame([feature_vector(sample, features)], columns=features)
     pred = model.predict(input_df)[0]
     return "Anomaly" if pred == -1 else "Normal"
+
+def detect_anomaly(cpu, ram, disk):
+    return detect_anomaly_sample({"cpu_percent": cpu, "ram_percent": ram, "disk_percent": disk})
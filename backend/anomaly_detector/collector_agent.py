@@ -0,0 +1,223 @@
+# collector_agent.py
+"""
+Lightweight fleet agent for backup nodes.
+
+Samples the local host, buffers samples in memory and ships them to the
+Backup Tracker server as gzip-compressed JSON batches tagged with a host id.
+Shipping runs on a sender thread fed by a bounded queue, so a slow or
+unreachable server never delays sampling. When the server is unreachable,
+batches are spooled to disk; the sender replays the spool (oldest first)
+before any newer batch, so the server always receives batches in order.
+
+Usage:
+    python -m anomaly_detector.collector_agent --server http://tracker:5050 --host-id node-07
+"""
+
+import os
+import sys
+import json
+import gzip
+import time
+import glob
+import queue
+import socket
+import argparse
+import threading
+import urllib.request
+import urllib.error
+
+from anomaly_detector.host_sampler import HostSampler
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SERVER = "http://127.0.0.1:5050"
+INGEST_PATH = "/api/metrics/ingest"
+DEFAULT_SPOOL_DIR = os.path.join(BASE_DIR, "spool")
+
+SAMPLE_INTERVAL = 5      # seconds between samples
+BATCH_SIZE = 12          # ship once this many samples are buffered (~60s)
+MAX_SPOOL_FILES = 2000   # oldest spooled batches are dropped beyond this
+HTTP_TIMEOUT = 10
+OUTBOX_SIZE = 8          # batches waiting for the sender; overflow goes to the spool
+RETRY_INTERVAL = 30      # seconds between spool replay attempts while idle
+
+
+class MetricsAgent:
+    def __init__(self, server=DEFAULT_SERVER, host_id=None, spool_dir=DEFAULT_SPOOL_DIR,
+                 batch_size=BATCH_SIZE, max_spool_files=MAX_SPOOL_FILES):
+        self.ingest_url = server.rstrip("/") + INGEST_PATH
+        self.host_id = host_id or socket.gethostname()
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.max_spool_files = max_spool_files
+        self.buffer = []
+        self._spool_seq = 0
+        self._spool_lock = threading.Lock()
+        self.sampler = HostSampler()
+        self.outbox = queue.Queue(maxsize=OUTBOX_SIZE)
+        self._sender = None
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    # ---------- SAMPLING ----------
+    def sample(self):
+        """Take one non-blocking snapshot of the local host."""
+        return self.sampler.snapshot()
+
+    def add(self, sample):
+        self.buffer.append(sample)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    # ---------- SHIPPING ----------
+    def _encode(self, samples):
+        body = json.dumps({"host": self.host_id, "samples": samples}, separators=(",", ":"))
+        return gzip.compress(body.encode("utf-8"))
+
+    def _post(self, payload):
+        """POST one compressed batch. Returns True when the server accepted it."""
+        req = urllib.request.Request(
+            self.ingest_url,
+            data=payload,
+            method="POST",
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=HTTP_TIMEOUT) as resp:
+                return 200 <= resp.status < 300
+        except urllib.error.HTTPError as e:
+            # A 4xx means the batch itself is bad; retrying it would never succeed.
+            if 400 <= e.code < 500:
+                print(f"[Agent] Batch rejected by server ({e.code}), dropping it")
+                return True
+            return False
+        except (urllib.error.URLError, OSError):
+            return False
+
+    def flush(self):
+        """Hand buffered samples to the sender thread (or the spool if it is backed up)."""
+        if not self.buffer:
+            return
+        payload = self._encode(self.buffer)
+        self.buffer = []
+        try:
+            self.outbox.put_nowait(payload)
+        except queue.Full:
+            self._spool(payload)
+
+    def _ship(self, payload):
+        """Send one batch, after everything already spooled; spool it on failure."""
+        if not self.replay_spool() or not self._post(payload):
+            self._spool(payload)
+
+    def _send_loop(self):
+        while True:
+            try:
+                payload = self.outbox.get(timeout=RETRY_INTERVAL)
+            except queue.Empty:
+                self.replay_spool()
+                continue
+            if payload is None:
+                return
+            self._ship(payload)
+
+    def start_sender(self):
+        self._sender = threading.Thread(target=self._send_loop, name="agent-sender", daemon=True)
+        self._sender.start()
+
+    def stop_sender(self, timeout=HTTP_TIMEOUT * 2):
+        """Drain the outbox; whatever is still queued after `timeout` is spooled."""
+        if self._sender is None:
+            return
+        try:
+            self.outbox.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._sender.join(timeout)
+        while True:
+            try:
+                payload = self.outbox.get_nowait()
+            except queue.Empty:
+                break
+            if payload is not None:
+                self._spool(payload)
+        self._sender = None
+
+    # ---------- SPOOL ----------
+    def _spool_files(self):
+        return sorted(glob.glob(os.path.join(self.spool_dir, "*.json.gz")))
+
+    def _spool(self, payload):
+        # Called from the sampling thread (outbox full) and the sender thread
+        with self._spool_lock:
+            self._spool_seq += 1
+            name = f"{time.time_ns()}_{self._spool_seq:06d}.json.gz"
+            tmp = os.path.join(self.spool_dir, name + ".tmp")
+            with open(tmp, "wb") as f:
+                f.write(payload)
+            os.replace(tmp, os.path.join(self.spool_dir, name))
+
+            files = self._spool_files()
+            for old in files[:max(0, len(files) - self.max_spool_files)]:
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass
+        print(f"[Agent] Server unreachable, spooled batch ({len(files)} pending)")
+
+    def replay_spool(self):
+        """Send spooled batches oldest first; returns False if any are still pending."""
+        sent = 0
+        drained = True
+        for path in self._spool_files():
+            try:
+                with open(path, "rb") as f:
+                    payload = f.read()
+            except FileNotFoundError:
+                continue  # trimmed by _spool meanwhile
+            if not self._post(payload):
+                drained = False
+                break
+            os.remove(path)
+            sent += 1
+        if sent:
+            print(f"[Agent] Replayed {sent} spooled batch(es)")
+        return drained
+
+    # ---------- MAIN LOOP ----------
+    def run(self, interval=SAMPLE_INTERVAL):
+        print(f"📡 Agent '{self.host_id}' shipping to {self.ingest_url}")
+        self.start_sender()
+        next_tick = time.monotonic()
+        try:
+            while True:
+                self.add(self.sample())
+                next_tick += interval
+                time.sleep(max(0.0, next_tick - time.monotonic()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.flush()
+            self.stop_sender()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backup Tracker fleet metrics agent")
+    parser.add_argument("--server", default=os.environ.get("TRACKER_SERVER", DEFAULT_SERVER))
+    parser.add_argument("--host-id", default=os.environ.get("TRACKER_HOST_ID"))
+    parser.add_argument("--interval", type=float, default=SAMPLE_INTERVAL)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--spool-dir", default=DEFAULT_SPOOL_DIR)
+    args = parser.parse_args(argv)
+
+    agent = MetricsAgent(
+        server=args.server,
+        host_id=args.host_id,
+        spool_dir=args.spool_dir,
+        batch_size=args.batch_size,
+    )
+    agent.run(interval=args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
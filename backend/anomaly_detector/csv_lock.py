@@ -0,0 +1,34 @@
+# csv_lock.py
+"""
+Cross-process lock for the append-only CSV logs (metrics, anomalies,
+incidents, fleet ingest).
+
+Writers hold it for each batch they append; maintenance.rewrite_csv holds
+it while it copies rows that arrived during its filter pass and swaps the
+rewritten file in, so no append can land in a file that is being replaced.
+The lock is an flock on a "<csv>.lock" file next to the log, which works
+between threads, API workers and the collector alike.
+"""
+
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock
+    fcntl = None
+
+
+@contextmanager
+def locked(path):
+    """Hold the exclusive lock for the CSV file at `path`."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,249 @@
+# detectors.py
+"""
+Streaming statistical detectors used as a cheap first stage before the LSTM.
+
+Every detector keeps a small bounded state per metric and is updated in
+O(1) per sample. The collector only escalates a window to the LSTM when a
+statistical detector flags it; static threshold rules raise incidents on
+their own but do not escalate (unless configured with "escalate": true),
+since a busy host can sit above a rule for hours and would otherwise
+send every tick to Keras.
+
+Detectors and thresholds are configured per metric in detector_config.json
+(override the path with DETECTOR_CONFIG). Supported types:
+
+    threshold  upper/lower static bounds (the old hard-coded rule engine)
+    ewma       exponentially weighted mean/variance z-score
+    mad        streaming median / median absolute deviation estimate
+    seasonal   per time-of-day bucket EWMA baseline
+"""
+
+import os
+import json
+import math
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONFIG_PATH = os.path.join(BASE_DIR, "detector_config.json")
+
+
+def severity_for(score):
+    if score >= 6:
+        return "High"
+    if score >= 4.5:
+        return "Medium"
+    return "Low"
+
+
+class Finding:
+    def __init__(self, metric, detector, value, score, severity, source="Statistical", escalate=True):
+        self.metric = metric
+        self.detector = detector
+        self.value = value
+        self.score = score
+        self.severity = severity
+        self.source = source
+        # Whether this finding is worth an LSTM inference
+        self.escalate = escalate
+
+    def __repr__(self):
+        return f"Finding({self.metric}, {self.detector}, value={self.value}, score={self.score:.2f})"
+
+
+# ---------- DETECTORS ----------
+class ThresholdDetector:
+    kind = "threshold"
+    source = "Rule-Based"
+
+    def __init__(self, upper=None, lower=None, severity="High", escalate=False):
+        self.upper = upper
+        self.lower = lower
+        self.severity = severity
+        self.escalate = escalate
+
+    def update(self, value, ts=None):
+        if self.upper is not None and value > self.upper:
+            return True, value
+        if self.lower is not None and value < self.lower:
+            return True, value
+        return False, value
+
+
+class EWMADetector:
+    kind = "ewma"
+    source = "Statistical"
+    escalate = True
+
+    def __init__(self, alpha=0.1, z=3.0, warmup=30, min_std=1e-6):
+        self.alpha = alpha
+        self.z = z
+        self.warmup = warmup
+        self.min_std = min_std
+        self.mean = None
+        self.var = 0.0
+        self.n = 0
+
+    def update(self, value, ts=None):
+        self.n += 1
+        if self.mean is None:
+            self.mean = value
+            return False, 0.0
+
+        diff = value - self.mean
+        score = abs(diff) / max(math.sqrt(self.var), self.min_std)
+        # Score against the baseline *before* absorbing this value
+        self.mean += self.alpha * diff
+        self.var = (1 - self.alpha) * (self.var + self.alpha * diff * diff)
+        return self.n > self.warmup and score > self.z, score
+
+
+class RollingMADDetector:
+    """Robust z-score against a streaming median and MAD.
+
+    The first window // 2 samples seed an exact median and MAD; after that
+    both are tracked with sign-based stochastic updates (each moves by a
+    step proportional to the current scale, toward the sample), which
+    converge to the median and the median absolute deviation with an
+    effective memory of about `window` samples. O(1) time and memory per
+    sample, and a single outlier moves the estimates by one step at most.
+
+    On zero-heavy series (disk/net bytes, IOPS) the MAD is 0, so the scale
+    is floored by the running RMS deviation from the median and by
+    `min_scale`; with that floor, Chebyshev keeps the share of samples
+    scoring above k near 1/k**2 at worst, whatever the distribution. If more than `reseed_rate` of recent samples are still
+    flagged, the estimate is considered stale and is seeded again.
+    """
+
+    kind = "mad"
+    source = "Statistical"
+    escalate = True
+
+    def __init__(self, window=60, k=3.5, min_mad=1e-6, min_scale=0.0, reseed_rate=0.2):
+        self.window = window
+        self.k = k
+        self.min_mad = min_mad
+        self.min_scale = min_scale
+        self.reseed_rate = reseed_rate
+        self.rate = 2.0 / max(window, 2)
+        self.median = None
+        self.mad = None
+        self.mean_sq_dev = None
+        self.flag_rate = 0.0
+        self._seed = []
+
+    @staticmethod
+    def _median(values):
+        values = sorted(values)
+        n = len(values)
+        mid = n // 2
+        return values[mid] if n % 2 else (values[mid - 1] + values[mid]) / 2.0
+
+    def update(self, value, ts=None):
+        if self.median is None:
+            self._seed.append(value)
+            if len(self._seed) >= max(self.window // 2, 1):
+                self.median = self._median(self._seed)
+                devs = [abs(v - self.median) for v in self._seed]
+                self.mad = self._median(devs)
+                self.mean_sq_dev = sum(d * d for d in devs) / len(devs)
+                self.flag_rate = 0.0
+                self._seed = None
+            return False, 0.0
+
+        # 1.4826 scales MAD to a standard deviation for normal data
+        scale = max(1.4826 * self.mad, math.sqrt(self.mean_sq_dev), self.min_scale, self.min_mad)
+        dev = abs(value - self.median)
+        score = dev / scale
+        step = self.rate * scale
+        if value != self.median:
+            self.median += step if value > self.median else -step
+        if dev != self.mad:
+            self.mad = max(0.0, self.mad + (step if dev > self.mad else -step))
+        self.mean_sq_dev += self.rate * (dev * dev - self.mean_sq_dev)
+
+        flagged = score > self.k
+        self.flag_rate += self.rate * (flagged - self.flag_rate)
+        if self.flag_rate > self.reseed_rate:
+            # Collapsed or stale estimate: start over from fresh samples
+            self.median = None
+            self._seed = []
+        return flagged, score
+
+
+class SeasonalBaselineDetector:
+    kind = "seasonal"
+    source = "Statistical"
+    escalate = True
+
+    def __init__(self, buckets=24, alpha=0.05, z=3.0, warmup=10, min_std=1e-6):
+        self.buckets = buckets
+        self.alpha = alpha
+        self.z = z
+        self.warmup = warmup
+        self.min_std = min_std
+        self._state = {}   # bucket -> [mean, var, n]
+
+    def _bucket(self, ts):
+        ts = ts or datetime.now()
+        seconds = ts.hour * 3600 + ts.minute * 60 + ts.second
+        return int(seconds * self.buckets / 86400)
+
+    def update(self, value, ts=None):
+        state = self._state.setdefault(self._bucket(ts), [value, 0.0, 0])
+        mean, var, n = state
+        diff = value - mean
+        score = abs(diff) / max(math.sqrt(var), self.min_std) if n else 0.0
+        state[0] = mean + self.alpha * diff
+        state[1] = (1 - self.alpha) * (var + self.alpha * diff * diff)
+        state[2] = n + 1
+        return n >= self.warmup and score > self.z, score
+
+
+DETECTOR_TYPES = {
+    cls.kind: cls for cls in (ThresholdDetector, EWMADetector, RollingMADDetector, SeasonalBaselineDetector)
+}
+
+
+# ---------- PIPELINE ----------
+class DetectorPipeline:
+    def __init__(self, config):
+        """`config` maps metric name -> list of {"type": ..., **params}."""
+        self.detectors = {}
+        for metric, specs in config.items():
+            built = []
+            for spec in specs:
+                spec = dict(spec)
+                kind = spec.pop("type")
+                if kind not in DETECTOR_TYPES:
+                    raise ValueError(f"Unknown detector type '{kind}' for {metric}")
+                built.append(DETECTOR_TYPES[kind](**spec))
+            self.detectors[metric] = built
+
+    def evaluate(self, sample, ts=None):
+        """Update every detector with the sample; return the findings that fired."""
+        findings = []
+        for metric, detectors in self.detectors.items():
+            raw = sample.get(metric)
+            if raw is None or raw == "":
+                continue
+            value = float(raw)
+            for det in detectors:
+                flagged, score = det.update(value, ts)
+                if not flagged:
+                    continue
+                if det.source == "Rule-Based":
+                    severity = det.severity
+                else:
+                    severity = severity_for(score)
+                findings.append(Finding(metric, det.kind, value, score, severity, det.source, det.escalate))
+        return findings
+
+
+def load_config(path=None):
+    path = path or os.environ.get("DETECTOR_CONFIG", DEFAULT_CONFIG_PATH)
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_pipeline(path=None):
+    return DetectorPipeline(load_config(path))
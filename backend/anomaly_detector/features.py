@@ -0,0 +1,39 @@
+# features.py
+"""
+Shared metric/feature names for the collector, the fleet agent and the models.
+
+Kept free of third-party imports so training scripts, the inference module
+and app.py can all import it cheaply.
+"""
+
+# Original three features; models trained before the extended set still use these.
+LEGACY_FEATURES = ["cpu_percent", "ram_percent", "disk_percent"]
+
+# Backup-relevant I/O and worker-process features (rates are per second).
+IO_FEATURES = [
+    "disk_read_bps",
+    "disk_write_bps",
+    "disk_read_iops",
+    "disk_write_iops",
+    "net_sent_bps",
+    "net_recv_bps",
+    "mount_max_percent",
+    "backup_proc_cpu",
+    "backup_proc_rss_mb",
+]
+
+FEATURES = LEGACY_FEATURES + IO_FEATURES
+
+# Column layout of sample_metrics.csv
+METRICS_HEADER = ["timestamp"] + FEATURES
+
+
+def feature_vector(sample, features=FEATURES):
+    """Return the sample's values for `features`, treating missing/blank as 0."""
+    row = []
+    for name in features:
+        try:
+            row.append(float(sample.get(name) or 0.0))
+        except (TypeError, ValueError):
+            row.append(0.0)
+    return row
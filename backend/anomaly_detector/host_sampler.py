@@ -0,0 +1,138 @@
+# host_sampler.py
+"""
+Low-overhead host sampler shared by metrics_collector and collector_agent.
+
+Each call to `snapshot()` takes one non-blocking reading: CPU uses
+psutil's delta-since-last-call mode instead of sleeping, disk/network
+throughput and IOPS are computed from counter deltas against the previous
+snapshot, and the expensive lookups (mount list, backup worker processes)
+are cached and only refreshed every few ticks.
+"""
+
+import os
+import time
+from datetime import datetime
+
+import psutil
+
+# Process names treated as backup workers (override with BACKUP_PROCESS_NAMES=a,b,c)
+DEFAULT_BACKUP_PROCESSES = "rsync,restic,borg,tar,duplicity,rclone,mysqldump,pg_dump"
+
+MOUNT_REFRESH_TICKS = 60
+PROCESS_REFRESH_TICKS = 12
+
+_IGNORED_FSTYPES = {"squashfs", "tmpfs", "devtmpfs", "overlay", "proc", "sysfs", "cgroup", "cgroup2"}
+
+
+class HostSampler:
+    def __init__(self, backup_processes=None):
+        names = backup_processes or os.environ.get("BACKUP_PROCESS_NAMES", DEFAULT_BACKUP_PROCESSES)
+        if isinstance(names, str):
+            names = names.split(",")
+        self.backup_processes = {n.strip().lower() for n in names if n.strip()}
+
+        self._tick = 0
+        self._mounts = []
+        self._procs = []
+        self._prev_time = time.monotonic()
+        self._prev_disk = psutil.disk_io_counters()
+        self._prev_net = psutil.net_io_counters()
+
+        # Prime delta-based counters so the first snapshot is meaningful.
+        psutil.cpu_percent(interval=None)
+        self._refresh_mounts()
+        self._refresh_processes()
+
+    # ---------- CACHED LOOKUPS ----------
+    def _refresh_mounts(self):
+        mounts = []
+        for part in psutil.disk_partitions(all=False):
+            if part.fstype in _IGNORED_FSTYPES or part.mountpoint in mounts:
+                continue
+            mounts.append(part.mountpoint)
+        self._mounts = mounts or ["/"]
+
+    def _refresh_processes(self):
+        if not self.backup_processes:
+            self._procs = []
+            return
+        procs = []
+        for p in psutil.process_iter(["name"]):
+            name = (p.info.get("name") or "").lower()
+            if name in self.backup_processes:
+                try:
+                    p.cpu_percent(interval=None)  # prime per-process counter
+                    procs.append(p)
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    pass
+        self._procs = procs
+
+    # ---------- SAMPLING ----------
+    @staticmethod
+    def _rate(curr, prev, attr, elapsed):
+        if curr is None or prev is None:
+            return 0.0
+        delta = getattr(curr, attr) - getattr(prev, attr)
+        # Counters can wrap or reset (e.g. device hot-plug); never report negatives.
+        return round(max(delta, 0) / elapsed, 2)
+
+    def _mount_usage(self):
+        usage = {}
+        for mount in self._mounts:
+            try:
+                usage[mount] = psutil.disk_usage(mount).percent
+            except OSError:
+                continue
+        return usage
+
+    def _backup_process_usage(self):
+        cpu, rss = 0.0, 0
+        alive = []
+        for p in self._procs:
+            try:
+                with p.oneshot():
+                    cpu += p.cpu_percent(interval=None)
+                    rss += p.memory_info().rss
+                alive.append(p)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        self._procs = alive
+        return round(cpu, 2), round(rss / (1024 * 1024), 2)
+
+    def snapshot(self):
+        """Return one non-blocking sample as a dict keyed by feature name."""
+        self._tick += 1
+        if self._tick % MOUNT_REFRESH_TICKS == 0:
+            self._refresh_mounts()
+        if self._tick % PROCESS_REFRESH_TICKS == 0:
+            self._refresh_processes()
+
+        now = time.monotonic()
+        elapsed = max(now - self._prev_time, 1e-6)
+        disk_io = psutil.disk_io_counters()
+        net_io = psutil.net_io_counters()
+        prev_disk, prev_net = self._prev_disk, self._prev_net
+        self._prev_time, self._prev_disk, self._prev_net = now, disk_io, net_io
+
+        mounts = self._mount_usage()
+        root_percent = mounts.get("/")
+        if root_percent is None:
+            root_percent = psutil.disk_usage("/").percent
+        proc_cpu, proc_rss_mb = self._backup_process_usage()
+
+        return {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "ram_percent": psutil.virtual_memory().percent,
+            "disk_percent": root_percent,
+            "disk_read_bps": self._rate(disk_io, prev_disk, "read_bytes", elapsed),
+            "disk_write_bps": self._rate(disk_io, prev_disk, "write_bytes", elapsed),
+            "disk_read_iops": self._rate(disk_io, prev_disk, "read_count", elapsed),
+            "disk_write_iops": self._rate(disk_io, prev_disk, "write_count", elapsed),
+            "net_sent_bps": self._rate(net_io, prev_net, "bytes_sent", elapsed),
+            "net_recv_bps": self._rate(net_io, prev_net, "bytes_recv", elapsed),
+            "mount_max_percent": max(mounts.values()) if mounts else root_percent,
+            "backup_proc_cpu": proc_cpu,
+            "backup_proc_rss_mb": proc_rss_mb,
+            "mounts": mounts,
+        }
@@ -0,0 +1,152 @@
+# incidents.py
+"""
+Anomaly incident engine.
+
+Consecutive anomalous samples for the same (source, metric) are merged into
+one open incident that tracks start, end, peak value and sample count. The
+tracker only produces three kinds of events:
+
+    open    first anomalous sample for a key
+    update  peak or severity grew (throttled to one per UPDATE_INTERVAL; growth
+            inside the window is held back and sent once it expires)
+    close   no anomalous sample for CLOSE_AFTER seconds
+
+so a CPU spike lasting an hour becomes two log rows instead of ~700.
+"""
+
+import os
+import csv
+import time
+import itertools
+from datetime import datetime
+
+from anomaly_detector.csv_lock import locked
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INCIDENT_LOG_PATH = os.path.join(BASE_DIR, "incident_log.csv")
+
+INCIDENT_HEADER = [
+    "incident_id", "status", "source", "metric", "start", "end",
+    "peak", "samples", "severity", "cpu_percent", "ram_percent", "disk_percent",
+]
+
+CLOSE_AFTER = 30        # seconds without an anomalous sample before closing
+UPDATE_INTERVAL = 60    # minimum seconds between update events per incident
+
+SEVERITY_RANK = {"Low": 0, "Medium": 1, "High": 2}
+
+
+def _fmt(epoch):
+    return datetime.fromtimestamp(epoch).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class Incident:
+    def __init__(self, incident_id, source, metric, value, severity, now, context):
+        self.incident_id = incident_id
+        self.source = source
+        self.metric = metric
+        self.start = now
+        self.last_seen = now
+        self.peak = value
+        self.samples = 1
+        self.severity = severity
+        self.status = "open"
+        self.context = dict(context or {})
+        self._last_update = now
+        self._dirty = False  # grew since the last open/update event
+
+    def to_dict(self):
+        return {
+            "incident_id": self.incident_id,
+            "status": self.status,
+            "source": self.source,
+            "metric": self.metric,
+            "start": _fmt(self.start),
+            "end": _fmt(self.last_seen),
+            "peak": round(self.peak, 5),
+            "samples": self.samples,
+            "severity": self.severity,
+            "duration_s": round(self.last_seen - self.start, 1),
+            **self.context,
+        }
+
+
+class IncidentTracker:
+    def __init__(self, close_after=CLOSE_AFTER, update_interval=UPDATE_INTERVAL, clock=time.time):
+        self.close_after = close_after
+        self.update_interval = update_interval
+        self.clock = clock
+        self.open = {}
+        # Prefix with start time so ids stay unique across collector restarts
+        self._ids = itertools.count(1)
+        self._prefix = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    def observe(self, source, metric, value, severity, context=None, now=None):
+        """Record one anomalous sample. Returns ("open"|"update", incident) or None."""
+        now = self.clock() if now is None else now
+        key = (source, metric)
+        inc = self.open.get(key)
+
+        if inc is None:
+            inc = Incident(f"{self._prefix}-{next(self._ids)}", source, metric, value, severity, now, context)
+            self.open[key] = inc
+            return "open", inc
+
+        inc.last_seen = now
+        inc.samples += 1
+        grew = False
+        if value > inc.peak:
+            inc.peak = value
+            inc.context.update(context or {})
+            grew = True
+        if SEVERITY_RANK.get(severity, 0) > SEVERITY_RANK.get(inc.severity, 0):
+            inc.severity = severity
+            grew = True
+        inc._dirty = inc._dirty or grew
+
+        return self._due_update(inc, now)
+
+    def _due_update(self, inc, now):
+        if inc._dirty and now - inc._last_update >= self.update_interval:
+            inc._last_update = now
+            inc._dirty = False
+            return "update", inc
+        return None
+
+    def sweep(self, now=None):
+        """Close incidents quiet for `close_after` seconds, and send updates held back by the throttle."""
+        now = self.clock() if now is None else now
+        events = []
+        for key, inc in list(self.open.items()):
+            if now - inc.last_seen >= self.close_after:
+                inc.status = "closed"
+                del self.open[key]
+                events.append(("close", inc))
+            else:
+                event = self._due_update(inc, now)
+                if event:
+                    events.append(event)
+        return events
+
+    def close_all(self):
+        closed = []
+        for inc in self.open.values():
+            inc.status = "closed"
+            closed.append(("close", inc))
+        self.open.clear()
+        return closed
+
+
+def append_incident_rows(rows, path=INCIDENT_LOG_PATH):
+    """Persist open/close records; readers keep the last row per incident_id."""
+    with locked(path):
+        new_file = not os.path.exists(path)
+        with open(path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=INCIDENT_HEADER, extrasaction="ignore")
+            if new_file:
+                writer.writeheader()
+            writer.writerows(rows)
+
+
+def append_incident(inc, path=INCIDENT_LOG_PATH):
+    append_incident_rows([inc.to_dict()], path)
@@ -1,38 +1,141 @@
 import os
-import numpy as np
-import joblib
+import json
+import time
+import threading
 import pickle
-import keras
-from keras.saving import load_model
+import numpy as np
+
+from anomaly_detector.features import LEGACY_FEATURES, feature_vector
+
+try:
+    from instrumentation import INFERENCE_LATENCY, INFERENCE_RESULTS
+except ImportError:  # imported from outside backend/ (notebooks, training scripts)
+    INFERENCE_LATENCY = INFERENCE_RESULTS = None
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_PATH = os.path.join(BASE_DIR, "lstm_model.keras")
 SCALER_PATH = os.path.join(BASE_DIR, "scaler.pkl")
 THRESH_PATH = os.path.join(BASE_DIR, "threshold.pkl")
 
+# Written atomically by retrainer.py; points at the currently promoted model version
+CURRENT_POINTER_PATH = os.path.join(BASE_DIR, "current_model.json")
+RELOAD_CHECK_SECONDS = 30
+
 WINDOW_SIZE = 12
 
-_model = None
-_scaler = None
-_th = None
+# (model, scaler, threshold_dict, version) — replaced as a whole so a
+# prediction never mixes a new model with an old scaler or threshold.
+_bundle = None
+_pointer_mtime = None
+_last_check = 0.0
+_reload_lock = threading.Lock()
+_reloading = False
+
+def _read_pointer():
+    try:
+        with open(CURRENT_POINTER_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _pointer_stat():
+    try:
+        return os.stat(CURRENT_POINTER_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+def load_bundle(pointer=None):
+    """Load model, scaler and threshold for `pointer` (or the default artifacts)."""
+    model_path = os.path.join(BASE_DIR, pointer["model"]) if pointer else MODEL_PATH
+    scaler_path = os.path.join(BASE_DIR, pointer["scaler"]) if pointer else SCALER_PATH
+    thresh_path = os.path.join(BASE_DIR, pointer["threshold"]) if pointer else THRESH_PATH
+
+    # Keras/TensorFlow take seconds to import; defer them to the first model load
+    import joblib
+    from keras.saving import load_model
+
+    scaler = joblib.load(scaler_path)
+    model = load_model(model_path, compile=False)
+    with open(thresh_path, "rb") as f:
+        th = pickle.load(f)
+    return model, scaler, th, (pointer or {}).get("version", "base")
+
+def swap_bundle(model, scaler, th, version):
+    """Atomically replace the in-process model; in-flight predictions finish on the old one."""
+    global _bundle
+    _bundle = (model, scaler, th, version)
+
+def _background_reload(mtime):
+    global _pointer_mtime, _reloading
+    try:
+        pointer = _read_pointer()
+        if pointer:
+            swap_bundle(*load_bundle(pointer))
+        _pointer_mtime = mtime
+    except Exception as e:
+        print("[ML reload error]", str(e))
+    finally:
+        _reloading = False
+
+def _check_for_new_version():
+    """Cheap stat of the pointer file; a changed model is loaded off the hot path."""
+    global _last_check, _reloading
+    now = time.monotonic()
+    if now - _last_check < RELOAD_CHECK_SECONDS:
+        return
+    _last_check = now
+
+    mtime = _pointer_stat()
+    if mtime is None or mtime == _pointer_mtime:
+        return
+    with _reload_lock:
+        if _reloading:
+            return
+        _reloading = True
+    threading.Thread(target=_background_reload, args=(mtime,), daemon=True).start()
 
 def _ensure_loaded():
-    global _model, _scaler, _th
+    global _pointer_mtime
 
-    if _scaler is None:
-        _scaler = joblib.load(SCALER_PATH)
+    if _bundle is None:
+        with _reload_lock:
+            if _bundle is None:
+                mtime = _pointer_stat()
+                swap_bundle(*load_bundle(_read_pointer() if mtime else None))
+                _pointer_mtime = mtime
+    else:
+        _check_for_new_version()
+    return _bundle
 
-    if _model is None:
-        _model = load_model(MODEL_PATH, compile=False)
+def warm_up():
+    """Import Keras and load the model ahead of the first prediction."""
+    try:
+        _ensure_loaded()
+        return True
+    except Exception as e:
+        print("[ML warm-up skipped]", str(e))
+        return False
 
-    if _th is None:
-        with open(THRESH_PATH, "rb") as f:
-            _th = pickle.load(f)
+def current_version():
+    return _ensure_loaded()[3]
 
-def detect_anomaly(cpu, ram, disk, recent_buffer=None):
-    _ensure_loaded()
+def model_features():
+    """Feature names the loaded model was trained on (older models: cpu/ram/disk)."""
+    _, _, th, _ = _ensure_loaded()
+    return list(th.get("features", LEGACY_FEATURES))
 
-    sample = np.array([cpu, ram, disk], dtype=float).reshape(1, -1)
+def _score(bundle, sample, recent_buffer):
+    if INFERENCE_LATENCY is None:
+        return _predict(bundle, sample, recent_buffer)
+    start = time.perf_counter()
+    label, mse = _predict(bundle, sample, recent_buffer)
+    INFERENCE_LATENCY.observe(time.perf_counter() - start, model=bundle[3] or "default")
+    INFERENCE_RESULTS.inc(label=label)
+    return label, mse
+
+def _predict(bundle, sample, recent_buffer):
+    model, scaler, th, _ = bundle
+    sample = np.asarray(sample, dtype=float).reshape(1, -1)
 
     if recent_buffer is None:
         recent_buffer = np.tile(sample, (WINDOW_SIZE, 1))
@@ -43,15 +146,27 @@ def detect_anomaly(cpu, ram, disk, recent_buffer=None):
             arr = np.vstack([pad, arr])
         recent_buffer = arr[-WINDOW_SIZE:]
 
-    scaled_window = _scaler.transform(recent_buffer)
+    scaled_window = scaler.transform(recent_buffer)
     X = np.expand_dims(scaled_window, axis=0)
 
-    pred_scaled = _model.predict(X, verbose=0)
-    pred = pred_scaled[0] * _scaler.scale_ + _scaler.mean_
+    pred_scaled = model.predict(X, verbose=0)
+    pred = pred_scaled[0] * scaler.scale_ + scaler.mean_
     actual = sample.flatten()
 
     mse = float(np.mean((pred - actual) ** 2))
-    threshold = _th["threshold"]
+    threshold = th["threshold"]
 
     label = "Anomaly" if mse > threshold else "Normal"
     return label, mse
+
+def detect_anomaly_sample(sample, recent_samples=None):
+    """Score a sample dict (and optional recent sample dicts) on the model's own feature set."""
+    bundle = _ensure_loaded()
+    features = list(bundle[2].get("features", LEGACY_FEATURES))
+    window = None
+    if recent_samples:
+        window = [feature_vector(s, features) for s in recent_samples]
+    return _score(bundle, feature_vector(sample, features), window)
+
+def detect_anomaly(cpu, ram, disk, recent_buffer=None):
+    return _score(_ensure_loaded(), [cpu, ram, disk], recent_buffer)
@@ -19,6 +19,11 @@ from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import LSTM, Dense, Dropout
 from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint
 
+try:
+    from anomaly_detector.features import FEATURES, LEGACY_FEATURES
+except ImportError:  # run as a script from inside anomaly_detector/
+    from features import FEATURES, LEGACY_FEATURES
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CSV_PATH = os.path.join(BASE_DIR, "sample_metrics.csv")
 MODEL_PATH = os.path.join(BASE_DIR, "lstm_model.h5")
@@ -36,7 +41,7 @@ def load_csv(path=CSV_PATH):
     df = pd.read_csv(path, parse_dates=["timestamp"])
     # Keep only required columns and ensure order
     df = df.sort_values("timestamp").reset_index(drop=True)
-    cols = ["cpu_percent", "ram_percent", "disk_percent"]
+    cols = list(LEGACY_FEATURES)
     # If dataset has different naming, try lowercase variants:
     for c in cols:
         if c not in df.columns:
@@ -45,7 +50,10 @@ def load_csv(path=CSV_PATH):
                 if alt in df.columns:
                     df[c] = df[alt]
                     break
-    return df[cols].astype(float)
+    # Extended I/O features are used only when the collector has recorded them
+    if all(c in df.columns for c in FEATURES) and df[FEATURES].notna().any().all():
+        cols = list(FEATURES)
+    return df[cols].fillna(0.0).astype(float)
 
 def create_sequences(values, window=WINDOW_SIZE):
     X, y = [], []
@@ -105,7 +113,8 @@ def train():
 
     # Save threshold
     with open(THRESH_PATH, "wb") as f:
-        pickle.dump({"mean": mean_err, "std": std_err, "threshold": threshold}, f)
+        pickle.dump({"mean": mean_err, "std": std_err, "threshold": threshold,
+                     "features": list(df.columns)}, f)
 
     print(f"[+] Saved model to {MODEL_PATH}")
     print(f"[+] Threshold: mean={mean_err:.6f}, std={std_err:.6f}, threshold={threshold:.6f}")
@@ -113,7 +122,8 @@ def train():
     return {
         "model_path": MODEL_PATH,
         "scaler_path": SCALER_PATH,
-        "threshold": {"mean": mean_err, "std": std_err, "threshold": threshold}
+        "threshold": {"mean": mean_err, "std": std_err, "threshold": threshold},
+        "features": list(df.columns)
     }
 
 if __name__ == "__main__":
@@ -10,6 +10,11 @@ import tensorflow as tf
 from tensorflow import keras
 from keras import layers
 
+try:
+    from anomaly_detector.features import FEATURES, LEGACY_FEATURES
+except ImportError:  # run as a script from inside anomaly_detector/
+    from features import FEATURES, LEGACY_FEATURES
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CSV_PATH = os.path.join(BASE_DIR, "sample_metrics.csv")
 MODEL_PATH = os.path.join(BASE_DIR, "lstm_model.keras")
@@ -22,11 +27,17 @@ BATCH_SIZE = 32
 TEST_SIZE = 0.2
 RANDOM_STATE = 42
 
+def select_features(df):
+    """Use the extended feature set when the CSV has it, else the legacy three."""
+    if all(c in df.columns for c in FEATURES) and df[FEATURES].notna().any().all():
+        return list(FEATURES)
+    return list(LEGACY_FEATURES)
+
 def load_csv(path=CSV_PATH):
     df = pd.read_csv(path, parse_dates=["timestamp"])
     df = df.sort_values("timestamp").reset_index(drop=True)
-    cols = ["cpu_percent", "ram_percent", "disk_percent"]
-    return df[cols].astype(float)
+    cols = select_features(df)
+    return df[cols].fillna(0.0).astype(float)
 
 def create_sequences(values, window=WINDOW_SIZE):
     X, y = [], []
@@ -100,10 +111,11 @@ def train():
     threshold = mean_err + 3 * std_err
 
     with open(THRESH_PATH, "wb") as f:
-        pickle.dump({"mean": mean_err, "std": std_err, "threshold": threshold}, f)
+        pickle.dump({"mean": mean_err, "std": std_err, "threshold": threshold,
+                     "features": list(df.columns)}, f)
 
     print(f"[+] Saved threshold → {THRESH_PATH}")
-    print(f"📌 mean={mean_err}, std={std_err}, threshold={threshold}")
+    print(f"📌 mean={mean_err}, std={std_err}, threshold={threshold}, features={list(df.columns)}")
 
 if __name__ == "__main__":
     train()
@@ -1,216 +1,403 @@
-# metrics_collector.py (updated)
-import time, csv, os, psutil, socketio
-from datetime import datetime
-from anomaly_detector.lstm_inference import WINDOW_SIZE, detect_anomaly as detect_anomaly_ml
+# metrics_collector.py (asyncio pipeline)
+"""
+Metrics collector built as four asyncio stages joined by bounded queues:
+
+    sample ──► detect ──► persist
+       │          └─────► ship
+       ├────────────────► persist
+       └────────────────► ship
+
+* sample   takes one non-blocking snapshot on an absolute schedule
+           (next_tick += interval), so the period never drifts.
+* detect   runs the streaming detectors inline and sends escalated windows
+           to the LSTM on a dedicated thread.
+* persist  batches CSV appends and writes them on its own thread.
+* ship     pushes Socket.IO events on its own thread and reconnects lazily.
+
+Queues drop their oldest item when full, so a slow model, disk or network
+loses stale data instead of delaying the next sample.
+
+Usage (from backend/):
+    python -m anomaly_detector.metrics_collector
+"""
+
+import os
+import csv
+import time
+import asyncio
 import traceback
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import socketio
+
+from anomaly_detector.lstm_inference import WINDOW_SIZE, warm_up, detect_anomaly_sample as detect_anomaly_ml
+from anomaly_detector.features import METRICS_HEADER
+from anomaly_detector.host_sampler import HostSampler
+from anomaly_detector.detectors import load_pipeline
+from anomaly_detector.csv_lock import locked
+from anomaly_detector.incidents import IncidentTracker, SEVERITY_RANK, append_incident_rows
 
 # ===== File Setup =====
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 csv_path = os.path.join(BASE_DIR, "sample_metrics.csv")
 log_path = os.path.join(BASE_DIR, "anomaly_log.csv")
 
-if not os.path.exists(csv_path):
-    with open(csv_path, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["timestamp", "cpu_percent", "ram_percent", "disk_percent"])
+SERVER_URL = os.environ.get("TRACKER_SERVER", "http://127.0.0.1:5050")
+SAMPLE_INTERVAL = 5         # seconds
+QUEUE_SIZE = 256            # per stage; oldest items are dropped beyond this
+PERSIST_BATCH = 64          # max rows per CSV write
+RECONNECT_INTERVAL = 10     # seconds between Socket.IO connect attempts
+# Serve inference metrics at :PORT/metrics when set (this process has no Flask app)
+METRICS_PORT = int(os.environ.get("COLLECTOR_METRICS_PORT", 0))
+METRICS_HOST = os.environ.get("COLLECTOR_METRICS_HOST", "127.0.0.1")
 
 # Ensure consistent anomaly_log header
 ANOMALY_HEADER = ["timestamp", "source", "metric", "value", "cpu_percent", "ram_percent", "disk_percent", "severity", "trend"]
 
-if not os.path.exists(log_path):
-    with open(log_path, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(ANOMALY_HEADER)
+# Dashboard names for the original metrics; other features keep their column name
+METRIC_LABELS = {"cpu_percent": "CPU", "ram_percent": "RAM", "disk_percent": "Disk"}
+
+
+def ensure_metrics_header(path):
+    """Create the metrics CSV, or upgrade an older column layout to METRICS_HEADER."""
+    if not os.path.exists(path):
+        with open(path, "w", newline="") as f:
+            csv.writer(f).writerow(METRICS_HEADER)
+        return
+
+    with open(path, newline="") as f:
+        header = next(csv.reader(f), None)
+    if header == METRICS_HEADER:
+        return
+
+    # One-off rewrite; new columns are left blank for historical rows
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=METRICS_HEADER, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, path)
+
+
+def ensure_anomaly_header(path):
+    if not os.path.exists(path):
+        with open(path, "w", newline="") as f:
+            csv.writer(f).writerow(ANOMALY_HEADER)
+
 
-# ===== Connect to Flask Socket =====
-sio = socketio.Client(reconnection=True, reconnection_attempts=5, reconnection_delay=2)
+def ml_severity(label, score):
+    # Severity mapping for ML score (if ML produced a score)
+    if label != "Anomaly":
+        return "Low"
+    if score > 0.7:
+        return "High"
+    if score > 0.4:
+        return "Medium"
+    return "Low"
 
-@sio.event
-def connect():
-    print("✅ Connected to Flask server!")
 
-@sio.event
-def disconnect():
-    print("❌ Disconnected from server")
+def write_batch(batch):
+    """Append a batch of (kind, row) items with one open per file."""
+    metrics, anomalies, incidents = [], [], []
+    for kind, row in batch:
+        if kind == "metrics":
+            metrics.append(row)
+        elif kind == "anomaly":
+            anomalies.append(row)
+        elif kind == "incident":
+            incidents.append(row)
 
-try:
-    sio.connect("http://127.0.0.1:5050")
-except Exception as e:
-    print("❌ Could not connect. Start app.py first.", str(e))
-    # don't exit: allow offline mode (still write CSV logs)
-    # exit()
+    if metrics:
+        with locked(csv_path), open(csv_path, "a", newline="") as f:
+            csv.writer(f).writerows(metrics)
+    if anomalies:
+        with locked(log_path), open(log_path, "a", newline="") as f:
+            csv.writer(f).writerows(anomalies)
+    if incidents:
+        append_incident_rows(incidents)
 
-print("📊 Starting extended metrics collector...")
 
 # ==========================================================
-#               METRICS COLLECTION LOOP
+#                  ASYNC COLLECTOR PIPELINE
 # ==========================================================
-def collect_metrics():
-    previous_score = None
+class AsyncCollector:
+    def __init__(self, interval=SAMPLE_INTERVAL, server=SERVER_URL, queue_size=QUEUE_SIZE):
+        self.interval = interval
+        self.server = server
+        self.sampler = HostSampler()
+        # Cheap streaming detectors; only flagged ticks escalate to the LSTM
+        self.pipeline = load_pipeline()
+        # Consecutive anomalous ticks are merged into one incident per (source, metric)
+        self.incidents = IncidentTracker()
+        # Sliding ML window kept in memory instead of re-reading the CSV every tick
+        self.recent = deque(maxlen=WINDOW_SIZE)
+        self.previous_score = None
+
+        self.detect_q = asyncio.Queue(queue_size)
+        self.persist_q = asyncio.Queue(queue_size)
+        self.ship_q = asyncio.Queue(queue_size)
+        self.dropped = Counter()
+        self.late_ticks = 0
+
+        # One thread per blocking resource so they never wait on each other
+        self.ml_executor = ThreadPoolExecutor(1, thread_name_prefix="ml")
+        self.io_executor = ThreadPoolExecutor(1, thread_name_prefix="persist")
+        self.net_executor = ThreadPoolExecutor(1, thread_name_prefix="ship")
+
+        self.sio = socketio.Client(reconnection=True, reconnection_attempts=5, reconnection_delay=2)
+        self._last_connect = 0.0
 
-    while True:
+    # ---------- QUEUE HELPERS ----------
+    def offer(self, queue, item, name):
+        """Non-blocking put; drop the oldest queued item when the stage is behind."""
         try:
-            cpu = psutil.cpu_percent(interval=1)
-            ram = psutil.virtual_memory().percent
-            disk = psutil.disk_usage("/").percent
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-            # -------- Write live metrics to CSV --------
-            with open(csv_path, "a", newline="") as f:
-                writer = csv.writer(f)
-                writer.writerow([timestamp, cpu, ram, disk])
-
-            # -------- Load sliding ML window (if available) --------
-            def load_recent_buffer(window=WINDOW_SIZE):
-                try:
-                    import pandas as pd
-                    df = pd.read_csv(csv_path, parse_dates=["timestamp"])
-                    df = df.sort_values("timestamp")
-                    vals = df[["cpu_percent", "ram_percent", "disk_percent"]].tail(window).values
-                    if vals.shape[0] == window:
-                        return vals
-                    return None
-                except Exception:
-                    return None
-
-            recent_buf = load_recent_buffer(WINDOW_SIZE)
-
-            # -------- ML anomaly detection (robust) --------
-            label, score = "Normal", 0.0
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            queue.put_nowait(item)
+            self.dropped[name] += 1
+
+    # ---------- STAGE 1: SAMPLING ----------
+    async def sample_loop(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
             try:
-                lab, sc = detect_anomaly_ml(cpu, ram, disk, recent_buf)
-                label, score = lab, float(sc)
-            except FileNotFoundError as e:
+                # One non-blocking snapshot (CPU, memory, disk/net I/O rates, mounts, backup workers)
+                sample = self.sampler.snapshot()
+                self.recent.append(sample)
+                window = list(self.recent) if len(self.recent) == WINDOW_SIZE else None
+
+                self.offer(self.persist_q, ("metrics", [sample.get(col, "") for col in METRICS_HEADER]), "persist")
+                self.offer(self.detect_q, (sample, window), "detect")
+                self.offer(self.ship_q, ("metrics_update", {
+                    "timestamp": sample["timestamp"],
+                    "cpu": sample["cpu_percent"],
+                    "ram": sample["ram_percent"],
+                    "disk": sample["disk_percent"],
+                    "disk_read_bps": sample["disk_read_bps"],
+                    "disk_write_bps": sample["disk_write_bps"],
+                    "net_sent_bps": sample["net_sent_bps"],
+                    "net_recv_bps": sample["net_recv_bps"],
+                    "mounts": sample["mounts"]
+                }), "ship")
+            except Exception as e:
+                print("[Sampler error]", e)
+                traceback.print_exc()
+
+            # Absolute schedule: work time never accumulates into the period
+            next_tick += self.interval
+            delay = next_tick - loop.time()
+            if delay < 0:
+                # Overran a whole tick (e.g. host suspended); skip ahead instead of bursting
+                missed = int(-delay // self.interval) + 1
+                self.late_ticks += missed
+                next_tick += missed * self.interval
+                delay = next_tick - loop.time()
+            await asyncio.sleep(delay)
+
+    # ---------- STAGE 2: DETECTION ----------
+    async def detect_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            sample, window = await self.detect_q.get()
+            try:
+                await self._detect(loop, sample, window)
+            except Exception as e:
+                print("[Detection error]", e)
+                traceback.print_exc()
+
+    async def _detect(self, loop, sample, window):
+        findings = self.pipeline.evaluate(sample)
+
+        # -------- ML anomaly detection (robust, escalated ticks only) --------
+        # Static rule hits alone do not escalate (see detectors.py)
+        label, score = "Skipped", 0.0
+        if any(f.escalate for f in findings):
+            try:
+                label, score = await loop.run_in_executor(self.ml_executor, detect_anomaly_ml, sample, window)
+                score = float(score)
+            except FileNotFoundError:
                 # model/scaler not available — keep ML disabled but continue
-                # print minimal message but continue with rule-based
-                # print("ML assets missing, skipping ML detection:", e)
                 label, score = "ModelMissing", 0.0
             except Exception as e:
                 print("[ML detection error]", str(e))
-                traceback.print_exc()
                 label, score = "Error", 0.0
 
-            # Severity mapping for ML score (if ML produced a score)
-            if label == "Anomaly":
-                if score > 0.7:
-                    ml_sev = "High"
-                elif score > 0.4:
-                    ml_sev = "Medium"
-                else:
-                    ml_sev = "Low"
-            else:
-                ml_sev = "Low"
-
-            # Trend calculation
-            if previous_score is None:
-                trend = "Stable"
-            else:
-                trend = "Rising" if score > previous_score else "Falling"
-
-            previous_score = score
-
-            # ==========================================================
-            #                ML ANOMALY LOGGING (normalized schema)
-            # ==========================================================
-            # We always append a normalized row when ML says Anomaly (or ModelMissing for visibility)
-            if label == "Anomaly":
-                with open(log_path, "a", newline="") as logf:
-                    writer = csv.writer(logf)
-                    writer.writerow([
-                        timestamp,
-                        "ML",
-                        "Composite",                # metric: composite score
-                        round(score, 5),
-                        round(cpu, 2),
-                        round(ram, 2),
-                        round(disk, 2),
-                        ml_sev,
-                        trend
-                    ])
-                print(f"[ML] Logged anomaly at {timestamp}, score={score}")
-
-                # Emit ML detection to dashboard (if connected)
-                try:
-                    sio.emit("anomaly_alert", {
-                        "timestamp": timestamp,
-                        "source": "ML",
-                        "metric": "Composite",
-                        "value": round(score, 4),
-                        "cpu_percent": round(cpu,2),
-                        "ram_percent": round(ram,2),
-                        "disk_percent": round(disk,2),
-                        "severity": ml_sev,
-                        "trend": trend
-                    })
-                except Exception:
-                    pass
-
-            # ==========================================================
-            #         RULE-BASED ANOMALY LOGGING (same normalized schema)
-            # ==========================================================
-            # Rule thresholds (kept as before but written into same schema)
-            # NOTE: keep thresholds as project expects — you can adjust later
-            rule_triggered = False
-            rule_metric = None
-            rule_value = None
-
-            if cpu > 15:
-                rule_triggered = True; rule_metric = "CPU"; rule_value = cpu
-            elif ram > 95:
-                rule_triggered = True; rule_metric = "RAM"; rule_value = ram
-            elif disk > 30:
-                rule_triggered = True; rule_metric = "Disk"; rule_value = disk
-
-            if rule_triggered:
-                with open(log_path, "a", newline="") as logf:
-                    writer = csv.writer(logf)
-                    writer.writerow([
-                        timestamp,
-                        "Rule-Based",
-                        rule_metric,
-                        round(rule_value, 2),
-                        round(cpu, 2),
-                        round(ram, 2),
-                        round(disk, 2),
-                        "High",      # rule-based set to High severity
-                        "Stable"
-                    ])
-                print(f"🧾 Rule-based anomaly logged at {timestamp} ({rule_metric}={rule_value})")
-
-                try:
-                    sio.emit("anomaly_alert", {
-                        "timestamp": timestamp,
-                        "source": "Rule-Based",
-                        "metric": rule_metric,
-                        "value": round(rule_value, 2),
-                        "cpu_percent": round(cpu,2),
-                        "ram_percent": round(ram,2),
-                        "disk_percent": round(disk,2),
-                        "severity": "High",
-                        "trend": "Stable"
-                    })
-                except Exception:
-                    pass
-
-            # -------- Send live metrics (same as before, kept for live charts) --------
+        ml_sev = ml_severity(label, score)
+
+        # Trend calculation (only ticks that reached the model carry a score)
+        if self.previous_score is None or label == "Skipped":
+            trend = "Stable"
+        else:
+            trend = "Rising" if score > self.previous_score else "Falling"
+        if label != "Skipped":
+            self.previous_score = score
+
+        # -------- Incident tracking (open / update / close only) --------
+        context = {
+            "cpu_percent": round(sample["cpu_percent"], 2),
+            "ram_percent": round(sample["ram_percent"], 2),
+            "disk_percent": round(sample["disk_percent"], 2),
+            "trend": trend
+        }
+        events = []
+        seen = set()
+        # Several detectors may flag the same metric; count it once per tick, at its worst severity
+        for finding in sorted(findings, key=lambda f: -SEVERITY_RANK.get(f.severity, 0)):
+            metric = METRIC_LABELS.get(finding.metric, finding.metric)
+            if (finding.source, metric) in seen:
+                continue
+            seen.add((finding.source, metric))
+            events.append(self.incidents.observe(finding.source, metric, round(finding.value, 2),
+                                                 finding.severity, context))
+        if label == "Anomaly":
+            events.append(self.incidents.observe("ML", "Composite", round(score, 5), ml_sev, context))
+        events.extend(self.incidents.sweep())
+
+        for event in events:
+            if event:
+                self.publish_incident(*event)
+
+    def publish_incident(self, kind, incident):
+        """Queue persistence and broadcast of an incident open/update/close event."""
+        data = incident.to_dict()
+
+        if kind in ("open", "close"):
+            self.offer(self.persist_q, ("incident", data), "persist")
+
+        if kind == "open":
+            # One anomaly_log row per incident keeps /api/anomalies and the timeline working
+            self.offer(self.persist_q, ("anomaly", [
+                data["start"],
+                data["source"],
+                data["metric"],
+                data["peak"],
+                data.get("cpu_percent", ""),
+                data.get("ram_percent", ""),
+                data.get("disk_percent", ""),
+                data["severity"],
+                data.get("trend", "Stable")
+            ]), "persist")
+            self.offer(self.ship_q, ("anomaly_alert", {
+                "timestamp": data["start"],
+                "source": data["source"],
+                "metric": data["metric"],
+                "value": data["peak"],
+                "cpu_percent": data.get("cpu_percent"),
+                "ram_percent": data.get("ram_percent"),
+                "disk_percent": data.get("disk_percent"),
+                "severity": data["severity"],
+                "trend": data.get("trend", "Stable")
+            }), "ship")
+            print(f"🧾 Incident {data['incident_id']} opened: {data['source']} {data['metric']}={data['peak']}")
+        elif kind == "close":
+            print(f"✅ Incident {data['incident_id']} closed after {data['samples']} samples (peak {data['peak']})")
+
+        self.offer(self.ship_q, (f"incident_{kind}", data), "ship")
+
+    # ---------- STAGE 3: PERSISTENCE ----------
+    async def persist_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.persist_q.get()]
+            while len(batch) < PERSIST_BATCH and not self.persist_q.empty():
+                batch.append(self.persist_q.get_nowait())
             try:
-                sio.emit("metrics_update", {
-                    "timestamp": timestamp,
-                    "cpu": cpu,
-                    "ram": ram,
-                    "disk": disk
-                })
+                await loop.run_in_executor(self.io_executor, write_batch, batch)
+            except Exception as e:
+                print("[Persist error]", e)
+
+    # ---------- STAGE 4: SHIPPING ----------
+    def _connect(self):
+        try:
+            self.sio.connect(self.server)
+            print("✅ Connected to Flask server!")
+        except Exception as e:
+            print("❌ Could not connect. Start app.py first.", str(e))
+
+    def _emit(self, event, data):
+        if not self.sio.connected:
+            now = time.monotonic()
+            if now - self._last_connect < RECONNECT_INTERVAL:
+                return False
+            self._last_connect = now
+            self._connect()
+            if not self.sio.connected:
+                return False
+        self.sio.emit(event, data)
+        return True
+
+    async def ship_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            event, data = await self.ship_q.get()
+            try:
+                # Offline mode: live events are dropped, CSV logs are still written
+                if not await loop.run_in_executor(self.net_executor, self._emit, event, data):
+                    self.dropped["offline"] += 1
             except Exception:
-                pass
+                self.dropped["offline"] += 1
 
-            print(f"📡 Sent metrics — CPU:{cpu}%, RAM:{ram}%, Disk:{disk}%")
-            time.sleep(5)
+    # ---------- LIFECYCLE ----------
+    async def status_loop(self, every=60):
+        while True:
+            await asyncio.sleep(every)
+            print(f"📡 Collector: queues detect={self.detect_q.qsize()} persist={self.persist_q.qsize()} "
+                  f"ship={self.ship_q.qsize()} dropped={dict(self.dropped)} late_ticks={self.late_ticks}")
 
-        except Exception as e:
-            print("[Collector loop error]", e)
-            traceback.print_exc()
-            # sleep a bit to avoid tight failure loop
-            time.sleep(3)
+    async def run(self):
+        print("📊 Starting extended metrics collector...")
+        # Keras loads lazily; pull it in on the ML thread so sampling starts at once
+        # and the first escalated tick does not pay for the import
+        self.ml_executor.submit(warm_up)
+        tasks = [
+            asyncio.create_task(self.sample_loop()),
+            asyncio.create_task(self.detect_loop()),
+            asyncio.create_task(self.persist_loop()),
+            asyncio.create_task(self.ship_loop()),
+            asyncio.create_task(self.status_loop()),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    def shutdown(self):
+        """Close open incidents and flush what is still queued."""
+        pending = []
+        while not self.persist_q.empty():
+            pending.append(self.persist_q.get_nowait())
+        for _, incident in self.incidents.close_all():
+            pending.append(("incident", incident.to_dict()))
+        if pending:
+            write_batch(pending)
+        for ex in (self.ml_executor, self.io_executor, self.net_executor):
+            ex.shutdown(wait=False)
+        if self.sio.connected:
+            self.sio.disconnect()
+
+
+def collect_metrics():
+    ensure_metrics_header(csv_path)
+    ensure_anomaly_header(log_path)
+    if METRICS_PORT:
+        from instrumentation import start_metrics_server
+        start_metrics_server(METRICS_PORT, METRICS_HOST)
+    collector = AsyncCollector()
+    try:
+        asyncio.run(collector.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        collector.shutdown()
 
 
 # Run
@@ -0,0 +1,205 @@
+# retrainer.py
+"""
+Incremental retraining of the anomaly models with hot model swap.
+
+Each run:
+  1. loads the currently promoted LSTM bundle (model, scaler, threshold),
+  2. fine-tunes a copy of the model on the most recent metrics windows,
+  3. validates the candidate against the current model on a recent holdout,
+  4. recomputes the threshold by blending the new error statistics into the
+     previous ones (exponentially weighted, so it follows workload drift),
+  5. writes versioned artifacts and atomically repoints current_model.json.
+
+Running collectors notice the pointer change in lstm_inference and load the
+new bundle in a background thread, so inference never pauses.
+
+The IsolationForest is refit on the same recent window and swapped by an
+atomic file replace (anomaly_model.load_model reads it per call).
+
+Usage (from backend/):
+    python -m anomaly_detector.retrainer
+"""
+
+import os
+import json
+import glob
+import pickle
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import joblib
+import keras
+from sklearn.ensemble import IsolationForest
+
+from anomaly_detector import lstm_inference
+from anomaly_detector.features import LEGACY_FEATURES
+from anomaly_detector.lstm_model_keras3 import CSV_PATH, create_sequences
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(BASE_DIR, "models")
+ISOLATION_MODEL_PATH = os.path.join(BASE_DIR, "isolation_model.pkl")
+
+WINDOW_SIZE = lstm_inference.WINDOW_SIZE
+RECENT_ROWS = 2000          # ~2.8h of 5s samples
+MIN_ROWS = WINDOW_SIZE * 10
+VAL_FRACTION = 0.2
+FINE_TUNE_EPOCHS = 3
+FINE_TUNE_LR = 1e-4
+BATCH_SIZE = 32
+VAL_TOLERANCE = 0.10        # candidate may be at most 10% worse than current
+THRESHOLD_ALPHA = 0.3       # weight of the newest error statistics
+THRESHOLD_SIGMA = 3
+KEEP_VERSIONS = 3
+
+
+def load_recent(features, path=CSV_PATH, rows=RECENT_ROWS):
+    df = pd.read_csv(path)
+    missing = [c for c in features if c not in df.columns]
+    if missing:
+        raise RuntimeError(f"Metrics CSV lacks model features: {missing}")
+    return df.tail(rows)[features].fillna(0.0).astype(float).values
+
+
+def raw_errors(model, scaler, X, actual):
+    """Per-window MSE in the same (unscaled) space lstm_inference compares against."""
+    pred = model.predict(X, verbose=0) * scaler.scale_ + scaler.mean_
+    return np.mean((pred - actual) ** 2, axis=1)
+
+
+def rolling_threshold(previous, errors):
+    """Blend new error mean/std into the previous threshold statistics."""
+    mean_new, std_new = float(np.mean(errors)), float(np.std(errors))
+    if previous.get("space") == "raw":
+        a = THRESHOLD_ALPHA
+        mean = (1 - a) * previous["mean"] + a * mean_new
+        var = (1 - a) * previous["std"] ** 2 + a * std_new ** 2
+        std = float(np.sqrt(var))
+    else:
+        # Thresholds from the offline trainer were computed on scaled values
+        mean, std = mean_new, std_new
+    return {
+        "mean": mean,
+        "std": std,
+        "threshold": mean + THRESHOLD_SIGMA * std,
+        "space": "raw",
+        "updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def _write_pointer(pointer):
+    tmp = lstm_inference.CURRENT_POINTER_PATH + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(pointer, f, indent=2)
+    os.replace(tmp, lstm_inference.CURRENT_POINTER_PATH)
+
+
+def _prune_versions(keep_version):
+    versions = sorted({
+        os.path.basename(p).split("_", 1)[1].rsplit(".", 1)[0]
+        for p in glob.glob(os.path.join(MODELS_DIR, "threshold_*.pkl"))
+    })
+    for version in versions[:-KEEP_VERSIONS]:
+        if version == keep_version:
+            continue
+        for path in glob.glob(os.path.join(MODELS_DIR, f"*_{version}.*")):
+            os.remove(path)
+
+
+def retrain_lstm():
+    """Fine-tune the current LSTM on recent data; promote it only if it validates."""
+    pointer = lstm_inference._read_pointer()
+    model, scaler, th, version = lstm_inference.load_bundle(pointer)
+    features = list(th.get("features", LEGACY_FEATURES))
+
+    values = load_recent(features)
+    if len(values) < MIN_ROWS:
+        print(f"[Retrain] Only {len(values)} recent rows, need {MIN_ROWS}; skipping")
+        return None
+
+    X, _ = create_sequences(scaler.transform(values), window=WINDOW_SIZE)
+    y_raw = values[WINDOW_SIZE:]
+    split = int(len(X) * (1 - VAL_FRACTION))
+    X_train, X_val = X[:split], X[split:]
+    y_train = scaler.transform(y_raw[:split])
+    y_val_raw = y_raw[split:]
+
+    candidate = keras.models.clone_model(model)
+    candidate.set_weights(model.get_weights())
+    candidate.compile(optimizer=keras.optimizers.Adam(learning_rate=FINE_TUNE_LR), loss="mse")
+    candidate.fit(X_train, y_train, epochs=FINE_TUNE_EPOCHS, batch_size=BATCH_SIZE, verbose=0)
+
+    current_err = raw_errors(model, scaler, X_val, y_val_raw)
+    candidate_err = raw_errors(candidate, scaler, X_val, y_val_raw)
+    cur, cand = float(np.mean(current_err)), float(np.mean(candidate_err))
+    print(f"[Retrain] holdout MSE current={cur:.6f} candidate={cand:.6f}")
+
+    if not np.isfinite(cand) or cand > cur * (1 + VAL_TOLERANCE):
+        print("[Retrain] Candidate rejected; keeping", version)
+        return None
+
+    new_th = rolling_threshold(th, candidate_err)
+    new_th["features"] = features
+    new_version = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    model_name = os.path.join("models", f"lstm_model_{new_version}.keras")
+    scaler_name = os.path.join("models", f"scaler_{new_version}.pkl")
+    thresh_name = os.path.join("models", f"threshold_{new_version}.pkl")
+
+    candidate.save(os.path.join(BASE_DIR, model_name))
+    joblib.dump(scaler, os.path.join(BASE_DIR, scaler_name))
+    with open(os.path.join(BASE_DIR, thresh_name), "wb") as f:
+        pickle.dump(new_th, f)
+
+    # Artifacts are complete on disk before the pointer flips
+    _write_pointer({
+        "version": new_version,
+        "model": model_name,
+        "scaler": scaler_name,
+        "threshold": thresh_name,
+        "previous": version,
+        "holdout_mse": cand,
+    })
+    lstm_inference.swap_bundle(candidate, scaler, new_th, new_version)
+    _prune_versions(new_version)
+
+    print(f"[Retrain] Promoted {new_version} (threshold={new_th['threshold']:.6f})")
+    return new_version
+
+
+def retrain_isolation_forest(path=CSV_PATH, rows=RECENT_ROWS):
+    """Refit the IsolationForest on the recent window and swap it in atomically."""
+    df = pd.read_csv(path).tail(rows)
+    try:
+        features = list(joblib.load(ISOLATION_MODEL_PATH).feature_names_in_)
+    except (OSError, AttributeError):
+        features = list(LEGACY_FEATURES)
+    if len(df) < MIN_ROWS or any(c not in df.columns for c in features):
+        return False
+
+    model = IsolationForest(contamination=0.05, random_state=42)
+    model.fit(df[features].fillna(0.0))
+
+    tmp = ISOLATION_MODEL_PATH + ".tmp"
+    joblib.dump(model, tmp)
+    os.replace(tmp, ISOLATION_MODEL_PATH)
+    print("[Retrain] IsolationForest refreshed")
+    return True
+
+
+def run_retraining():
+    result = {"lstm": None, "isolation_forest": False}
+    try:
+        result["lstm"] = retrain_lstm()
+    except Exception as e:
+        print("[Retrain] LSTM retraining failed:", e)
+    try:
+        result["isolation_forest"] = retrain_isolation_forest()
+    except Exception as e:
+        print("[Retrain] IsolationForest retraining failed:", e)
+    return result
+
+
+if __name__ == "__main__":
+    print(json.dumps(run_retraining()))
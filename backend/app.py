@@ -1,60 +1,95 @@
 import os
+import sys
+import atexit
 import csv
+import zlib
 import json
-import psutil
 import random
 import logging
+import logging.handlers
 import hashlib
-from datetime import datetime
+import functools
+import mimetypes
+import threading
+import subprocess
+from datetime import datetime, timedelta
 from urllib.parse import quote_plus
-from cryptography.fernet import Fernet
-import smtplib
-from email.message import EmailMessage
-from flask import Flask, request, jsonify, send_file
-from flask_sqlalchemy import SQLAlchemy
+from flask import Blueprint, Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_socketio import SocketIO, emit
-from flask_apscheduler import APScheduler
+from sqlalchemy.exc import SQLAlchemyError
 
-from database import db, BackupJob
+from database import db, BackupJob, get_revision
+from anomaly_detector.features import METRICS_HEADER
+from anomaly_detector.csv_lock import locked
+import storage
+import vault_crypto
+import maintenance
+import cluster
+import instrumentation
+import response_cache
+from instrumentation import VAULT_BYTES, VAULT_LATENCY
 
 
 # ----------------------------------------
 # Initial Setup
 # ----------------------------------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-VAULT_DIR = os.path.join(BASE_DIR, "vault")
+VAULT_DIR = storage.VAULT_DIR  # local backend root; objects go through storage.get_backend()
 DECRYPT_DIR = os.path.join(BASE_DIR, "restored")
 ANOMALY_LOG_PATH = os.path.join(BASE_DIR, "anomaly_detector", "anomaly_log.csv")
+FLEET_METRICS_PATH = os.path.join(BASE_DIR, "anomaly_detector", "fleet_metrics.csv")
+INCIDENT_LOG_PATH = os.path.join(BASE_DIR, "anomaly_detector", "incident_log.csv")
 
-os.makedirs(VAULT_DIR, exist_ok=True)
 os.makedirs(DECRYPT_DIR, exist_ok=True)
 
 
-# ----------------------------------------
-# Vault Key Setup
-# ----------------------------------------
-KEY_PATH = os.path.join(BASE_DIR, "vault_key.key")
-if os.path.exists(KEY_PATH):
-    with open(KEY_PATH, "rb") as f:
-        key = f.read()
-else:
-    key = Fernet.generate_key()
-    with open(KEY_PATH, "wb") as f:
-        f.write(key)
-
-fernet = Fernet(key)
-
-
 # ----------------------------------------
 # Flask & DB Setup
 # ----------------------------------------
-app = Flask(__name__)
 password = quote_plus("root")
-app.config['SQLALCHEMY_DATABASE_URI'] = f"mysql+pymysql://root:Be/1229/2019-20@localhost/backup_tracker"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
-
-socketio = SocketIO(app, cors_allowed_origins="*")
+api = Blueprint("api", __name__)
+socketio = SocketIO(cors_allowed_origins="*")
+
+
+def create_app(config=None):
+    """Build the Flask app.
+
+    Only Flask, SQLAlchemy and Socket.IO are set up here; the vault cipher,
+    psutil, SMTP and the ML stack load on first use, and the scheduler is
+    started by start_scheduler() when serving (or START_SCHEDULER=1).
+    """
+    app = Flask(__name__)
+    # DATABASE_URL lets benchmarks and local runs point at SQLite instead of MySQL
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+        "DATABASE_URL", f"mysql+pymysql://root:Be/1229/2019-20@localhost/backup_tracker"
+    )
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    if config:
+        app.config.update(config)
+    db.init_app(app)
+    # Tables are created by init_db(), never on import
+    app.cli.command("init-db", help="Create missing database tables.")(lambda: init_db(app))
+    # SOCKETIO_MESSAGE_QUEUE shares broadcasts between workers (see cluster.py)
+    socketio.init_app(app, **cluster.socketio_options())
+
+    # Per-route request counters/latency, SQL statement counts and GET /metrics
+    instrumentation.init_app(app)
+    instrumentation.instrument_sqlalchemy()
+
+    app.register_blueprint(api)
+    if os.environ.get("START_SCHEDULER") == "1":
+        start_scheduler(app)
+    return app
+
+
+def init_db(app):
+    """Create missing tables (backup_jobs, scheduler_lease, data_revision).
+
+    Run by start_scheduler() (so also by __main__); gunicorn deployments without the
+    scheduler run `flask --app app init-db` once instead.
+    """
+    with app.app_context():
+        db.create_all()
 
 
 # ----------------------------------------
@@ -65,8 +100,14 @@ def setup_logger():
         os.makedirs('logs')
     logger = logging.getLogger("BackupTracker")
     logger.setLevel(logging.INFO)
-    handler = logging.FileHandler('logs/backup_tracker.log')
-    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    # Size-based rotation so the log no longer grows forever
+    handler = logging.handlers.RotatingFileHandler(
+        'logs/backup_tracker.log', maxBytes=10 * 1024 * 1024, backupCount=5
+    )
+    if os.environ.get("LOG_FORMAT") == "json":
+        handler.setFormatter(instrumentation.JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
     if not logger.hasHandlers():
         logger.addHandler(handler)
     return logger
@@ -79,10 +120,21 @@ logger.info("Flask Backup Tracker Started")
 # ----------------------------------------
 # Scheduler (Automatic Job Update)
 # ----------------------------------------
-scheduler = APScheduler()
+scheduler = None
+leader = None  # cluster.LeaderLease once the scheduler is started
+
+
+def _is_leader():
+    return 1 if leader is not None and leader.is_leader else 0
+
+
+instrumentation.Gauge("scheduler_is_leader", "1 if this worker runs the scheduled jobs", fn=_is_leader)
 
 
 def send_alert_email(failed_count):
+    import smtplib
+    from email.message import EmailMessage
+
     msg = EmailMessage()
     msg.set_content(f"{failed_count} backup job(s) failed!")
     msg['Subject'] = 'Backup Tracker Alert'
@@ -94,52 +146,183 @@ def send_alert_email(failed_count):
         s.send_message(msg)
 
 def update_jobs():
-    with app.app_context():
+    # Update pending jobs randomly
+    pending_jobs = BackupJob.query.filter_by(status='PENDING').all()
+    for job in pending_jobs:
+        job.status = random.choice(['SUCCESS', 'FAILED'])
+        job.logs = f"Job {job.job_name} completed with status {job.status}"
+    db.session.commit()
 
-        # Update pending jobs randomly
-        pending_jobs = BackupJob.query.filter_by(status='PENDING').all()
-        for job in pending_jobs:
-            job.status = random.choice(['SUCCESS', 'FAILED'])
-            job.logs = f"Job {job.job_name} completed with status {job.status}"
-        db.session.commit()
-
-        # Send job stats
-        stats = {
-            "total": BackupJob.query.count(),
-            "success": BackupJob.query.filter_by(status='SUCCESS').count(),
-            "failed": BackupJob.query.filter_by(status='FAILED').count(),
-            "pending": BackupJob.query.filter_by(status='PENDING').count()
-        }
-        socketio.emit('job_update', stats)
-
-        # Anomaly Rule: CPU > 80%
-        cpu_value = psutil.cpu_percent(interval=1)
-        if cpu_value > 80:
-            socketio.emit('anomaly_alert', {
-                "cpu": cpu_value,
-                "message": "CPU anomaly detected"
-            })
+    # Send job stats
+    stats = {
+        "total": BackupJob.query.count(),
+        "success": BackupJob.query.filter_by(status='SUCCESS').count(),
+        "failed": BackupJob.query.filter_by(status='FAILED').count(),
+        "pending": BackupJob.query.filter_by(status='PENDING').count()
+    }
+    socketio.emit('job_update', stats)
+
+    # Anomaly Rule: CPU > 80%
+    import psutil
+    cpu_value = psutil.cpu_percent(interval=1)
+    if cpu_value > 80:
+        socketio.emit('anomaly_alert', {
+            "cpu": cpu_value,
+            "message": "CPU anomaly detected"
+        })
  
-        if stats["failed"] > 7:
-            send_alert_email(stats["failed"])
+    if stats["failed"] > 7:
+        send_alert_email(stats["failed"])
+
+
+
+RETRAIN_INTERVAL_HOURS = float(os.environ.get("RETRAIN_INTERVAL_HOURS", 6))
+
+
+def retrain_models():
+    """Incrementally retrain the anomaly models in a child process.
+
+    Keeps TensorFlow out of the API process; collectors hot-swap the promoted
+    model on their own once current_model.json changes.
+    """
+    try:
+        result = subprocess.run(
+            [sys.executable, "-m", "anomaly_detector.retrainer"],
+            cwd=BASE_DIR, capture_output=True, text=True, timeout=3600
+        )
+        logger.info("Model retraining finished (rc=%s): %s", result.returncode, result.stdout.strip()[-500:])
+    except subprocess.TimeoutExpired:
+        logger.warning("Model retraining timed out")
+
+
+def run_maintenance():
+    """Rollups, retention and anomaly-log compaction (see maintenance.py)."""
+    summary = maintenance.run_maintenance()
+    logger.info("Maintenance finished: %s", json.dumps(summary))
+
+
+# Directories to snapshot nightly (os.pathsep-separated), at SNAPSHOT_HOUR local time
+SNAPSHOT_SOURCES = [p for p in os.environ.get("SNAPSHOT_SOURCES", "").split(os.pathsep) if p]
+SNAPSHOT_HOUR = int(os.environ.get("SNAPSHOT_HOUR", 2))
+
 
+def run_snapshots():
+    """Incremental snapshot of every SNAPSHOT_SOURCES directory (see snapshots.py)."""
+    import snapshots
 
+    for source in SNAPSHOT_SOURCES:
+        try:
+            entry = snapshots.create_snapshot(source)
+            logger.info("Snapshot %s: %s files, %s changed, %s new objects in %ss",
+                        entry["snapshot_id"], entry["files"], entry["changed_files"],
+                        entry["new_objects"], entry["duration_s"])
+            socketio.emit("vault_update", {"message": f"Snapshot {entry['snapshot_id']} stored"})
+        except OSError as e:
+            logger.error("Snapshot of %s failed: %s", source, e)
 
-with app.app_context():
-    scheduler.add_job(id='JobUpdater', func=update_jobs, trigger='interval', seconds=30)
-    scheduler.init_app(app)
-    scheduler.start()
+
+# Daily vault cleanup at VAULT_GC_HOUR. Deleting versions per retention_policies.json
+# is opt-in (VAULT_GC_ENABLED=1); preview it first with GET /vault/retention
+VAULT_GC_HOUR = int(os.environ.get("VAULT_GC_HOUR", 3))
+VAULT_GC_ENABLED = os.environ.get("VAULT_GC_ENABLED") == "1"
+RETENTION_CONFIG = os.environ.get("VAULT_RETENTION_CONFIG", os.path.join(BASE_DIR, "retention_policies.json"))
+
+
+def run_vault_gc():
+    """Drop stale chunked uploads and, when enabled, the versions retention policies expire."""
+    import chunked_upload
+
+    expired_uploads = chunked_upload.expire_sessions()
+    if not VAULT_GC_ENABLED:
+        return {"expired_uploads": expired_uploads}
+    if not os.path.exists(RETENTION_CONFIG):
+        logger.warning("VAULT_GC_ENABLED is set but %s does not exist; no versions expired", RETENTION_CONFIG)
+        return {"expired_uploads": expired_uploads}
+
+    import retention
+
+    report = retention.run_gc(dry_run=False, config=retention.load_policies(RETENTION_CONFIG))
+    report["expired_uploads"] = expired_uploads
+    if report.get("deleted_keys"):
+        socketio.emit("vault_update", {"message": f"Retention removed {report['expired_versions']} versions"})
+    return report
+
+
+def _scheduled(app, job_id, fn):
+    """Run `fn` inside `app`'s context and record it in the job metrics.
+
+    Every worker schedules the jobs; only the current lease holder runs them.
+    """
+    timed = instrumentation.instrument_job(job_id, fn)
+
+    @functools.wraps(fn)
+    def run():
+        if not leader.is_leader:
+            return None
+        with app.app_context():
+            return timed()
+    return run
+
+
+def _release_leadership(app):
+    with app.app_context():
+        leader.release()
+
+
+def start_scheduler(app):
+    """Register and start the background jobs; called when serving, never on import."""
+    global scheduler, leader
+    if scheduler is not None:
+        return scheduler
+    from flask_apscheduler import APScheduler
+
+    leader = cluster.LeaderLease()
+    scheduler = APScheduler()
+    with app.app_context():
+        try:
+            init_db(app)
+        except SQLAlchemyError as e:
+            logger.error("Could not create database tables: %s", e)
+        # Take the lease now so a lone worker runs its first jobs on schedule
+        leader.heartbeat()
+        atexit.register(_release_leadership, app)
+
+        def renew_lease():
+            with app.app_context():
+                leader.heartbeat()
+
+        scheduler.add_job(id='LeaderLease', func=renew_lease, trigger='interval',
+                          seconds=cluster.LEASE_RENEW_SECONDS)
+        scheduler.add_job(id='JobUpdater', func=_scheduled(app, 'JobUpdater', update_jobs),
+                          trigger='interval', seconds=30)
+        scheduler.add_job(id='ModelRetrainer', func=_scheduled(app, 'ModelRetrainer', retrain_models),
+                          trigger='interval', hours=RETRAIN_INTERVAL_HOURS)
+        scheduler.add_job(id='Maintenance', func=_scheduled(app, 'Maintenance', run_maintenance),
+                          trigger='interval', minutes=maintenance.MAINTENANCE_MINUTES)
+        if SNAPSHOT_SOURCES:
+            scheduler.add_job(id='Snapshots', func=_scheduled(app, 'Snapshots', run_snapshots),
+                              trigger='cron', hour=SNAPSHOT_HOUR, minute=0)
+        scheduler.add_job(id='VaultGC', func=_scheduled(app, 'VaultGC', run_vault_gc),
+                          trigger='cron', hour=VAULT_GC_HOUR, minute=30)
+        scheduler.init_app(app)
+        scheduler.start()
+    return scheduler
 
 
 # ----------------------------------------
 # Helper Functions
 # ----------------------------------------
-def compute_sha256(path):
-    sha = hashlib.sha256()
-    with open(path, "rb") as f:
-        for block in iter(lambda: f.read(4096), b""):
-            sha.update(block)
-    return sha.hexdigest()
+def compute_sha256(key):
+    """SHA-256 of a stored vault object, streamed from the storage backend."""
+    with VAULT_LATENCY.time(op="hash"):
+        return storage.get_backend().sha256(key)
+
+
+def _vault_exists(key):
+    try:
+        return storage.get_backend().exists(key)
+    except ValueError:  # not a valid storage key (e.g. "..")
+        return False
 
 
 def _safe_float(v):
@@ -153,14 +336,30 @@ def _safe_float(v):
 # API ROUTES
 # ----------------------------------------
 
-@app.route("/")
+@api.route("/")
 def home():
     return jsonify({"message": "Backup Tracker API Running"})
 
 
 # ---------------------- JOBS ----------------------
 
-@app.route("/api/jobs", methods=["GET"])
+# Cache keys for the polled read APIs (see response_cache.py)
+def _jobs_version():
+    revision = get_revision("jobs")
+    return None if revision is None else ("jobs", revision)
+
+
+def _anomaly_log_version():
+    return response_cache.file_version(ANOMALY_LOG_PATH)
+
+
+def _vault_version():
+    generation = storage.get_backend().generation()
+    return None if generation is None else ("vault", generation)
+
+
+@api.route("/api/jobs", methods=["GET"])
+@response_cache.cached(_jobs_version)
 def api_jobs():
     jobs = BackupJob.query.order_by(BackupJob.timestamp.desc()).all()
     return jsonify([
@@ -174,7 +373,7 @@ def api_jobs():
     ])
 
 
-@app.route("/create_job", methods=["POST"])
+@api.route("/create_job", methods=["POST"])
 def create_job():
     data = request.json
     new_job = BackupJob(job_name=data["job_name"])
@@ -185,7 +384,8 @@ def create_job():
 
 # ---------------------- STATS ----------------------
 
-@app.route("/api/stats")
+@api.route("/api/stats")
+@response_cache.cached(_jobs_version)
 def api_stats():
     total = BackupJob.query.count()
     success = BackupJob.query.filter_by(status='SUCCESS').count()
@@ -204,93 +404,254 @@ def api_stats():
 
 # ---------------------- VAULT ----------------------
 
-@app.route("/vault/list")
+@api.route("/vault/list")
+@response_cache.cached(_vault_version)
 def vault_list():
     files = []
-    for file in os.listdir(VAULT_DIR):
-        path = os.path.join(VAULT_DIR, file)
+    # Top level only: objects/ and snapshots/ belong to directory snapshots
+    for obj in storage.get_backend().list(recursive=False):
         files.append({
-            "name": file,
-            "size_kb": round(os.path.getsize(path) / 1024, 2),
-            "modified": datetime.fromtimestamp(os.path.getmtime(path)).strftime("%Y-%m-%d %H:%M:%S")
+            "name": obj.key,
+            "size_kb": round(obj.size / 1024, 2),
+            "modified": datetime.fromtimestamp(obj.modified).strftime("%Y-%m-%d %H:%M:%S")
         })
     return jsonify(files)
 
 
-@app.route("/vault/upload", methods=["POST"])
+@api.route("/vault/snapshots")
+def vault_snapshots():
+    """Snapshot catalog entries, newest first; ?source=<dir> filters to one tree."""
+    import snapshots
+
+    rows = snapshots.list_snapshots(request.args.get("source"))
+    return jsonify(sorted(rows, key=lambda e: e["timestamp"], reverse=True))
+
+
+@api.route("/vault/retention")
+def vault_retention():
+    """Dry-run retention report: what the next GC would keep and delete."""
+    import retention
+
+    report = retention.run_gc(dry_run=True, config=retention.load_policies(RETENTION_CONFIG))
+    report["gc_enabled"] = VAULT_GC_ENABLED
+    return jsonify(report)
+
+
+@api.route("/vault/upload", methods=["POST"])
 def vault_upload():
     if "file" not in request.files:
         return jsonify({"error": "No file uploaded"}), 400
 
     file = request.files["file"]
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    encrypted_name = f"{file.filename}_{ts}.enc"
-    path = os.path.join(VAULT_DIR, encrypted_name)
-
-    encrypted_data = fernet.encrypt(file.read())
-    with open(path, "wb") as f:
-        f.write(encrypted_data)
-
-    hash_value = compute_sha256(path)
-    with open(path + ".hash", "w") as h:
-        h.write(hash_value)
+    encrypted_name = f"{os.path.basename(file.filename)}_{ts}.enc"
+    backend = storage.get_backend()
+
+    with VAULT_LATENCY.time(op="encrypt"):
+        plaintext = file.read()
+        # Fresh data key per object, wrapped by the master key (see vault_crypto.py)
+        encrypted_data, crypto_meta = vault_crypto.encrypt(plaintext)
+    VAULT_BYTES.inc(len(plaintext), op="encrypt")
+    with VAULT_LATENCY.time(op="write"):
+        backend.put(encrypted_name, encrypted_data, crypto_meta)
+
+    # Hash of the bytes just written; saves reading the object back
+    with VAULT_LATENCY.time(op="hash"):
+        hash_value = hashlib.sha256(encrypted_data).hexdigest()
+    backend.put(encrypted_name + ".hash", hash_value.encode())
 
     socketio.emit("vault_update", {"message": f"{file.filename} uploaded"})
 
     return jsonify({"message": "Encrypted & stored", "filename": encrypted_name})
 
 
-@app.route('/vault/verify/<filename>', methods=['GET'])
+
+# ---------------------- RESUMABLE UPLOADS ----------------------
+
+def _upload_error(e):
+    return jsonify({"error": str(e), **e.extra}), e.status
+
+
+@api.route("/vault/uploads", methods=["POST"])
+def vault_upload_init():
+    """Start a resumable upload; body {"filename": ..., "size": <bytes, optional>}."""
+    import chunked_upload
+
+    params = request.get_json(silent=True) or {}
+    try:
+        return jsonify(chunked_upload.init_upload(params.get("filename"), params.get("size"))), 201
+    except chunked_upload.UploadError as e:
+        return _upload_error(e)
+
+
+@api.route("/vault/uploads/<upload_id>", methods=["PUT"])
+def vault_upload_part(upload_id):
+    """Append one part: raw body at ?offset=N with X-Content-SHA256 of the body."""
+    import chunked_upload
+
+    offset = request.args.get("offset", type=int)
+    if offset is None or offset < 0:
+        return jsonify({"error": "offset query parameter is required"}), 400
+    limit = chunked_upload.PART_SIZE
+    if (request.content_length or 0) > limit:
+        return jsonify({"error": f"Part larger than {limit} bytes"}), 413
+    # Read from the stream so no more than one part is ever buffered
+    data = request.stream.read(limit + 1)
+    if len(data) > limit:
+        return jsonify({"error": f"Part larger than {limit} bytes"}), 413
+
+    try:
+        with VAULT_LATENCY.time(op="encrypt"):
+            state = chunked_upload.put_part(upload_id, offset, data, request.headers.get("X-Content-SHA256"))
+    except chunked_upload.UploadError as e:
+        return _upload_error(e)
+    VAULT_BYTES.inc(len(data), op="encrypt")
+    return jsonify(state)
+
+
+@api.route("/vault/uploads/<upload_id>", methods=["GET"])
+def vault_upload_status(upload_id):
+    import chunked_upload
+
+    try:
+        session, _ = chunked_upload.load_session(upload_id)
+    except chunked_upload.UploadError as e:
+        return _upload_error(e)
+    return jsonify(chunked_upload.status(session))
+
+
+@api.route("/vault/uploads/<upload_id>/complete", methods=["POST"])
+def vault_upload_complete(upload_id):
+    import chunked_upload
+
+    try:
+        with VAULT_LATENCY.time(op="write"):
+            result = chunked_upload.complete_upload(upload_id)
+    except chunked_upload.UploadError as e:
+        return _upload_error(e)
+    socketio.emit("vault_update", {"message": f"{result['filename']} uploaded"})
+    return jsonify({"message": "Encrypted & stored", **result})
+
+
+@api.route("/vault/uploads/<upload_id>", methods=["DELETE"])
+def vault_upload_abort(upload_id):
+    import chunked_upload
+
+    try:
+        chunked_upload.abort_upload(upload_id)
+    except chunked_upload.UploadError as e:
+        return _upload_error(e)
+    return jsonify({"message": "Upload aborted"})
+
+@api.route('/vault/verify/<filename>', methods=['GET'])
 def vault_verify(filename):
     """Verify integrity of encrypted file using its hash"""
-    file_path = os.path.join(VAULT_DIR, filename)
-    hash_path = file_path + ".hash"
+    hash_key = filename + ".hash"
 
-    if not os.path.exists(file_path):
+    if not _vault_exists(filename):
         return jsonify({"error": "Encrypted file not found"}), 404
-    if not os.path.exists(hash_path):
+    if not _vault_exists(hash_key):
         return jsonify({"error": "Hash file missing"}), 404
 
-    stored_hash = open(hash_path).read().strip()
-    current_hash = compute_sha256(file_path)
+    stored_hash = storage.get_backend().get(hash_key).decode().strip()
+    current_hash = compute_sha256(filename)
 
     if stored_hash == current_hash:
         return jsonify({"verified": True, "message": "✅ Integrity check passed"})
     else:
         return jsonify({"verified": False, "message": "⚠️ File integrity compromised!"})
 
-    with open(file_path, "rb") as f:
-        decrypted_data = fernet.decrypt(f.read())
+    decrypted_data = vault_crypto.load(filename)
     restore_path = os.path.join(DECRYPT_DIR, filename.replace(".enc", ""))
     with open(restore_path, "wb") as f:
         f.write(decrypted_data)
 
     return send_file(restore_path, as_attachment=True)
 
-@app.route("/vault/restore/<filename>")
+@api.route("/vault/restore/<filename>")
 def vault_restore(filename):
-    path = os.path.join(VAULT_DIR, filename)
-
-    if not os.path.exists(path):
+    if not _vault_exists(filename):
         return jsonify({"error": "File not found"}), 404
 
     try:
-        decrypted = fernet.decrypt(open(path, "rb").read())
-        original_name = filename.replace(".enc", "")
-        restore_path = os.path.join(DECRYPT_DIR, original_name)
-
-        with open(restore_path, "wb") as f:
-            f.write(decrypted)
-
-        return send_file(restore_path, as_attachment=True, download_name=original_name)
-
+        with VAULT_LATENCY.time(op="decrypt"):
+            size, chunks = vault_crypto.iter_decrypt(filename, storage.get_backend())
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    original_name = filename.replace(".enc", "")
+    restore_path = os.path.join(DECRYPT_DIR, original_name)
+
+    def stream():
+        # Chunked uploads decrypt token by token; a copy still lands in restored/
+        tmp = f"{restore_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        total = 0
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    total += len(chunk)
+                    yield chunk
+            os.replace(tmp, restore_path)
+        except Exception as e:
+            logger.error("Restore of %s failed after %d bytes: %s", filename, total, e)
+            raise
+        finally:
+            VAULT_BYTES.inc(total, op="decrypt")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    mimetype = mimetypes.guess_type(original_name)[0] or "application/octet-stream"
+    resp = Response(stream_with_context(stream()), mimetype=mimetype)
+    resp.headers.set("Content-Disposition", "attachment", filename=original_name)
+    if size is not None:
+        resp.headers["Content-Length"] = str(size)
+    return resp
+
+
+
+@api.route("/vault/restore/bulk", methods=["GET", "POST"])
+def vault_restore_bulk():
+    """Stream many restored files as one archive.
+
+    JSON body or query: exactly one of files=[...], prefix=<key prefix> or
+    snapshot=<snapshot id>; format=tar (default) or zip.
+    """
+    import bulk_restore
+
+    params = request.get_json(silent=True) or request.args.to_dict()
+    fmt = params.get("format", "tar")
+    if fmt not in bulk_restore.FORMATS:
+        return jsonify({"error": f"format must be one of {list(bulk_restore.FORMATS)}"}), 400
+    chosen = [k for k in ("files", "prefix", "snapshot") if params.get(k)]
+    if len(chosen) != 1:
+        return jsonify({"error": "Give exactly one of 'files', 'prefix' or 'snapshot'"}), 400
+
+    try:
+        if "snapshot" in chosen:
+            items = bulk_restore.select_snapshot(params["snapshot"])
+            name = params["snapshot"]  # already timestamped
+        elif "prefix" in chosen:
+            items = bulk_restore.select_prefix(params["prefix"])
+            name = f"{params['prefix'].rstrip('_') or 'vault'}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        else:
+            files = params["files"]
+            items = bulk_restore.select_files(files if isinstance(files, list) else files.split(","))
+            name = f"vault_restore_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    except (KeyError, FileNotFoundError) as e:
+        return jsonify({"error": f"Not found: {e}"}), 404
+    if not items:
+        return jsonify({"error": "Nothing to restore"}), 404
+
+    resp = Response(stream_with_context(bulk_restore.stream_archive(items, fmt)),
+                    mimetype=bulk_restore.FORMATS[fmt])
+    resp.headers.set("Content-Disposition", "attachment", filename=f"{os.path.basename(name)}.{fmt}")
+    return resp
 
 # ---------------------- ANOMALIES ----------------------
 
-@app.route("/api/anomalies")
+@api.route("/api/anomalies")
+@response_cache.cached(_anomaly_log_version)
 def api_anomalies():
     if not os.path.exists(ANOMALY_LOG_PATH):
         return jsonify([])
@@ -314,7 +675,8 @@ def api_anomalies():
     return jsonify(rows[-50:])
 
 
-@app.route("/api/anomaly_timeline")
+@api.route("/api/anomaly_timeline")
+@response_cache.cached(_anomaly_log_version)
 def api_timeline():
     if not os.path.exists(ANOMALY_LOG_PATH):
         return jsonify([])
@@ -335,6 +697,118 @@ def api_timeline():
     return jsonify(rows)
 
 
+@api.route("/api/incidents")
+def api_incidents():
+    """Latest incidents (open and closed); the log holds an open and a close row per incident."""
+    if not os.path.exists(INCIDENT_LOG_PATH):
+        return jsonify([])
+
+    incidents = {}
+    with open(INCIDENT_LOG_PATH) as f:
+        for r in csv.DictReader(f):
+            incidents[r.get("incident_id")] = {
+                "incident_id": r.get("incident_id"),
+                "status": r.get("status"),
+                "source": r.get("source"),
+                "metric": r.get("metric"),
+                "start": r.get("start"),
+                "end": r.get("end"),
+                "peak": _safe_float(r.get("peak", "")),
+                "samples": int(_safe_float(r.get("samples", "")) or 0),
+                "severity": r.get("severity")
+            }
+
+    rows = sorted(incidents.values(), key=lambda x: x["start"] or "", reverse=True)
+    return jsonify(rows[:50])
+
+
+# ---------------------- METRIC ROLLUPS ----------------------
+
+@api.route("/api/metrics/rollup")
+def api_metrics_rollup():
+    """Downsampled history for long-range charts.
+
+    Query: resolution=1m|1h (default 1h), hours=<lookback, default 24*7>,
+    host=<fleet host id> (reads fleet rollups instead of the local collector).
+    """
+    resolution = request.args.get("resolution", "1h")
+    if resolution not in maintenance.RESOLUTIONS:
+        return jsonify({"error": f"resolution must be one of {list(maintenance.RESOLUTIONS)}"}), 400
+    hours = _safe_float(request.args.get("hours", 24 * 7)) or 24 * 7
+    host = request.args.get("host")
+
+    since = (datetime.now() - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M")
+    prefix = "fleet" if host else "metrics"
+    return jsonify(maintenance.read_rollup(prefix, resolution, since=since, host=host))
+
+
+# ---------------------- FLEET METRICS ----------------------
+
+FLEET_METRIC_FIELDS = METRICS_HEADER
+FLEET_HEADER = ["host"] + FLEET_METRIC_FIELDS
+MAX_INGEST_BYTES = 8 * 1024 * 1024
+
+
+@api.route("/api/metrics/ingest", methods=["POST"])
+def api_metrics_ingest():
+    """Accept a (optionally gzip-compressed) batch of samples from a fleet agent."""
+    # Bound both the wire size and the inflated size, so a small gzip bomb cannot exhaust memory
+    if request.content_length is None or request.content_length > MAX_INGEST_BYTES:
+        return jsonify({"error": "Batch too large or missing Content-Length"}), 413
+    raw = request.get_data(cache=False)
+    try:
+        if request.headers.get("Content-Encoding", "").lower() == "gzip":
+            inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            raw = inflater.decompress(raw, MAX_INGEST_BYTES + 1)
+            if not inflater.eof and not inflater.unconsumed_tail:
+                raise ValueError("truncated gzip stream")
+        if len(raw) > MAX_INGEST_BYTES:
+            return jsonify({"error": "Batch too large"}), 413
+        batch = json.loads(raw)
+    except (zlib.error, ValueError):
+        return jsonify({"error": "Malformed batch"}), 400
+
+    host = str(batch.get("host") or "").strip() if isinstance(batch, dict) else ""
+    samples = batch.get("samples") if isinstance(batch, dict) else None
+    if not host or not isinstance(samples, list):
+        return jsonify({"error": "Batch needs 'host' and a 'samples' list"}), 400
+
+    samples = [s for s in samples if isinstance(s, dict)]
+    rows = [[host] + [s.get(field, "") for field in FLEET_METRIC_FIELDS] for s in samples]
+    if not rows:
+        return jsonify({"accepted": 0})
+
+    # One open + writerows per batch instead of one write per sample; the
+    # lock is shared with other workers and with maintenance's rewrites
+    with locked(FLEET_METRICS_PATH):
+        new_file = not os.path.exists(FLEET_METRICS_PATH)
+        if not new_file:
+            with open(FLEET_METRICS_PATH, newline="") as f:
+                header = next(csv.reader(f), None)
+            if header != FLEET_HEADER:
+                # Older column layout: set it aside rather than mixing schemas
+                ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+                os.replace(FLEET_METRICS_PATH, FLEET_METRICS_PATH.replace(".csv", f"_{ts}.csv"))
+                new_file = True
+        with open(FLEET_METRICS_PATH, "a", newline="") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(FLEET_HEADER)
+            writer.writerows(rows)
+
+    latest = samples[-1]
+    socketio.emit("metrics_batch", {"host": host, "count": len(rows), "latest": latest})
+    socketio.emit("metrics_update", {
+        "host": host,
+        "timestamp": latest.get("timestamp"),
+        "cpu": latest.get("cpu_percent"),
+        "ram": latest.get("ram_percent"),
+        "disk": latest.get("disk_percent")
+    })
+
+    return jsonify({"accepted": len(rows)})
+
+
 # ---------------------- Socket.IO ----------------------
 
 @socketio.on("metrics_update")
@@ -347,10 +821,30 @@ def socket_anomaly(data):
     emit("anomaly_alert", data, broadcast=True)
 
 
+@socketio.on("incident_open")
+def socket_incident_open(data):
+    emit("incident_open", data, broadcast=True)
+
+
+@socketio.on("incident_update")
+def socket_incident_update(data):
+    emit("incident_update", data, broadcast=True)
+
+
+@socketio.on("incident_close")
+def socket_incident_close(data):
+    emit("incident_close", data, broadcast=True)
+
+
 # ----------------------------------------
 # Run Server
 # ----------------------------------------
+# Module-level app for `from app import app`, testscript.py and the benchmarks
+app = create_app()
+
+
 if __name__ == "__main__":
-    with app.app_context():
-        db.create_all()
-    socketio.run(app, host="127.0.0.1", port=5050, debug=True)
+    start_scheduler(app)
+    # One process per port; run several behind a sticky load balancer for multi-worker mode
+    socketio.run(app, host=os.environ.get("HOST", "127.0.0.1"), port=int(os.environ.get("PORT", 5050)),
+                 debug=os.environ.get("FLASK_DEBUG", "1") == "1")
@@ -0,0 +1,481 @@
+# load_test.py
+"""
+End-to-end load generator for the backend.
+
+Starts app.py as a real server (threaded Werkzeug + Socket.IO) on a
+throwaway SQLite database, vault and log directory, then drives it with
+three kinds of simulated clients for --duration seconds:
+
+    orchestrators (N)  POST /create_job at --job-rate jobs/s each
+    collectors    (M)  Socket.IO clients emitting metrics_update at
+                       --metrics-rate/s each, plus anomaly_alert with
+                       probability --alert-ratio
+    dashboards    (K)  Socket.IO clients receiving those broadcasts, and
+                       polling /api/jobs, /api/stats, /api/anomalies and
+                       /vault/list every --poll seconds with If-None-Match,
+                       like the browser dashboard
+
+The JSON report has per-route throughput and latency percentiles (with
+200/304/error counts), Socket.IO fan-out (expected vs delivered events,
+dropped events, delivery latency) and the server process's CPU, RSS,
+threads and open files sampled once a second.
+
+Usage (from backend/):
+    python -m benchmarks.load_test --orchestrators 4 --collectors 20 --dashboards 10 --duration 60
+    python -m benchmarks.load_test --url http://127.0.0.1:5050 --server-pid 1234   # existing instance
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from datetime import datetime
+
+from benchmarks.run_benchmarks import BACKEND_DIR, summarize, git_commit
+
+POLL_ROUTES = ("/api/jobs", "/api/stats", "/api/anomalies", "/vault/list")
+SOCKET_EVENTS = ("metrics_update", "anomaly_alert")
+
+
+# ---------- SERVER ----------
+def _isolate(app_module, root):
+    """Point every file the server and its scheduled jobs write at `root`.
+
+    These paths are module constants next to the sources, so they are
+    rebound here rather than through the environment.
+    """
+    import maintenance
+    import snapshots
+    import vault_crypto
+    import vault_manager
+
+    detector_dir = os.path.join(root, "anomaly_detector")
+    os.makedirs(detector_dir, exist_ok=True)
+    app_module.DECRYPT_DIR = vault_manager.DECRYPT_DIR = os.path.join(root, "restored")
+    os.makedirs(app_module.DECRYPT_DIR, exist_ok=True)
+    for name in ("ANOMALY_LOG_PATH", "FLEET_METRICS_PATH", "INCIDENT_LOG_PATH"):
+        path = os.path.join(detector_dir, os.path.basename(getattr(app_module, name)))
+        setattr(app_module, name, path)
+        setattr(maintenance, name, path)
+    maintenance.METRICS_PATH = os.path.join(detector_dir, "sample_metrics.csv")
+    maintenance.ROLLUP_DIR = os.path.join(detector_dir, "rollups")
+    maintenance.STATE_PATH = os.path.join(maintenance.ROLLUP_DIR, "maintenance_state.json")
+    maintenance.SOURCES = [(maintenance.METRICS_PATH, "metrics"), (maintenance.FLEET_METRICS_PATH, "fleet")]
+    vault_crypto.KEYRING_PATH = os.path.join(root, "vault_master_keys.json")
+    vault_crypto.LEGACY_KEY_PATH = vault_manager.KEY_FILE = os.path.join(root, "vault_key.key")
+    vault_manager.METADATA_FILE = os.path.join(root, "vault_metadata.json")
+    snapshots.CACHE_DIR = os.path.join(root, "snapshot_cache")
+
+    # Never mail the on-call address or retrain (and promote) the shipped models
+    app_module.send_alert_email = lambda failed_count: None
+    app_module.retrain_models = lambda: None
+
+
+def serve(port, with_scheduler=False):
+    """Entry point of the server subprocess (cwd and env are set by LocalServer)."""
+    import app as app_module
+
+    _isolate(app_module, os.getcwd())
+    app_module.init_db(app_module.app)
+    if with_scheduler:
+        app_module.start_scheduler(app_module.app)
+    app_module.socketio.run(app_module.app, host="127.0.0.1", port=port, debug=False,
+                            use_reloader=False, log_output=False, allow_unsafe_werkzeug=True)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LocalServer:
+    """app.py in a subprocess with all of its writable state in a temp dir."""
+
+    def __init__(self, with_scheduler=False):
+        self.tmp = tempfile.mkdtemp(prefix="tracker-load-")
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        env = dict(os.environ)
+        env.update({
+            "DATABASE_URL": "sqlite:///" + os.path.join(self.tmp, "load.db"),
+            "VAULT_DIR": os.path.join(self.tmp, "vault"),
+            "PYTHONPATH": BACKEND_DIR + os.pathsep + env.get("PYTHONPATH", ""),
+        })
+        for name in ("START_SCHEDULER", "SNAPSHOT_SOURCES", "VAULT_GC_ENABLED"):
+            env.pop(name, None)
+        cmd = [sys.executable, "-m", "benchmarks.load_test", "--serve", str(self.port)]
+        if with_scheduler:
+            cmd.append("--scheduler")
+        # cwd=tmp: app.py writes logs/ relative to the working directory
+        self.stderr_path = os.path.join(self.tmp, "server.err")
+        with open(self.stderr_path, "wb") as err:
+            self.proc = subprocess.Popen(cmd, cwd=self.tmp, env=env, stdout=subprocess.DEVNULL, stderr=err)
+        self.pid = self.proc.pid
+
+    def wait_ready(self, timeout=60):
+        import requests
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                with open(self.stderr_path, errors="replace") as f:
+                    raise RuntimeError("Server exited during startup:\n" + f.read())
+            try:
+                if requests.get(self.url + "/api/stats", timeout=1).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise TimeoutError(f"Server on {self.url} not ready after {timeout}s")
+
+    def stop(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+# ---------- RECORDING ----------
+class Recorder:
+    """Thread-safe latency samples and outcome counts per operation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+
+    def record(self, op, seconds, outcome):
+        with self._lock:
+            if seconds is not None:
+                self.latency[op].append(seconds)
+            self.outcomes[op][str(outcome)] += 1
+
+    def report(self, duration):
+        rows = {}
+        for op in sorted(self.outcomes):
+            outcomes = dict(self.outcomes[op])
+            total = sum(outcomes.values())
+            row = {"requests": total, "per_s": round(total / duration, 2), "outcomes": outcomes}
+            if self.latency[op]:
+                row.update(summarize(self.latency[op]))
+            rows[op] = row
+        return rows
+
+
+def _pace(rate, stop):
+    """Yield once per 1/rate seconds (as fast as possible when rate <= 0) until `stop` is set."""
+    interval = 1.0 / rate if rate > 0 else 0.0
+    # Random phase so clients do not fire in lockstep
+    next_at = time.monotonic() + random.uniform(0, interval)
+    while not stop.is_set():
+        delay = next_at - time.monotonic()
+        if delay > 0 and stop.wait(delay):
+            return
+        next_at = max(next_at + interval, time.monotonic() - interval)
+        yield
+
+
+# ---------- CLIENTS ----------
+def orchestrator(index, base_url, rate, rec, stop):
+    import requests
+
+    session = requests.Session()
+    for n, _ in enumerate(_pace(rate, stop)):
+        start = time.perf_counter()
+        try:
+            resp = session.post(f"{base_url}/create_job", json={"job_name": f"load_{index}_{n}"}, timeout=30)
+            rec.record("POST /create_job", time.perf_counter() - start, resp.status_code)
+        except requests.RequestException as e:
+            rec.record("POST /create_job", None, type(e).__name__)
+
+
+class Collector:
+    """Emits metrics_update (and sometimes anomaly_alert) like metrics_collector.py."""
+
+    def __init__(self, index, base_url, rate, alert_ratio, rec):
+        import socketio
+
+        self.index = index
+        self.rate = rate
+        self.alert_ratio = alert_ratio
+        self.rec = rec
+        self.sent = defaultdict(int)
+        self.client = socketio.Client(reconnection=False)
+        self.client.connect(base_url, transports=["websocket"], wait_timeout=10)
+
+    def run(self, stop):
+        for seq, _ in enumerate(_pace(self.rate, stop)):
+            event = "anomaly_alert" if random.random() < self.alert_ratio else "metrics_update"
+            payload = {
+                "host": f"load-collector-{self.index}",
+                "collector": self.index,
+                "seq": seq,
+                "sent_at": time.time(),
+                "cpu": round(random.uniform(5, 95), 2),
+                "ram": round(random.uniform(20, 90), 2),
+                "disk": round(random.uniform(30, 80), 2),
+            }
+            try:
+                self.client.emit(event, payload)
+                self.sent[event] += 1
+                self.rec.record(f"emit {event}", None, "ok")
+            except Exception as e:
+                self.rec.record(f"emit {event}", None, type(e).__name__)
+
+    def close(self):
+        self.client.disconnect()
+
+
+class Dashboard:
+    """Socket.IO subscriber plus the 5-second HTTP polls of the React dashboard."""
+
+    def __init__(self, index, base_url, poll_interval, rec):
+        import socketio
+
+        self.base_url = base_url
+        self.poll_interval = poll_interval
+        self.rec = rec
+        self.received = defaultdict(set)  # event -> {(collector, seq)}
+        self.delivery = []
+        self._lock = threading.Lock()
+        self.client = socketio.Client(reconnection=False)
+        for event in SOCKET_EVENTS:
+            self.client.on(event, self._handler(event))
+        self.client.connect(base_url, transports=["websocket"], wait_timeout=10)
+
+    def _handler(self, event):
+        def on_event(data):
+            if not isinstance(data, dict) or "seq" not in data:
+                return  # broadcasts not sent by this load test
+            with self._lock:
+                self.received[event].add((data["collector"], data["seq"]))
+                self.delivery.append(time.time() - data["sent_at"])
+        return on_event
+
+    def poll(self, stop):
+        import requests
+
+        session = requests.Session()
+        etags = {}
+        for _ in _pace(1.0 / self.poll_interval, stop):
+            for route in POLL_ROUTES:
+                headers = {"If-None-Match": etags[route]} if route in etags else {}
+                start = time.perf_counter()
+                try:
+                    resp = session.get(self.base_url + route, headers=headers, timeout=30)
+                    resp.content
+                    self.rec.record(f"GET {route}", time.perf_counter() - start, resp.status_code)
+                    if resp.headers.get("ETag"):
+                        etags[route] = resp.headers["ETag"]
+                except requests.RequestException as e:
+                    self.rec.record(f"GET {route}", None, type(e).__name__)
+
+    def close(self):
+        self.client.disconnect()
+
+
+# ---------- SERVER RESOURCES ----------
+class ResourceSampler(threading.Thread):
+    def __init__(self, pid, interval=1.0):
+        super().__init__(daemon=True)
+        import psutil
+
+        self.proc = psutil.Process(pid)
+        self.interval = interval
+        self.samples = []
+        self._halt = threading.Event()
+        self.proc.cpu_percent(None)  # first call only primes the counter
+
+    def run(self):
+        import psutil
+
+        while not self._halt.wait(self.interval):
+            try:
+                with self.proc.oneshot():
+                    self.samples.append({
+                        "cpu_percent": self.proc.cpu_percent(None),
+                        "rss_mb": self.proc.memory_info().rss / (1024 * 1024),
+                        "threads": self.proc.num_threads(),
+                        "fds": self.proc.num_fds() if hasattr(self.proc, "num_fds") else None,
+                    })
+            except psutil.Error:
+                return
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+    def report(self):
+        if not self.samples:
+            return {}
+        out = {"samples": len(self.samples)}
+        for field in ("cpu_percent", "rss_mb", "threads", "fds"):
+            values = [s[field] for s in self.samples if s[field] is not None]
+            if values:
+                out[f"{field}_mean"] = round(sum(values) / len(values), 2)
+                out[f"{field}_max"] = round(max(values), 2)
+        return out
+
+
+def scrape_server_metrics(base_url):
+    """Totals of a few /metrics families (SQL statements, response cache outcomes)."""
+    import requests
+
+    totals = defaultdict(float)
+    try:
+        text = requests.get(base_url + "/metrics", timeout=10).text
+    except requests.RequestException:
+        return {}
+    for line in text.splitlines():
+        if line.startswith("#") or " " not in line:
+            continue
+        name, value = line.rsplit(" ", 1)
+        family = name.split("{", 1)[0]
+        if family == "db_queries_total":
+            totals["db_queries"] += float(value)
+        elif family == "http_response_cache_total":
+            result = name.split('result="', 1)[1].split('"', 1)[0]
+            totals[f"response_cache_{result}"] += float(value)
+    return dict(totals)
+
+
+# ---------- RUN ----------
+def run_load(base_url, orchestrators=2, job_rate=5.0, collectors=10, metrics_rate=1.0, alert_ratio=0.05,
+             dashboards=5, poll=5.0, duration=30.0, drain=2.0, server_pid=None):
+    rec = Recorder()
+    stop = threading.Event()
+
+    # Subscribers first, so every emitted event has its full audience
+    dash = [Dashboard(i, base_url, poll, rec) for i in range(dashboards)]
+    cols = [Collector(i, base_url, metrics_rate, alert_ratio, rec) for i in range(collectors)]
+    before = scrape_server_metrics(base_url)
+    sampler = ResourceSampler(server_pid) if server_pid else None
+
+    threads = [threading.Thread(target=orchestrator, args=(i, base_url, job_rate, rec, stop), daemon=True)
+               for i in range(orchestrators)]
+    threads += [threading.Thread(target=c.run, args=(stop,), daemon=True) for c in cols]
+    threads += [threading.Thread(target=d.poll, args=(stop,), daemon=True) for d in dash]
+
+    if sampler:
+        sampler.start()
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    time.sleep(drain)  # let in-flight broadcasts arrive
+    if sampler:
+        sampler.stop()
+
+    sent = defaultdict(int)
+    for c in cols:
+        for event, n in c.sent.items():
+            sent[event] += n
+    fanout = {}
+    for event in SOCKET_EVENTS:
+        expected = sent[event] * len(dash)
+        delivered = sum(len(d.received[event]) for d in dash)
+        fanout[event] = {
+            "emitted": sent[event],
+            "emitted_per_s": round(sent[event] / elapsed, 2),
+            "expected_deliveries": expected,
+            "delivered": delivered,
+            "dropped": expected - delivered,
+            "drop_rate": round((expected - delivered) / expected, 4) if expected else 0.0,
+        }
+    delivery = [s for d in dash for s in d.delivery]
+    if delivery:
+        fanout["delivery_latency"] = summarize(delivery)
+
+    after = scrape_server_metrics(base_url)
+    for c in cols:
+        c.close()
+    for d in dash:
+        d.close()
+
+    return {
+        "duration_s": round(elapsed, 2),
+        "http": rec.report(elapsed),
+        "socketio": fanout,
+        "server": {
+            "resources": sampler.report() if sampler else None,
+            "metrics_delta": {k: after[k] - before.get(k, 0) for k in after},
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backup Tracker end-to-end load generator")
+    parser.add_argument("--orchestrators", type=int, default=2)
+    parser.add_argument("--job-rate", type=float, default=5.0, help="jobs/s per orchestrator (0 = unthrottled)")
+    parser.add_argument("--collectors", type=int, default=10)
+    parser.add_argument("--metrics-rate", type=float, default=1.0, help="events/s per collector")
+    parser.add_argument("--alert-ratio", type=float, default=0.05)
+    parser.add_argument("--dashboards", type=int, default=5)
+    parser.add_argument("--poll", type=float, default=5.0, help="dashboard poll interval in seconds")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--url", help="target an already running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="with --url: sample this process's resources")
+    parser.add_argument("--scheduler", action="store_true", help="also run the scheduler in the server")
+    parser.add_argument("--out", help="write the JSON report to this file")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        return serve(args.serve, args.scheduler)
+
+    random.seed(42)
+    server = None
+    if args.url:
+        base_url, pid = args.url.rstrip("/"), args.server_pid
+    else:
+        server = LocalServer(args.scheduler)
+        server.wait_ready()
+        base_url, pid = server.url, server.pid
+
+    try:
+        results = run_load(
+            base_url, orchestrators=args.orchestrators, job_rate=args.job_rate,
+            collectors=args.collectors, metrics_rate=args.metrics_rate, alert_ratio=args.alert_ratio,
+            dashboards=args.dashboards, poll=args.poll, duration=args.duration, server_pid=pid,
+        )
+    finally:
+        if server:
+            server.stop()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "target": args.url or "local sqlite",
+            "config": {k: v for k, v in vars(args).items() if k not in ("out", "serve")},
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
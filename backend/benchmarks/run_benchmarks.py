@@ -0,0 +1,355 @@
+# run_benchmarks.py
+"""
+Offline benchmark suite for the backend hot paths.
+
+Runs entirely in-process against a throwaway SQLite database and temporary
+vault/restore/anomaly-log paths, so the real data under backend/ is never touched:
+
+    vault       upload / restore / verify throughput (MB/s) and peak memory per file size
+    api         /api/jobs and /api/stats latency as the job table grows
+    anomalies   /api/anomalies latency as anomaly_log.csv grows
+    collector   per-tick cost of sampling + streaming detectors + incident tracking
+    inference   lstm_inference.detect_anomaly latency (skipped if Keras/model missing)
+
+Results are printed (or written with --out) as JSON so runs from different
+commits can be diffed; --compare prints the ratio against a previous run.
+
+Usage (from backend/):
+    python -m benchmarks.run_benchmarks --out bench.json
+    python -m benchmarks.run_benchmarks --only vault,api --compare bench.json
+"""
+
+import os
+import io
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VAULT_SIZES_MB = [0.0625, 1, 8, 32]
+JOB_COUNTS = [100, 1000, 10000]
+ANOMALY_ROWS = [1000, 10000, 100000]
+REPEAT = 20
+TICKS = 500
+
+
+# ---------- HELPERS ----------
+def summarize(samples):
+    """Latency summary in milliseconds."""
+    s = sorted(samples)
+    pick = lambda q: s[min(len(s) - 1, int(q * len(s)))]
+    return {
+        "n": len(s),
+        "mean_ms": round(sum(s) / len(s) * 1000, 3),
+        "p50_ms": round(pick(0.50) * 1000, 3),
+        "p95_ms": round(pick(0.95) * 1000, 3),
+        "p99_ms": round(pick(0.99) * 1000, 3),
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def peak_alloc_mb(fn):
+    """Peak Python heap allocated while fn runs (separate pass: tracemalloc slows timing)."""
+    tracemalloc.start()
+    try:
+        fn()
+        return round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+    finally:
+        tracemalloc.stop()
+
+
+def peak_rss_mb():
+    """Process RSS high-water mark so far (it only grows across the run)."""
+    try:
+        import resource
+    except ImportError:
+        # Windows: no getrusage, psutil exposes the peak working set
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 2)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 2)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---------- ENVIRONMENT ----------
+class BenchEnv:
+    """Imports app.py against SQLite and redirects its data paths into a temp dir."""
+
+    def __init__(self, backend="local"):
+        self.tmp = tempfile.mkdtemp(prefix="tracker-bench-")
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(self.tmp, "bench.db")
+        if BACKEND_DIR not in sys.path:
+            sys.path.insert(0, BACKEND_DIR)
+
+        # Importing app no longer starts the scheduler, so no jobs race the benchmarks
+        import app as app_module
+        self.mod = app_module
+
+        import storage
+        if backend == "memory-s3":
+            storage.set_backend(storage.S3Backend("bench", client=storage.MemoryS3Client()))
+        else:
+            storage.set_backend(storage.LocalBackend(os.path.join(self.tmp, "vault")))
+        app_module.DECRYPT_DIR = os.path.join(self.tmp, "restored")
+        os.makedirs(app_module.DECRYPT_DIR, exist_ok=True)
+        app_module.ANOMALY_LOG_PATH = os.path.join(self.tmp, "anomaly_log.csv")
+
+        self.client = app_module.app.test_client()
+        with app_module.app.app_context():
+            app_module.db.create_all()
+
+    def close(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+# ---------- BENCHMARKS ----------
+def bench_vault(env, sizes_mb=VAULT_SIZES_MB, repeat=3):
+    results = []
+    for size_mb in sizes_mb:
+        payload = os.urandom(int(size_mb * 1024 * 1024))
+        mb = len(payload) / (1024 * 1024)
+        names = []
+
+        def upload():
+            resp = env.client.post(
+                "/vault/upload",
+                data={"file": (io.BytesIO(payload), "bench.bin")},
+                content_type="multipart/form-data",
+            )
+            assert resp.status_code == 200, resp.data
+            # Same-second uploads share a name and simply overwrite each other
+            names.append(resp.get_json()["filename"])
+
+        upload_s = timed(upload, repeat)
+        name = names[-1]
+
+        def restore():
+            resp = env.client.get(f"/vault/restore/{name}")
+            assert resp.status_code == 200, resp.data
+            resp.get_data()
+            resp.close()
+
+        def verify():
+            assert env.client.get(f"/vault/verify/{name}").get_json()["verified"]
+
+        restore_s = timed(restore, repeat)
+        verify_s = timed(verify, repeat)
+
+        results.append({
+            "size_mb": round(mb, 4),
+            "upload_mb_s": round(mb / (sum(upload_s) / len(upload_s)), 2),
+            "restore_mb_s": round(mb / (sum(restore_s) / len(restore_s)), 2),
+            "verify_mb_s": round(mb / (sum(verify_s) / len(verify_s)), 2),
+            "upload_peak_alloc_mb": peak_alloc_mb(upload),
+            "restore_peak_alloc_mb": peak_alloc_mb(restore),
+            "peak_rss_mb": peak_rss_mb(),
+        })
+    return results
+
+
+def _seed_jobs(env, total):
+    mod = env.mod
+    with mod.app.app_context():
+        current = mod.BackupJob.query.count()
+        if total > current:
+            now = datetime.now()
+            mod.db.session.bulk_insert_mappings(mod.BackupJob, [
+                {
+                    "job_name": f"bench_job_{i}",
+                    "status": random.choice(["SUCCESS", "FAILED", "PENDING"]),
+                    "timestamp": now - timedelta(seconds=i),
+                }
+                for i in range(current, total)
+            ])
+            # bulk_insert_mappings skips the flush hook that invalidates cached reads
+            from database import bump_revision
+            bump_revision("jobs")
+            mod.db.session.commit()
+
+
+def bench_api(env, counts=JOB_COUNTS, repeat=REPEAT):
+    results = []
+    for count in counts:
+        _seed_jobs(env, count)
+        for route in ("/api/jobs", "/api/stats"):
+            # cold: body rebuilt every time; warm: served from the response cache
+            def cold():
+                env.mod.response_cache.CACHE.clear()
+                return env.client.get(route).get_data()
+            samples = timed(cold, repeat)
+            results.append({"route": route, "rows": count, "cache": "cold", **summarize(samples)})
+            samples = timed(lambda: env.client.get(route).get_data(), repeat)
+            results.append({"route": route, "rows": count, "cache": "warm", **summarize(samples)})
+    return results
+
+
+def _write_anomaly_log(path, rows):
+    start = datetime(2025, 1, 1)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["timestamp", "source", "metric", "value", "cpu_percent",
+                         "ram_percent", "disk_percent", "severity", "trend"])
+        for i in range(rows):
+            ts = (start + timedelta(seconds=5 * i)).strftime("%Y-%m-%d %H:%M:%S")
+            cpu = round(random.uniform(5, 95), 2)
+            writer.writerow([ts, "Rule-Based", "CPU", cpu, cpu, 60.0, 40.0, "High", "Stable"])
+
+
+def bench_anomalies(env, sizes=ANOMALY_ROWS, repeat=REPEAT):
+    results = []
+    for rows in sizes:
+        _write_anomaly_log(env.mod.ANOMALY_LOG_PATH, rows)
+        def cold():
+            env.mod.response_cache.CACHE.clear()
+            return env.client.get("/api/anomalies").get_data()
+        samples = timed(cold, repeat)
+        results.append({"route": "/api/anomalies", "log_rows": rows, "cache": "cold", **summarize(samples)})
+        samples = timed(lambda: env.client.get("/api/anomalies").get_data(), repeat)
+        results.append({"route": "/api/anomalies", "log_rows": rows, "cache": "warm", **summarize(samples)})
+    return results
+
+
+def bench_collector(ticks=TICKS):
+    """Per-tick cost of the collector's non-ML work (sampling, detectors, incidents)."""
+    from anomaly_detector.host_sampler import HostSampler
+    from anomaly_detector.detectors import load_pipeline
+    from anomaly_detector.incidents import IncidentTracker
+
+    sampler = HostSampler()
+    pipeline = load_pipeline()
+    incidents = IncidentTracker()
+
+    snap_s, detect_s = [], []
+    for _ in range(ticks):
+        t0 = time.perf_counter()
+        sample = sampler.snapshot()
+        t1 = time.perf_counter()
+        for f in pipeline.evaluate(sample):
+            incidents.observe(f.source, f.metric, f.value, f.severity)
+        incidents.sweep()
+        t2 = time.perf_counter()
+        snap_s.append(t1 - t0)
+        detect_s.append(t2 - t1)
+    return [
+        {"stage": "snapshot", **summarize(snap_s)},
+        {"stage": "detectors+incidents", **summarize(detect_s)},
+        {"stage": "tick_total", **summarize([a + b for a, b in zip(snap_s, detect_s)])},
+    ]
+
+
+def bench_inference(repeat=REPEAT):
+    try:
+        from anomaly_detector import lstm_inference
+        lstm_inference._ensure_loaded()
+    except Exception as e:
+        return {"skipped": f"{type(e).__name__}: {e}"}
+
+    features = lstm_inference.model_features()
+    window = [{f: random.uniform(0, 100) for f in features} for _ in range(lstm_inference.WINDOW_SIZE)]
+    sample = window[-1]
+    lstm_inference.detect_anomaly_sample(sample, window)  # warm-up (graph tracing)
+    samples = timed(lambda: lstm_inference.detect_anomaly_sample(sample, window), repeat)
+    return [{"call": "detect_anomaly_sample", "features": len(features), **summarize(samples)}]
+
+
+SUITES = ["vault", "api", "anomalies", "collector", "inference"]
+
+
+# ---------- COMPARISON ----------
+def compare(current, baseline_path):
+    """Print current/baseline ratios for every numeric *_ms and *_mb_s field."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    for suite, rows in current["results"].items():
+        base_rows = baseline.get("results", {}).get(suite)
+        if not isinstance(rows, list) or not isinstance(base_rows, list):
+            continue
+        for row, base in zip(rows, base_rows):
+            label = {k: v for k, v in row.items() if not isinstance(v, float) and k != "n"}
+            for key, value in row.items():
+                if (key.endswith("_ms") or key.endswith("_mb_s")) and base.get(key):
+                    ratio = value / base[key]
+                    print(f"{suite:10s} {json.dumps(label):50s} {key:14s} {ratio:6.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backup Tracker backend benchmarks")
+    parser.add_argument("--only", help=f"comma-separated subset of {','.join(SUITES)}")
+    parser.add_argument("--out", help="write JSON results to this file")
+    parser.add_argument("--compare", help="previous JSON results to compare against")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes for a fast smoke run")
+    parser.add_argument("--backend", choices=["local", "memory-s3"], default="local",
+                        help="vault storage backend for the vault suite")
+    args = parser.parse_args(argv)
+
+    suites = args.only.split(",") if args.only else SUITES
+    random.seed(42)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "backend": args.backend,
+        },
+        "results": {},
+    }
+
+    env = BenchEnv(args.backend) if {"vault", "api", "anomalies"} & set(suites) else None
+    try:
+        if "vault" in suites:
+            sizes = VAULT_SIZES_MB[:2] if args.quick else VAULT_SIZES_MB
+            report["results"]["vault"] = bench_vault(env, sizes)
+        if "api" in suites:
+            report["results"]["api"] = bench_api(env, JOB_COUNTS[:2] if args.quick else JOB_COUNTS)
+        if "anomalies" in suites:
+            report["results"]["anomalies"] = bench_anomalies(env, ANOMALY_ROWS[:2] if args.quick else ANOMALY_ROWS)
+        if "collector" in suites:
+            report["results"]["collector"] = bench_collector(50 if args.quick else TICKS)
+        if "inference" in suites:
+            report["results"]["inference"] = bench_inference()
+    finally:
+        if env:
+            env.close()
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    print(text)
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
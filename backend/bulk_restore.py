@@ -0,0 +1,307 @@
+# bulk_restore.py
+"""
+Bulk restore of vault objects as one streamed tar or zip archive.
+
+A selection is either an explicit list of vault files, every upload under
+a key prefix, or a whole snapshot. Objects are fetched and decrypted by a
+small thread pool while the archive is being written: at most READ_AHEAD
+decrypted objects are held at once, and archive bytes are handed to the
+caller as soon as they are written, so memory stays flat however many
+files are restored and nothing is staged under restored/. Chunked
+uploads are not held whole at all: their tokens are decrypted and
+written into the member one at a time.
+
+An object that fails to load or decrypt does not abort the archive; it is
+listed in a trailing restore_errors.json member instead. One that fails
+part-way through streaming keeps its member, zero-padded in a tar.
+
+Usage (from backend/):
+    python bulk_restore.py --snapshot data_20250101_020000 data.tar
+    python bulk_restore.py --prefix report.csv_ --format zip reports.zip
+    python bulk_restore.py --files a.txt_20250101_020000.enc b.txt_20250101_020000.enc out.tar
+"""
+
+import os
+import sys
+import json
+import time
+import tarfile
+import zipfile
+import logging
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+import vault_crypto
+
+logger = logging.getLogger("BackupTracker")
+
+RESTORE_WORKERS = int(os.environ.get("VAULT_RESTORE_WORKERS", 4))
+READ_AHEAD = int(os.environ.get("VAULT_RESTORE_READ_AHEAD", 2 * RESTORE_WORKERS))
+
+FORMATS = {"tar": "application/x-tar", "zip": "application/zip"}
+ERRORS_MEMBER = "restore_errors.json"
+
+try:
+    from instrumentation import VAULT_BYTES, VAULT_LATENCY
+except ImportError:
+    VAULT_BYTES = VAULT_LATENCY = None
+
+
+class RestoreItem:
+    """One archive member: where it goes and how to get its plaintext.
+
+    load() returns (size, iterator of plaintext chunks), like vault_crypto.iter_decrypt.
+    """
+
+    __slots__ = ("arcname", "load", "mode", "mtime")
+
+    def __init__(self, arcname, load, mode=0o644, mtime=None):
+        self.arcname = arcname
+        self.load = load
+        self.mode = mode
+        self.mtime = mtime if mtime is not None else time.time()
+
+
+# ---------- SELECTION ----------
+def _upload_item(backend, info):
+    # Same naming as /vault/restore/<filename>
+    return RestoreItem(info.key.replace(".enc", ""), lambda: vault_crypto.iter_decrypt(info.key, backend),
+                       mtime=info.modified)
+
+
+def _whole(data):
+    return len(data), iter((data,))
+
+
+def select_files(names, backend=None):
+    """Items for explicit vault keys; raises FileNotFoundError naming the first missing one."""
+    backend = backend or storage.get_backend()
+    items = []
+    for name in names:
+        try:
+            info = backend.stat(name)
+        except ValueError:
+            info = None
+        if info is None:
+            raise FileNotFoundError(name)
+        items.append(_upload_item(backend, info))
+    return items
+
+
+def select_prefix(prefix, backend=None):
+    """Items for every top-level upload whose key starts with `prefix` (integrity sidecars excluded)."""
+    backend = backend or storage.get_backend()
+    listing = sorted(backend.list(prefix, recursive=False), key=lambda i: i.key)
+    return [_upload_item(backend, info) for info in listing
+            if not info.key.endswith(".hash") and "/" not in info.key]
+
+
+def select_snapshot(snapshot_id):
+    """Items for every file of a snapshot, under a <snapshot_id>/ directory."""
+    import snapshots
+
+    manifest = snapshots.load_manifest(snapshot_id)
+    return [
+        RestoreItem(f"{snapshot_id}/{f['path']}", lambda d=f["digest"]: _whole(snapshots.read_object(d)),
+                    mode=f["mode"], mtime=f["mtime_ns"] / 1e9)
+        for f in manifest["files"]
+    ]
+
+
+# ---------- PIPELINE ----------
+def _open(item):
+    size, chunks = item.load()
+    if size is None:
+        # Chunked upload from before sizes were recorded; a tar header needs one
+        return _whole(b"".join(chunks))
+    return size, chunks
+
+
+def _load(item):
+    if VAULT_LATENCY is None:
+        return _open(item)
+    with VAULT_LATENCY.time(op="decrypt"):
+        size, chunks = _open(item)
+    VAULT_BYTES.inc(size, op="decrypt")
+    return size, chunks
+
+
+def iter_decrypted(items, workers=RESTORE_WORKERS, read_ahead=READ_AHEAD):
+    """Yield (item, (size, chunks), error) in order, opening up to `read_ahead` items ahead."""
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = deque()
+        for item in items:
+            pending.append((item, pool.submit(_load, item)))
+            if len(pending) >= max(1, read_ahead):
+                break
+        while pending:
+            item, fut = pending.popleft()
+            try:
+                yield item, fut.result(), None
+            except Exception as e:
+                yield item, None, e
+            nxt = next(items, None)
+            if nxt is not None:
+                pending.append((nxt, pool.submit(_load, nxt)))
+
+
+class _Sink:
+    """Write-only file object that hands written bytes back to the generator."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        out = b"".join(self._chunks)
+        self._chunks.clear()
+        return out
+
+
+def _safe_arcname(name):
+    # Members never escape the extraction directory
+    parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+    return "/".join(parts) or "unnamed"
+
+
+class StreamError(Exception):
+    """A member's plaintext stopped matching its recorded size."""
+
+
+def _member_chunks(size, chunks):
+    """Pass `chunks` through, raising StreamError if they do not add up to `size` bytes."""
+    sent = 0
+    for chunk in chunks:
+        if sent + len(chunk) > size:
+            raise StreamError(f"more data than the recorded {size} bytes")
+        sent += len(chunk)
+        yield chunk
+    if sent != size:
+        raise StreamError(f"{sent} of {size} bytes")
+
+
+def _tar_member(name, size, chunks, mode, mtime):
+    """Generator of one ustar/pax member; returns an error message if the data fell short."""
+    info = tarfile.TarInfo(name)
+    info.size, info.mode, info.mtime = size, mode, int(mtime)
+    yield info.tobuf(tarfile.DEFAULT_FORMAT, tarfile.ENCODING, "surrogateescape")
+    sent, error = 0, None
+    try:
+        for chunk in _member_chunks(size, chunks):
+            sent += len(chunk)
+            yield chunk
+    except Exception as e:
+        error = str(e) or type(e).__name__
+        # The header already promised `size` bytes
+        yield bytes(size - sent)
+    remainder = size % tarfile.BLOCKSIZE
+    if remainder:
+        yield bytes(tarfile.BLOCKSIZE - remainder)
+    return error
+
+
+def _tar_end(written):
+    # Two zero blocks, padded to a whole record like tarfile's stream mode
+    end = 2 * tarfile.BLOCKSIZE
+    return bytes(end + (-(written + end)) % tarfile.RECORDSIZE)
+
+
+def stream_archive(items, fmt="tar", workers=RESTORE_WORKERS, read_ahead=READ_AHEAD):
+    """Generator of archive bytes for `items`."""
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {list(FORMATS)}")
+    errors = []
+
+    if fmt == "tar":
+        written = 0
+
+        def add(name, size, chunks, mode, mtime):
+            nonlocal written
+            member = _tar_member(name, size, chunks, mode, mtime)
+            while True:
+                try:
+                    block = next(member)
+                except StopIteration as done:
+                    return done.value
+                written += len(block)
+                yield block
+
+        def finish():
+            yield _tar_end(written)
+    else:
+        sink = _Sink()
+        archive = zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED)
+
+        def add(name, size, chunks, mode, mtime):
+            info = zipfile.ZipInfo(name, time.localtime(max(mtime, 315532800))[:6])
+            info.external_attr = (0o100000 | mode) << 16
+            info.file_size = size  # picks zip64 up front for large members
+            error = None
+            with archive.open(info, "w") as member:
+                try:
+                    for chunk in _member_chunks(size, chunks):
+                        member.write(chunk)
+                        yield sink.drain()
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+            yield sink.drain()
+            return error
+
+        def finish():
+            archive.close()
+            yield sink.drain()
+
+    def record(name, error):
+        logger.error("Bulk restore of %s failed: %s", name, error)
+        errors.append({"file": name, "error": error})
+
+    for item, loaded, error in iter_decrypted(items, workers, read_ahead):
+        if error is not None:
+            record(item.arcname, str(error) or type(error).__name__)
+            continue
+        size, chunks = loaded
+        failed = yield from add(_safe_arcname(item.arcname), size, chunks, item.mode, item.mtime)
+        del loaded, chunks
+        if failed:
+            record(item.arcname, failed)
+    if errors:
+        report = json.dumps(errors, indent=2).encode("utf-8")
+        yield from add(ERRORS_MEMBER, len(report), iter((report,)), 0o644, time.time())
+    yield from finish()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Restore many vault objects into one archive")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--files", nargs="+")
+    source.add_argument("--prefix")
+    source.add_argument("--snapshot")
+    parser.add_argument("--format", choices=list(FORMATS), default="tar")
+    parser.add_argument("--workers", type=int, default=RESTORE_WORKERS)
+    parser.add_argument("output")
+    args = parser.parse_args(argv)
+
+    if args.snapshot:
+        items = select_snapshot(args.snapshot)
+    elif args.prefix is not None:
+        items = select_prefix(args.prefix)
+    else:
+        items = select_files(args.files)
+    with open(args.output, "wb") as f:
+        for chunk in stream_archive(items, args.format, args.workers, 2 * args.workers):
+            f.write(chunk)
+    print(f"Restored {len(items)} files to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+# chunked_upload.py
+"""
+Resumable chunked uploads into the vault.
+
+Protocol (see the /vault/uploads routes in app.py):
+
+    POST   /vault/uploads                  {"filename", "size"?}  -> upload_id, part_size
+    PUT    /vault/uploads/<id>?offset=N    raw part body, X-Content-SHA256: <hex of the part>
+    GET    /vault/uploads/<id>             next_offset to resume from
+    POST   /vault/uploads/<id>/complete    -> the stored vault file name
+    DELETE /vault/uploads/<id>
+
+Each upload session gets one data key (wrapped by the master key, like any
+vault object). Every part is checked against its SHA-256, encrypted with
+that key into a single Fernet token and persisted under uploads/<id>/ as
+soon as it arrives, so an interrupted transfer resumes from the last
+acknowledged offset and the server holds at most one part in memory.
+
+Completing the upload streams the stored tokens, newline-separated, into
+the final "<file>_<timestamp>.enc" object (framing "lines" and the
+plaintext size in its envelope header). Parts are not decrypted or
+re-encrypted on completion, and restores decrypt them token by token
+(vault_crypto.iter_decrypt).
+
+API workers may run in separate processes or on separate hosts, so the
+per-upload lock that applies parts one at a time lives in the storage
+backend itself: an uploads/<id>/lock object created with a create-only
+write (storage.StorageBackend.create). A lock older than
+VAULT_UPLOAD_LOCK_TTL seconds was left by a dead worker and is broken.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+from datetime import datetime
+from contextlib import contextmanager
+
+import storage
+import vault_crypto
+
+PART_SIZE = int(float(os.environ.get("VAULT_UPLOAD_PART_SIZE_MB", 8)) * 1024 * 1024)
+SESSION_TTL_HOURS = float(os.environ.get("VAULT_UPLOAD_TTL_HOURS", 48))
+# Far longer than storing one part takes; a lock this old belongs to a dead worker
+LOCK_TTL_SECONDS = float(os.environ.get("VAULT_UPLOAD_LOCK_TTL", 300))
+LOCK_WAIT_SECONDS = 30
+UPLOAD_PREFIX = "uploads/"
+UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadError(Exception):
+    """Rejected request; `status` is the HTTP status the API answers with."""
+
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+
+def session_key(upload_id):
+    return f"{UPLOAD_PREFIX}{upload_id}/session.json"
+
+
+def part_key(upload_id, offset):
+    # Zero-padded so a listing returns parts in offset order
+    return f"{UPLOAD_PREFIX}{upload_id}/{offset:016d}.part"
+
+
+def lock_key(upload_id):
+    return f"{UPLOAD_PREFIX}{upload_id}/lock"
+
+
+@contextmanager
+def _lock(upload_id, backend):
+    """Apply one upload's requests one at a time, across every API worker."""
+    if not UPLOAD_ID_RE.match(upload_id):
+        raise UploadError(f"Unknown upload {upload_id}", 404)
+    key = lock_key(upload_id)
+    owner = uuid.uuid4().hex.encode()
+    deadline = time.monotonic() + LOCK_WAIT_SECONDS
+    while not backend.create(key, owner):
+        info = backend.stat(key)
+        if info is not None and time.time() - (info.modified or 0) > LOCK_TTL_SECONDS:
+            backend.delete(key)
+            continue
+        if time.monotonic() > deadline:
+            raise UploadError("Upload is busy; retry the request", 423)
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        try:
+            # Completing or aborting deletes the lock with the rest of the session
+            if backend.get(key) == owner:
+                backend.delete(key)
+        except FileNotFoundError:
+            pass
+
+
+# ---------- SESSIONS ----------
+def _save(session, header, backend):
+    # The envelope header rides on the session object, so key rotation re-wraps it
+    backend.put(session_key(session["upload_id"]), json.dumps(session).encode("utf-8"), header)
+
+
+def _current_header(upload_id, backend):
+    """The session's envelope header as stored right now, wrapped under the active master key.
+
+    A key rotation may have re-wrapped it since the request loaded the
+    session; writing back that earlier copy would undo the rotation.
+    """
+    info = backend.stat(session_key(upload_id))
+    if info is None or not vault_crypto.is_envelope(info.metadata):
+        raise UploadError(f"Unknown upload {upload_id}", 404)
+    header = info.metadata
+    keyring = vault_crypto.get_keyring()
+    if header["kid"] != keyring.active:
+        kid, wrapped = vault_crypto.wrap_key(vault_crypto.unwrap_key(header, keyring), keyring)
+        header = {**header, "kid": kid, "dek": wrapped}
+    return header
+
+
+def load_session(upload_id, backend=None):
+    """(session, envelope header); raises UploadError(404) for unknown uploads."""
+    backend = backend or storage.get_backend()
+    info = backend.stat(session_key(upload_id)) if UPLOAD_ID_RE.match(upload_id) else None
+    if info is None or not vault_crypto.is_envelope(info.metadata):
+        raise UploadError(f"Unknown upload {upload_id}", 404)
+    return json.loads(backend.get(session_key(upload_id))), info.metadata
+
+
+def status(session):
+    return {
+        "upload_id": session["upload_id"],
+        "filename": session["filename"],
+        "size": session["size"],
+        "part_size": session["part_size"],
+        "next_offset": session["next_offset"],
+        "parts": len(session["parts"]),
+        "created": session["created"],
+    }
+
+
+def init_upload(filename, size=None, backend=None):
+    filename = os.path.basename(filename or "")
+    if not filename:
+        raise UploadError("filename is required")
+    if size is not None and (not isinstance(size, int) or size < 0):
+        raise UploadError("size must be a non-negative integer")
+    backend = backend or storage.get_backend()
+    _, header = vault_crypto.new_data_key()
+    session = {
+        "upload_id": uuid.uuid4().hex,
+        "filename": filename,
+        "size": size,
+        "part_size": PART_SIZE,
+        "next_offset": 0,
+        "parts": [],  # [offset, length, sha256 of the plaintext]
+        "created": time.time(),
+    }
+    _save(session, header, backend)
+    return status(session)
+
+
+def put_part(upload_id, offset, data, checksum, backend=None):
+    """Verify, encrypt and persist one part at `offset`; returns the new status.
+
+    Parts must arrive in order. Re-sending an already stored part (a retry
+    whose response was lost) is accepted as long as the checksum matches.
+    """
+    from cryptography.fernet import Fernet
+
+    backend = backend or storage.get_backend()
+    if not checksum:
+        raise UploadError("X-Content-SHA256 header is required")
+    if hashlib.sha256(data).hexdigest() != checksum.lower():
+        raise UploadError("Checksum mismatch", 400)
+
+    with _lock(upload_id, backend):
+        session, header = load_session(upload_id, backend)
+        if len(data) > session["part_size"]:
+            raise UploadError(f"Part larger than {session['part_size']} bytes", 413)
+        for start, length, digest in session["parts"]:
+            if start == offset:
+                if length == len(data) and digest == checksum.lower():
+                    return status(session)
+                break
+        if offset != session["next_offset"]:
+            raise UploadError("Unexpected offset", 409, next_offset=session["next_offset"])
+        if not data:
+            raise UploadError("Empty part")
+        if session["size"] is not None and offset + len(data) > session["size"]:
+            raise UploadError("Part runs past the declared size", 400)
+
+        token = Fernet(vault_crypto.unwrap_key(header)).encrypt(data)
+        backend.put(part_key(upload_id, offset), token)
+        session["parts"].append([offset, len(data), checksum.lower()])
+        session["next_offset"] = offset + len(data)
+        _save(session, _current_header(upload_id, backend), backend)
+        return status(session)
+
+
+def complete_upload(upload_id, backend=None):
+    """Assemble the parts into the final vault object; returns its name, size and hash."""
+    backend = backend or storage.get_backend()
+    with _lock(upload_id, backend):
+        session, _ = load_session(upload_id, backend)
+        received = session["next_offset"]
+        if session["size"] is not None and received != session["size"]:
+            raise UploadError("Upload incomplete", 409, next_offset=received)
+        if not session["parts"]:
+            raise UploadError("No parts uploaded", 409, next_offset=0)
+
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        encrypted_name = f"{session['filename']}_{ts}.enc"
+        sha = hashlib.sha256()
+
+        def tokens():
+            renewed = time.monotonic()
+            for start, _, _ in session["parts"]:
+                if time.monotonic() - renewed > LOCK_TTL_SECONDS / 4:
+                    # Assembling a large upload can outlast the TTL; keep the lock fresh
+                    backend.touch(lock_key(upload_id))
+                    renewed = time.monotonic()
+                framed = backend.get(part_key(upload_id, start)) + b"\n"
+                sha.update(framed)
+                yield framed
+
+        header = _current_header(upload_id, backend)
+        backend.put_stream(encrypted_name, tokens(),
+                           {**header, "framing": vault_crypto.FRAMING_LINES, "size": received})
+        # Same integrity sidecar as a single-request upload
+        backend.put(encrypted_name + ".hash", sha.hexdigest().encode())
+        _discard(upload_id, backend)
+    return {"filename": encrypted_name, "size": received, "sha256": sha.hexdigest()}
+
+
+def _discard(upload_id, backend):
+    keys = [o.key for o in backend.list(f"{UPLOAD_PREFIX}{upload_id}/")]
+    backend.delete_many(keys)
+
+
+def abort_upload(upload_id, backend=None):
+    backend = backend or storage.get_backend()
+    load_session(upload_id, backend)
+    _discard(upload_id, backend)
+
+
+def expire_sessions(max_age_hours=SESSION_TTL_HOURS, backend=None):
+    """Drop uploads not touched for `max_age_hours`; returns how many."""
+    backend = backend or storage.get_backend()
+    cutoff = time.time() - max_age_hours * 3600
+    expired = [o.key.split("/")[1] for o in backend.list(UPLOAD_PREFIX)
+               if o.key.endswith("/session.json") and (o.modified or 0) < cutoff]
+    for upload_id in expired:
+        _discard(upload_id, backend)
+    return len(expired)
@@ -0,0 +1,194 @@
+# cluster.py
+"""
+Multi-worker support for the API.
+
+Run several app.py processes (or `gunicorn -k eventlet 'app:create_app()'`
+workers) behind a load balancer with sticky sessions, all pointed at the
+same DATABASE_URL and SOCKETIO_MESSAGE_QUEUE. Create the tables once with
+`flask --app app init-db` (workers started with START_SCHEDULER=1 also do it):
+
+* Socket.IO fan-out  every worker publishes broadcasts to a shared message
+                     queue (redis://, amqp://, kafka://, zmq+tcp:// — any URL
+                     Flask-SocketIO understands), so a client on worker A
+                     sees events emitted on worker B. `local://` selects an
+                     in-process bus for several servers in one process.
+                     Flask-SocketIO's test client refuses any message queue,
+                     so tests leave SOCKETIO_MESSAGE_QUEUE unset.
+* Leader election    a row in scheduler_lease acts as a renewable lease.
+                     Every worker runs the scheduler, but only the lease
+                     holder executes jobs, so update_jobs and alert e-mails
+                     fire once per interval for the whole deployment. A
+                     crashed leader is replaced once its lease expires.
+                     Expiry is computed on the database clock; a worker
+                     stops acting as leader LEASE_MARGIN_SECONDS before
+                     the lease it last saw could run out, by its own
+                     monotonic clock, even if a renewal is stuck.
+"""
+
+import os
+import time
+import uuid
+import queue
+import socket
+import pickle
+import logging
+import threading
+from datetime import timedelta
+
+import socketio
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from database import db, SchedulerLease
+
+logger = logging.getLogger("BackupTracker")
+
+MESSAGE_QUEUE_URL = os.environ.get("SOCKETIO_MESSAGE_QUEUE", "")
+LEASE_NAME = "scheduler"
+LEASE_TTL_SECONDS = float(os.environ.get("SCHEDULER_LEASE_TTL", 30))
+LEASE_RENEW_SECONDS = LEASE_TTL_SECONDS / 3
+# Covers clock-rate drift and a slow renewal round-trip
+LEASE_MARGIN_SECONDS = float(os.environ.get("SCHEDULER_LEASE_MARGIN", LEASE_TTL_SECONDS / 6))
+
+
+# ---------- SOCKET.IO MESSAGE QUEUE ----------
+class LocalBus:
+    """In-process pub/sub: every subscriber gets its own queue of published messages."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, channel):
+        q = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(q)
+        return q
+
+    def publish(self, channel, message):
+        with self._lock:
+            targets = list(self._subscribers.get(channel, ()))
+        for q in targets:
+            q.put(message)
+
+
+LOCAL_BUS = LocalBus()
+
+
+class LocalPubSubManager(socketio.PubSubManager):
+    """Stand-in for the Redis/Kombu managers; several Socket.IO servers in one
+    process share broadcasts through LOCAL_BUS."""
+
+    name = "local"
+
+    def __init__(self, channel="socketio", write_only=False, logger=None, bus=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.bus = bus or LOCAL_BUS
+        self._queue = None if write_only else self.bus.subscribe(channel)
+
+    def _publish(self, data):
+        # Pickled like the network managers, so handlers never share objects
+        self.bus.publish(self.channel, pickle.dumps(data))
+
+    def _listen(self):
+        while True:
+            yield self._queue.get()
+
+
+def socketio_options(url=None):
+    """Keyword arguments for SocketIO.init_app() selecting the message queue."""
+    url = MESSAGE_QUEUE_URL if url is None else url
+    if not url:
+        return {}
+    if url.startswith("local://"):
+        return {"client_manager": LocalPubSubManager(channel=url[len("local://"):] or "socketio")}
+    return {"message_queue": url}
+
+
+# ---------- LEADER ELECTION ----------
+def db_now():
+    """Current time on the database server, shared by every worker."""
+    return db.session.execute(select(func.now())).scalar()
+
+
+class LeaderLease:
+    """Renewable DB lease; `is_leader` is true only while this worker holds it.
+
+    Acquire and renew are a single conditional UPDATE, so two workers can
+    never both see rowcount == 1 for the same lease period. Timestamps in
+    the table come from `clock` (the database clock by default), never the
+    worker's wall clock, so skewed hosts agree on when a lease expires.
+    """
+
+    def __init__(self, name=LEASE_NAME, ttl=LEASE_TTL_SECONDS, worker_id=None, clock=db_now,
+                 margin=LEASE_MARGIN_SECONDS, monotonic=time.monotonic):
+        self.name = name
+        self.ttl = ttl
+        self.margin = margin
+        # pid alone can repeat across containers, hence the random suffix
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.clock = clock
+        self.monotonic = monotonic
+        self._valid_until = None  # local monotonic deadline of the lease we hold
+
+    @property
+    def is_leader(self):
+        return self._valid_until is not None and self.monotonic() < self._valid_until
+
+    def _try_update(self, now):
+        table = SchedulerLease.__table__
+        result = db.session.execute(
+            table.update()
+            .where(table.c.name == self.name)
+            .where((table.c.holder == self.worker_id) | (table.c.expires_at <= now))
+            .values(holder=self.worker_id, expires_at=now + timedelta(seconds=self.ttl))
+        )
+        return result.rowcount == 1
+
+    def heartbeat(self):
+        """Acquire or renew the lease; call every LEASE_RENEW_SECONDS inside an app context."""
+        was_leader = self.is_leader
+        # Taken before the round-trip, so the local deadline never outlives the row
+        started = self.monotonic()
+        try:
+            now = self.clock()
+            acquired = self._try_update(now)
+            if not acquired and db.session.get(SchedulerLease, self.name) is None:
+                db.session.add(SchedulerLease(
+                    name=self.name, holder=self.worker_id, expires_at=now + timedelta(seconds=self.ttl)
+                ))
+                acquired = True
+            db.session.commit()
+        except IntegrityError:
+            # Another worker inserted the row first
+            db.session.rollback()
+            logger.info("Worker %s lost the race to create the scheduler lease", self.worker_id)
+            acquired = False
+        except SQLAlchemyError as e:
+            # Unreachable DB: step down rather than risk two leaders
+            db.session.rollback()
+            logger.warning("Leader lease heartbeat failed: %s", e)
+            acquired = False
+
+        self._valid_until = started + self.ttl - self.margin if acquired else None
+        if acquired != was_leader:
+            logger.info("Worker %s %s scheduler leadership", self.worker_id, "took" if acquired else "lost")
+        return acquired
+
+    def release(self):
+        """Give the lease up immediately (clean shutdown) so another worker takes over."""
+        if self._valid_until is None:
+            return
+        self._valid_until = None
+        table = SchedulerLease.__table__
+        try:
+            db.session.execute(
+                table.update()
+                .where(table.c.name == self.name)
+                .where(table.c.holder == self.worker_id)
+                .values(expires_at=self.clock())
+            )
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.warning("Could not release the scheduler lease: %s", e)
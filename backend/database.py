@@ -1,4 +1,9 @@
+import logging
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
 
 # Create a single shared SQLAlchemy instance
 db = SQLAlchemy()
@@ -10,3 +15,58 @@ class BackupJob(db.Model):
     status = db.Column(db.String(20), default='PENDING')
     timestamp = db.Column(db.DateTime, server_default=db.func.now())
     logs = db.Column(db.Text)
+
+
+class SchedulerLease(db.Model):
+    """Leader lease for the scheduler when several API workers share the DB (see cluster.py)."""
+    __tablename__ = 'scheduler_lease'
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+class DataRevision(db.Model):
+    """Per-table change counter; read APIs use it as a cheap cache key (see response_cache.py)."""
+    __tablename__ = 'data_revision'
+    name = db.Column(db.String(50), primary_key=True)
+    revision = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Tables whose ORM changes bump a revision, by model
+REVISIONED = {BackupJob: "jobs"}
+
+
+def bump_revision(name, connection=None):
+    """Increment `name`'s revision inside the current transaction.
+
+    Called automatically for ORM changes to REVISIONED models; bulk writes
+    that bypass the unit of work (bulk_insert_mappings, Core statements)
+    must call it themselves before committing.
+    """
+    conn = connection or db.session.connection()
+    table = DataRevision.__table__
+    result = conn.execute(table.update().where(table.c.name == name)
+                          .values(revision=table.c.revision + 1))
+    if result.rowcount == 0:
+        conn.execute(table.insert().values(name=name, revision=1))
+
+
+def get_revision(name):
+    """Current revision of `name`, or None if it cannot be read (callers then skip caching)."""
+    try:
+        return db.session.execute(
+            db.select(DataRevision.revision).where(DataRevision.name == name)
+        ).scalar() or 0
+    except SQLAlchemyError as e:
+        # e.g. data_revision not created yet on this database
+        db.session.rollback()
+        logging.getLogger("BackupTracker").warning("Revision of %s unavailable: %s", name, e)
+        return None
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_revisions(session, flush_context):
+    changed = {REVISIONED[type(obj)] for obj in (*session.new, *session.dirty, *session.deleted)
+               if type(obj) in REVISIONED}
+    for name in changed:
+        bump_revision(name, session.connection())
@@ -0,0 +1,357 @@
+# instrumentation.py
+"""
+Lightweight Prometheus-style instrumentation (no client library needed).
+
+Counters, gauges and histograms live in a process-wide registry and are
+rendered in the Prometheus text exposition format at /metrics. Updates are
+a dict lookup plus a lock-protected add, so they are cheap enough to leave
+on under full load.
+
+    init_app(app)              per-route request counters/latency + /metrics
+    instrument_sqlalchemy()    query count and latency for every engine
+    timed(hist, **labels)      decorator / context manager for hot paths
+    start_metrics_server(port) /metrics for processes without Flask (collector)
+"""
+
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, fn=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self._fn = fn  # optional callable evaluated at scrape time (unlabelled gauges)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        lines = self.header()
+        if self._fn is not None:
+            try:
+                lines.append(f"{self.name} {self._fn()}")
+            except Exception:
+                pass
+            return lines
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket (non-cumulative) counts + overflow, sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, {'le': bound})} {cumulative}")
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, {'le': '+Inf'})} {count}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, hist, labels):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.hist.time(**self.labels):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+def timed(hist, **labels):
+    """`with timed(h, op="x"):` or `@timed(h, op="x")`."""
+    return hist.time(**labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ---------- SHARED METRICS ----------
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests handled", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+DB_QUERIES = Counter("db_queries_total", "SQL statements executed", ("operation",))
+DB_LATENCY = Histogram("db_query_duration_seconds", "SQL statement latency", ("operation",))
+DB_ERRORS = Counter("db_query_errors_total", "SQL statements that raised", ("operation",))
+JOB_RUNS = Counter("scheduler_job_runs_total", "Scheduled job runs", ("job", "outcome"))
+JOB_LATENCY = Histogram("scheduler_job_duration_seconds", "Scheduled job duration", ("job",),
+                        buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600))
+VAULT_BYTES = Counter("vault_bytes_total", "Plaintext bytes through vault crypto", ("op",))
+VAULT_LATENCY = Histogram("vault_operation_duration_seconds", "Vault crypto/IO duration", ("op",))
+INFERENCE_LATENCY = Histogram("anomaly_inference_duration_seconds", "LSTM detect_anomaly latency", ("model",))
+INFERENCE_RESULTS = Counter("anomaly_inference_total", "LSTM detect_anomaly results", ("label",))
+
+
+def _process_rss():
+    import psutil
+    return psutil.Process().memory_info().rss
+
+
+def _process_cpu_seconds():
+    t = os.times()
+    return t.user + t.system
+
+
+Gauge("process_resident_memory_bytes", "Resident memory size in bytes", fn=_process_rss)
+Gauge("process_cpu_seconds_total", "Total user and system CPU time in seconds", fn=_process_cpu_seconds)
+
+
+# ---------- INTEGRATIONS ----------
+def init_app(app, path="/metrics"):
+    """Instrument every Flask route and expose the registry at `path`."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _status(response):
+        g._metrics_status = response.status_code
+        return response
+
+    # Teardown also runs when a view raises, so failed requests are counted as 500s
+    @app.teardown_request
+    def _record(exc):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            status = 500 if exc is not None else g.pop("_metrics_status", 500)
+            # url_rule keeps label cardinality bounded (/vault/restore/<filename>)
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            HTTP_LATENCY.observe(time.perf_counter() - start, method=request.method, route=route)
+            HTTP_REQUESTS.inc(method=request.method, route=route, status=status)
+
+    def metrics_endpoint():
+        return Response(REGISTRY.render(), mimetype=CONTENT_TYPE)
+
+    app.add_url_rule(path, "metrics", metrics_endpoint)
+    return app
+
+
+_sqlalchemy_done = False
+
+
+def instrument_sqlalchemy():
+    """Count and time every statement on every SQLAlchemy engine (idempotent)."""
+    global _sqlalchemy_done
+    if _sqlalchemy_done:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    def _operation(statement):
+        return statement.lstrip().split(None, 1)[0].upper() if statement and statement.strip() else "OTHER"
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_metrics_start", []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("_metrics_start")
+        if not starts:
+            return
+        op = _operation(statement)
+        DB_LATENCY.observe(time.perf_counter() - starts.pop(), operation=op)
+        DB_QUERIES.inc(operation=op)
+
+    @event.listens_for(Engine, "handle_error")
+    def _error(ctx):
+        # after_cursor_execute never fires for a statement that raised; without
+        # this its start time would stay on the connection and skew the next one
+        starts = ctx.connection.info.get("_metrics_start") if ctx.connection is not None else None
+        if ctx.statement is None or not starts:
+            return  # failed before any statement ran (e.g. connecting)
+        op = _operation(ctx.statement)
+        DB_LATENCY.observe(time.perf_counter() - starts.pop(), operation=op)
+        DB_QUERIES.inc(operation=op)
+        DB_ERRORS.inc(operation=op)
+
+    _sqlalchemy_done = True
+
+
+def instrument_job(job_id, fn):
+    """Wrap a scheduled job so its runs, failures and duration are recorded."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            JOB_RUNS.inc(job=job_id, outcome="error")
+            raise
+        finally:
+            JOB_LATENCY.observe(time.perf_counter() - start, job=job_id)
+        JOB_RUNS.inc(job=job_id, outcome="ok")
+        return result
+    return wrapper
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serve /metrics from a daemon thread (for the collector, which has no Flask app).
+
+    Binds to loopback unless `host` says otherwise; the endpoint has no auth.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    return server
+
+
+# ---------- STRUCTURED LOGS ----------
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line (enable with LOG_FORMAT=json)."""
+
+    def format(self, record):
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload)
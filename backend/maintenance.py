@@ -0,0 +1,398 @@
+# maintenance.py
+"""
+Retention, compaction and rollup jobs for metrics and anomaly history.
+
+Registered with the APScheduler instance in app.py (every MAINTENANCE_MINUTES):
+
+* rollups     raw samples are downsampled into 1-minute and 1-hour rollups
+              (sample count, avg and max per feature). Per-host watermarks
+              in maintenance_state.json make each run incremental: agents
+              ship batches late and replay their spool after an outage, so
+              one host's backlog must not be skipped because another host
+              already moved the fleet ahead. Minutes younger than
+              ROLLUP_SETTLE_SECONDS are left for the next run, which
+              resumes reading the raw file at the first of them.
+* retention   raw samples older than RAW_RETENTION_DAYS and minute rollups
+              older than MINUTE_RETENTION_DAYS are dropped; hourly rollups
+              are kept for long-range charts.
+* compaction  anomaly_log.csv loses rows past ANOMALY_RETENTION_DAYS and
+              consecutive repeats of the same (source, metric, severity);
+              closed incidents past the same window leave incident_log.csv.
+
+All timestamps are "%Y-%m-%d %H:%M:%S" strings, so buckets are prefixes
+and cutoffs are plain string comparisons — no per-row datetime parsing.
+"""
+
+import os
+import csv
+import json
+from datetime import datetime, timedelta
+
+from anomaly_detector.csv_lock import locked
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DETECTOR_DIR = os.path.join(BASE_DIR, "anomaly_detector")
+
+METRICS_PATH = os.path.join(DETECTOR_DIR, "sample_metrics.csv")
+FLEET_METRICS_PATH = os.path.join(DETECTOR_DIR, "fleet_metrics.csv")
+ANOMALY_LOG_PATH = os.path.join(DETECTOR_DIR, "anomaly_log.csv")
+INCIDENT_LOG_PATH = os.path.join(DETECTOR_DIR, "incident_log.csv")
+ROLLUP_DIR = os.path.join(DETECTOR_DIR, "rollups")
+STATE_PATH = os.path.join(ROLLUP_DIR, "maintenance_state.json")
+
+RAW_RETENTION_DAYS = float(os.environ.get("RAW_RETENTION_DAYS", 7))
+MINUTE_RETENTION_DAYS = float(os.environ.get("MINUTE_RETENTION_DAYS", 90))
+ANOMALY_RETENTION_DAYS = float(os.environ.get("ANOMALY_RETENTION_DAYS", 90))
+MAINTENANCE_MINUTES = float(os.environ.get("MAINTENANCE_MINUTES", 15))
+# About two agent batch intervals: rows for a minute may still be in flight
+ROLLUP_SETTLE_SECONDS = float(os.environ.get("ROLLUP_SETTLE_SECONDS", 150))
+
+# Repeated anomaly rows closer than this are folded into the first one
+COMPACT_GAP_SECONDS = 60
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+RESOLUTIONS = ("1m", "1h")
+
+# (raw csv, rollup file prefix)
+SOURCES = [
+    (METRICS_PATH, "metrics"),
+    (FLEET_METRICS_PATH, "fleet"),
+]
+
+
+def rollup_path(prefix, resolution):
+    return os.path.join(ROLLUP_DIR, f"{prefix}_rollup_{resolution}.csv")
+
+
+def _cutoff(days, now):
+    return (now - timedelta(days=days)).strftime(TS_FORMAT)
+
+
+def _load_state():
+    try:
+        with open(STATE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(state):
+    tmp = STATE_PATH + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, STATE_PATH)
+
+
+def _watermarks(state, key):
+    """{host: last rolled-up bucket} for one rollup."""
+    marks = state.get(key) or {}
+    if isinstance(marks, str):
+        # Single fleet-wide watermark from before per-host tracking
+        marks = {"*": marks}
+    return marks
+
+
+def _mark(marks, host):
+    return marks.get(host, marks.get("*", ""))
+
+
+def _advance(marks, buckets):
+    for bucket, host in buckets:
+        if bucket > marks.get(host, ""):
+            marks[host] = bucket
+    return marks
+
+
+def _float(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+# ---------- SAFE REWRITE ----------
+def rewrite_csv(path, keep, scan=None):
+    """Rewrite `path` keeping rows for which keep(row) is true.
+
+    Writers (collector, ingest endpoint) only ever append, so any bytes that
+    arrive while we filter are copied over verbatim before the atomic swap.
+    The copy and swap hold the writers' lock (csv_lock.locked): an append
+    that reached the old file after the copy would otherwise be lost.
+
+    Kept rows are copied byte for byte, so a rollup resume point `scan`
+    ({"inode", "offset"}, see rollup_raw) taken on this file is moved to
+    the same row of the rewritten one. Returns (kept, dropped).
+    """
+    if not os.path.exists(path):
+        return 0, 0
+
+    tmp = path + ".tmp"
+    kept = dropped = 0
+    new_offset = None
+    with open(path, "rb") as src, open(tmp, "wb") as dst:
+        st = os.fstat(src.fileno())
+        track = bool(scan) and scan.get("inode") == st.st_ino
+        header_line = src.readline()
+        header = next(csv.reader([header_line.decode("utf-8")]), [])
+        dst.write(header_line)
+        consumed = len(header_line)
+        for line in src:
+            # Stop at the size seen on open, or at a row still being appended
+            if consumed + len(line) > st.st_size or not line.endswith(b"\n"):
+                break
+            if track and new_offset is None and consumed >= scan["offset"]:
+                new_offset = dst.tell()
+            consumed += len(line)
+            if keep(dict(zip(header, next(csv.reader([line.decode("utf-8")]), [])))):
+                dst.write(line)
+                kept += 1
+            else:
+                dropped += 1
+
+    if dropped == 0:
+        os.remove(tmp)
+        return kept, 0
+
+    with locked(path):
+        with open(path, "rb") as src, open(tmp, "ab") as dst:
+            if track and new_offset is None:
+                new_offset = dst.tell() + scan["offset"] - consumed
+            src.seek(consumed)
+            dst.write(src.read())
+            inode = os.fstat(dst.fileno()).st_ino
+        os.replace(tmp, path)
+    if track:
+        scan.update(inode=inode, offset=new_offset)
+    return kept, dropped
+
+
+# ---------- ROLLUPS ----------
+def _feature_columns(header):
+    return [c for c in header if c not in ("timestamp", "host")]
+
+
+def _append_rollup(path, header, rows):
+    new_file = not os.path.exists(path)
+    with open(path, "a", newline="") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(header)
+        writer.writerows(rows)
+
+
+def _rollup_header(has_host, features):
+    return (["bucket"] + (["host"] if has_host else []) + ["samples"]
+            + [f"{c}_avg" for c in features] + [f"{c}_max" for c in features])
+
+
+def _scan_start(f, scan):
+    """Byte offset in open file `f` where the last rollup left off, if `f` is still the same file.
+
+    Retention rewrites (and the ingest endpoint's schema rotation) replace
+    the file, so the offset is only trusted on the inode it was taken on.
+    """
+    st = os.fstat(f.fileno())
+    if scan and scan.get("inode") == st.st_ino and scan.get("offset", 0) <= st.st_size:
+        return scan["offset"]
+    return 0
+
+
+def rollup_raw(raw_path, prefix, state, now):
+    """Fold settled minutes newer than each host's watermark into the 1m rollup.
+
+    Every row before the first one still settling is either rolled up or
+    behind its host's watermark, so the next run resumes from that row
+    instead of re-reading days of raw samples.
+    """
+    if not os.path.exists(raw_path):
+        return 0
+
+    key = f"{prefix}_1m"
+    scan_key = f"{prefix}_scan"
+    marks = _watermarks(state, key)
+    settled = (now - timedelta(seconds=ROLLUP_SETTLE_SECONDS)).strftime(TS_FORMAT)[:16]
+    buckets = {}
+
+    with open(raw_path, "rb") as f:
+        header = next(csv.reader([f.readline().decode("utf-8")]), [])
+        has_host = "host" in header
+        features = _feature_columns(header)
+        pos = max(f.tell(), _scan_start(f, state.get(scan_key)))
+        f.seek(pos)
+        resume = None
+        for line in f:
+            start, pos = pos, pos + len(line)
+            if not line.endswith(b"\n"):
+                # A writer is mid-append; read the row again next time
+                resume = start if resume is None else resume
+                break
+            row = dict(zip(header, next(csv.reader([line.decode("utf-8")]), [])))
+            minute = (row.get("timestamp") or "")[:16]
+            host = row.get("host", "")
+            if len(minute) != 16 or not minute[:4].isdigit() or minute <= _mark(marks, host):
+                continue
+            if minute >= settled:
+                resume = start if resume is None else resume
+                continue
+            agg = buckets.setdefault((minute, host), [0, {}, {}, {}])
+            agg[0] += 1
+            for c in features:
+                v = _float(row.get(c))
+                if v is None:
+                    continue
+                # Per-feature counts: older rows may lack the extended columns
+                agg[1][c] = agg[1].get(c, 0.0) + v
+                agg[2][c] = max(agg[2].get(c, v), v)
+                agg[3][c] = agg[3].get(c, 0) + 1
+        state[scan_key] = {"inode": os.fstat(f.fileno()).st_ino, "offset": pos if resume is None else resume}
+
+    if not buckets:
+        return 0
+
+    rows = []
+    for (minute, host), (n, sums, maxes, counts) in sorted(buckets.items()):
+        rows.append([minute] + ([host] if has_host else []) + [n]
+                    + [round(sums[c] / counts[c], 3) if c in sums else "" for c in features]
+                    + [maxes.get(c, "") for c in features])
+    _append_rollup(rollup_path(prefix, "1m"), _rollup_header(has_host, features), rows)
+    state[key] = _advance(marks, buckets)
+    return len(rows)
+
+
+def rollup_hours(prefix, state, now):
+    """Fold complete hours of the 1m rollup into the 1h rollup (sample-weighted).
+
+    An hour is complete for a host once its 1m watermark has moved past it.
+    """
+    src = rollup_path(prefix, "1m")
+    if not os.path.exists(src):
+        return 0
+
+    key = f"{prefix}_1h"
+    marks = _watermarks(state, key)
+    minute_marks = _watermarks(state, f"{prefix}_1m")
+    current = now.strftime(TS_FORMAT)[:13]
+    buckets = {}
+
+    with open(src, newline="") as f:
+        reader = csv.DictReader(f)
+        header = reader.fieldnames or []
+        has_host = "host" in header
+        features = [c[:-4] for c in header if c.endswith("_avg")]
+        for row in reader:
+            hour = row["bucket"][:13]
+            host = row.get("host", "")
+            if not (_mark(marks, host) < hour < min(current, _mark(minute_marks, host)[:13])):
+                continue
+            n = int(row.get("samples") or 0)
+            agg = buckets.setdefault((hour, host), [0, {}, {}, {}])
+            agg[0] += n
+            for c in features:
+                avg, mx = _float(row.get(f"{c}_avg")), _float(row.get(f"{c}_max"))
+                if avg is not None:
+                    agg[1][c] = agg[1].get(c, 0.0) + avg * n
+                    agg[3][c] = agg[3].get(c, 0) + n
+                if mx is not None:
+                    agg[2][c] = max(agg[2].get(c, mx), mx)
+
+    if not buckets:
+        return 0
+
+    rows = []
+    for (hour, host), (n, sums, maxes, weights) in sorted(buckets.items()):
+        rows.append([hour] + ([host] if has_host else []) + [n]
+                    + [round(sums[c] / weights[c], 3) if weights.get(c) else "" for c in features]
+                    + [maxes.get(c, "") for c in features])
+    _append_rollup(rollup_path(prefix, "1h"), _rollup_header(has_host, features), rows)
+    state[key] = _advance(marks, buckets)
+    return len(rows)
+
+
+def read_rollup(prefix, resolution, since=None, host=None):
+    """Rows of a rollup file newer than `since` (bucket string), optionally for one host."""
+    path = rollup_path(prefix, resolution)
+    if not os.path.exists(path):
+        return []
+    rows = []
+    with open(path, newline="") as f:
+        for r in csv.DictReader(f):
+            if since and r["bucket"] < since:
+                continue
+            if host and r.get("host") != host:
+                continue
+            rows.append({k: (v if k in ("bucket", "host") else _float(v)) for k, v in r.items()})
+    return rows
+
+
+# ---------- ANOMALY COMPACTION ----------
+def compact_anomaly_log(now, path=None):
+    path = path or ANOMALY_LOG_PATH
+    cutoff = _cutoff(ANOMALY_RETENTION_DAYS, now)
+    last_seen = {}
+
+    def keep(row):
+        ts = row.get("timestamp") or ""
+        if ts < cutoff:
+            return False
+        key = (row.get("source"), row.get("metric"), row.get("severity"))
+        prev = last_seen.get(key)
+        last_seen[key] = ts
+        if prev is None:
+            return True
+        try:
+            gap = (datetime.strptime(ts, TS_FORMAT) - datetime.strptime(prev, TS_FORMAT)).total_seconds()
+        except ValueError:
+            return True
+        # Part of the same run of repeats as the previous row for this key
+        return gap > COMPACT_GAP_SECONDS
+
+    return rewrite_csv(path, keep)
+
+
+def expire_incidents(now, path=None):
+    path = path or INCIDENT_LOG_PATH
+    cutoff = _cutoff(ANOMALY_RETENTION_DAYS, now)
+    return rewrite_csv(path, lambda r: (r.get("end") or "") >= cutoff or r.get("status") == "open")
+
+
+# ---------- ENTRY POINT ----------
+def run_maintenance(now=None):
+    """Run every maintenance step once; returns a summary dict for logging."""
+    now = now or datetime.now()
+    os.makedirs(ROLLUP_DIR, exist_ok=True)
+    state = _load_state()
+    summary = {}
+
+    raw_cutoff = _cutoff(RAW_RETENTION_DAYS, now)
+    minute_cutoff = _cutoff(MINUTE_RETENTION_DAYS, now)[:16]
+
+    for raw_path, prefix in SOURCES:
+        # Roll up before expiring so nothing is dropped un-aggregated
+        minutes = rollup_raw(raw_path, prefix, state, now)
+        hours = rollup_hours(prefix, state, now)
+        _save_state(state)
+
+        marks = _watermarks(state, f"{prefix}_1m")
+        _, raw_dropped = rewrite_csv(
+            raw_path,
+            lambda r: (r.get("timestamp") or "") >= raw_cutoff
+            or (r.get("timestamp") or "")[:16] > _mark(marks, r.get("host", "")),
+            scan=state.get(f"{prefix}_scan"),
+        )
+        if raw_dropped:
+            _save_state(state)  # the resume offset now points into the rewritten file
+        _, min_dropped = rewrite_csv(rollup_path(prefix, "1m"), lambda r: r["bucket"] >= minute_cutoff)
+        summary[prefix] = {
+            "minute_rows": minutes,
+            "hour_rows": hours,
+            "raw_expired": raw_dropped,
+            "minute_expired": min_dropped,
+        }
+
+    summary["anomalies_compacted"] = compact_anomaly_log(now)[1]
+    summary["incidents_expired"] = expire_incidents(now)[1]
+    return summary
+
+
+if __name__ == "__main__":
+    print(json.dumps(run_maintenance(), indent=2))
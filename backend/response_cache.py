@@ -0,0 +1,174 @@
+# response_cache.py
+"""
+Conditional GET, ETags and compression for the dashboard's polled read APIs.
+
+A cached view declares a cheap `version()` function (a DB revision
+counter, a file's size/mtime, the vault generation). The ETag is derived
+from that version plus the request URL, so it is known before the view
+runs and is identical on every API worker:
+
+* If-None-Match matches   304, the view is not called at all
+* cache hit               the stored body is sent, the view is not called
+* miss                    the view runs once; its body (and a gzip copy
+                          when large) is kept in a bounded LRU
+
+version() returning None disables caching for that request; the response
+still gets an ETag computed from its body, so unchanged data costs no
+bandwidth.
+
+Usage:
+    @api.route("/api/jobs")
+    @response_cache.cached(lambda: ("jobs", get_revision("jobs")))
+    def api_jobs(): ...
+"""
+
+import os
+import gzip
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+
+from flask import Response, current_app, request
+
+from instrumentation import Counter
+
+CACHE_REQUESTS = Counter("http_response_cache_total", "Cached read API lookups", ("route", "result"))
+
+MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_ENTRIES", 256))
+MAX_BYTES = int(float(os.environ.get("RESPONSE_CACHE_MB", 32)) * 1024 * 1024)
+GZIP_MIN_BYTES = int(os.environ.get("RESPONSE_GZIP_MIN_BYTES", 1024))
+GZIP_LEVEL = 6
+
+# Bump when a cached view's output format changes, so old ETags stop matching
+FORMAT_VERSION = 1
+
+
+class ResponseCache:
+    """LRU of serialized bodies, bounded by entry count and total bytes."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(entry):
+        return len(entry[1]) + len(entry[2] or b"")
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        """entry = (mimetype, body, gzipped body or None)."""
+        size = self._size(entry)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= self._size(old)
+            self._entries[key] = entry
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= self._size(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+CACHE = ResponseCache()
+
+
+def _count(result):
+    CACHE_REQUESTS.inc(route=request.endpoint or "", result=result)
+
+
+def _entry(mimetype, body):
+    gz = gzip.compress(body, GZIP_LEVEL) if len(body) >= GZIP_MIN_BYTES else None
+    return mimetype, body, gz
+
+
+def _send(entry, etag):
+    mimetype, body, gz = entry
+    use_gzip = gz is not None and "gzip" in request.accept_encodings
+    resp = Response(gz if use_gzip else body, mimetype=mimetype)
+    if use_gzip:
+        resp.headers["Content-Encoding"] = "gzip"
+    resp.headers["Vary"] = "Accept-Encoding"
+    # Weak: the gzip and identity bodies share one tag
+    resp.set_etag(etag, weak=True)
+    # Always revalidate; a 304 is cheap
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+def _not_modified(etag):
+    resp = Response(status=304)
+    resp.set_etag(etag, weak=True)
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["Vary"] = "Accept-Encoding"
+    return resp
+
+
+def cached(version, cache=None):
+    """Decorator for GET views whose output depends only on the URL and version()."""
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            store = cache or CACHE
+            token = version()
+            if token is None:
+                resp = current_app.make_response(view(*args, **kwargs))
+                if resp.status_code != 200 or resp.is_streamed:
+                    return resp
+                body = resp.get_data()
+                etag = hashlib.sha1(body).hexdigest()
+                _count("uncached")
+                if request.if_none_match.contains_weak(etag):
+                    return _not_modified(etag)
+                return _send(_entry(resp.mimetype, body), etag)
+
+            key = (request.endpoint, request.query_string, tuple(sorted(kwargs.items())), token)
+            etag = hashlib.sha1(repr((FORMAT_VERSION, key)).encode("utf-8")).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                _count("not_modified")
+                return _not_modified(etag)
+
+            entry = store.get(key)
+            if entry is None:
+                resp = current_app.make_response(view(*args, **kwargs))
+                if resp.status_code != 200 or resp.is_streamed:
+                    return resp
+                entry = _entry(resp.mimetype, resp.get_data())
+                store.put(key, entry)
+                _count("miss")
+            else:
+                _count("hit")
+            return _send(entry, etag)
+
+        return wrapper
+
+    return decorator
+
+
+def file_version(path):
+    """Version token for a file-backed view: changes on append, rewrite or replace."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return ("missing", path)
+    return (path, st.st_ino, st.st_size, st.st_mtime_ns)
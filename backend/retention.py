@@ -0,0 +1,231 @@
+# retention.py
+"""
+Retention policies and garbage collection for vault versions.
+
+Versions are grouped by name:
+
+* uploads    "<file>_<YYYYmmdd_HHMMSS>.enc" objects are versions of <file>
+* snapshots  catalog snapshots are versions of their source directory
+             (an absolute path, so "/"-prefixed policies match them)
+
+retention_policies.json (or VAULT_RETENTION_CONFIG) picks a policy per
+group: an exact "name" match wins, then the longest "prefix", then
+"default". None ships with the repo; copy retention_policies.example.json
+and review `python retention.py` before enabling it. A policy keeps the
+union of
+
+    keep_last  the N newest versions
+    gfs        grandfather-father-son: the newest version in each of the
+               last `daily` days, `weekly` ISO weeks, `monthly` months
+               and `yearly` years that have any version
+
+and the newest version of a group is never expired. Groups with no
+matching policy (and no default) are left alone.
+
+A GC pass deletes expired objects and their .hash sidecars in bulk,
+drops their catalog entries, and then sweeps content objects that no
+remaining snapshot references. run_gc(dry_run=True) only reports; the
+scheduled job in app.py deletes only with VAULT_GC_ENABLED=1.
+
+Usage (from backend/):
+    python retention.py            # dry-run report
+    python retention.py --apply
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+from datetime import datetime, timedelta
+
+import logging
+
+import storage
+import vault_manager
+import snapshots
+
+logger = logging.getLogger("BackupTracker")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.environ.get("VAULT_RETENTION_CONFIG", os.path.join(BASE_DIR, "retention_policies.json"))
+
+# Unreferenced content objects younger than this may belong to a snapshot in progress
+SWEEP_GRACE_HOURS = float(os.environ.get("VAULT_GC_GRACE_HOURS", 24))
+
+VERSION_RE = re.compile(r"^(?P<name>.+)_(?P<ts>\d{8}_\d{6})\.enc$")
+TS_FORMAT = "%Y%m%d_%H%M%S"
+
+
+def load_policies(path=None):
+    path = path or CONFIG_PATH
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def policy_for(group, config):
+    policies = config.get("policies", [])
+    for p in policies:
+        if p.get("name") == group:
+            return p
+    prefixed = [p for p in policies if "prefix" in p and group.startswith(p["prefix"])]
+    if prefixed:
+        return max(prefixed, key=lambda p: len(p["prefix"]))
+    return config.get("default")
+
+
+# ---------- SELECTION ----------
+GFS_PERIODS = {
+    "daily": lambda t: t.strftime("%Y-%m-%d"),
+    "weekly": lambda t: "%d-W%02d" % t.isocalendar()[:2],
+    "monthly": lambda t: t.strftime("%Y-%m"),
+    "yearly": lambda t: t.strftime("%Y"),
+}
+
+
+def select_keep(timestamps, policy):
+    """Indexes (into `timestamps`, sorted newest first) that `policy` keeps."""
+    keep = {0} if timestamps else set()
+    keep_last = policy.get("keep_last")
+    if keep_last:
+        keep.update(range(min(keep_last, len(timestamps))))
+    for period, count in (policy.get("gfs") or {}).items():
+        bucket_of = GFS_PERIODS[period]
+        seen = set()
+        for i, ts in enumerate(timestamps):
+            if len(seen) >= count:
+                break
+            bucket = bucket_of(ts)
+            if bucket not in seen:
+                seen.add(bucket)
+                keep.add(i)
+    return keep
+
+
+# ---------- INVENTORY ----------
+def collect_versions(backend):
+    """{group: [version, ...]} for uploads and snapshots, plus orphaned .hash sidecars."""
+    groups = {}
+    top = backend.list(recursive=False)
+    names = {o.key for o in top}
+    orphans = []
+    for obj in top:
+        if obj.key.endswith(".hash"):
+            if obj.key[:-len(".hash")] not in names:
+                orphans.append(obj.key)
+            continue
+        m = VERSION_RE.match(obj.key)
+        if not m:
+            continue  # not a timestamped upload; never touched
+        keys = [obj.key] + ([obj.key + ".hash"] if obj.key + ".hash" in names else [])
+        groups.setdefault(m.group("name"), []).append({
+            "kind": "upload",
+            "id": obj.key,
+            "timestamp": datetime.strptime(m.group("ts"), TS_FORMAT),
+            "seq": 1,
+            "keys": keys,
+            "bytes": obj.size,
+        })
+
+    for entry in snapshots.list_snapshots():
+        # Runs within the same second get "<name>_<timestamp>_<n>" ids, n from 2
+        suffix = entry["snapshot_id"].rpartition(entry["timestamp"])[2]
+        groups.setdefault(entry["source"], []).append({
+            "kind": "snapshot",
+            "id": entry["snapshot_id"],
+            "timestamp": datetime.strptime(entry["timestamp"], TS_FORMAT),
+            "seq": int(suffix[1:]) if suffix[1:].isdigit() else 1,
+            "keys": [entry["manifest"]],
+            "bytes": entry.get("bytes", 0),
+        })
+
+    for versions in groups.values():
+        versions.sort(key=lambda v: (v["timestamp"], v["seq"]), reverse=True)
+    return groups, orphans
+
+
+def plan(backend=None, config=None):
+    """Per-group keep/expire decision without touching anything."""
+    backend = backend or storage.get_backend()
+    config = load_policies() if config is None else config
+    groups, orphans = collect_versions(backend)
+
+    report = {"groups": {}, "orphan_sidecars": orphans, "expired_versions": 0, "expired_bytes": 0}
+    expired = []
+    for group, versions in sorted(groups.items()):
+        policy = policy_for(group, config)
+        if not policy:
+            continue
+        keep = select_keep([v["timestamp"] for v in versions], policy)
+        gone = [v for i, v in enumerate(versions) if i not in keep]
+        expired.extend(gone)
+        report["groups"][group] = {
+            "policy": policy,
+            "kept": [v["id"] for i, v in enumerate(versions) if i in keep],
+            "expired": [v["id"] for v in gone],
+        }
+        report["expired_versions"] += len(gone)
+        report["expired_bytes"] += sum(v["bytes"] for v in gone)
+    return report, expired
+
+
+# ---------- GC ----------
+def sweep_objects(backend, exclude=(), now=None):
+    """Keys under objects/ that no snapshot (other than `exclude`) references.
+
+    Returns None when a manifest cannot be read: its objects are unknown,
+    so nothing is safe to sweep.
+    """
+    now = now or datetime.now()
+    referenced = set()
+    for entry in snapshots.list_snapshots():
+        if entry["snapshot_id"] in exclude:
+            continue
+        try:
+            manifest = snapshots.load_manifest(entry["snapshot_id"])
+        except Exception as e:
+            logger.warning("Object sweep skipped, manifest of %s unreadable: %s", entry["snapshot_id"], e)
+            return None
+        referenced.update(snapshots.object_key(f["digest"]) for f in manifest["files"])
+
+    cutoff = (now - timedelta(hours=SWEEP_GRACE_HOURS)).timestamp()
+    return [o.key for o in backend.list("objects/")
+            if o.key not in referenced and (o.modified or 0) < cutoff]
+
+
+def run_gc(dry_run=True, backend=None, config=None, now=None):
+    """Expire versions per policy; with dry_run=False delete them in bulk. Returns the report."""
+    backend = backend or storage.get_backend()
+    report, expired = plan(backend, config)
+    report["dry_run"] = dry_run
+
+    uploads = {v["id"] for v in expired if v["kind"] == "upload"}
+    snaps = {v["id"] for v in expired if v["kind"] == "snapshot"}
+    unreferenced = sweep_objects(backend, exclude=snaps, now=now)
+    report["unreferenced_objects"] = None if unreferenced is None else len(unreferenced)
+    if dry_run:
+        return report
+
+    keys = [k for v in expired for k in v["keys"]] + report["orphan_sidecars"]
+    backend.delete_many(keys)
+    report["catalog_entries_removed"] = vault_manager.remove_metadata(
+        lambda e: e.get("encrypted_file") in uploads or e.get("snapshot_id") in snaps
+    )
+    # Content objects go last, once no remaining manifest can point at them
+    backend.delete_many(unreferenced or [])
+    report["deleted_keys"] = len(keys) + len(unreferenced or [])
+    logger.info("Vault GC removed %d versions, %d keys", len(expired), report["deleted_keys"])
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vault retention / garbage collection")
+    parser.add_argument("--apply", action="store_true", help="delete expired versions (default: dry run)")
+    args = parser.parse_args(argv)
+    print(json.dumps(run_gc(dry_run=not args.apply), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,306 @@
+# snapshots.py
+"""
+Incremental directory snapshots for the vault.
+
+A snapshot records every regular file under a source directory. File
+contents are stored once, encrypted, as content-addressed objects
+(objects/<aa>/<sha256>.enc in the vault storage backend), so unchanged or
+duplicate files cost nothing on the next run.
+
+A persistent stat cache (snapshot_cache/<root-id>.json) maps each path to
+(size, mtime_ns, inode, digest). On a rescan a file whose size, mtime and
+inode still match is not opened at all; only new or modified files are
+read, hashed and encrypted. A nightly run over a large tree therefore
+costs one stat per file plus work proportional to what changed.
+
+Each snapshot writes an encrypted manifest (snapshots/<id>.manifest.enc)
+and one catalog entry of type "snapshot" in vault_metadata.json.
+
+Reusing an existing object (a stat-cache hit or a duplicate) races the
+GC sweep (retention.py), which deletes unreferenced objects older than
+its grace period: the object is touched when reused, and checked again
+once the catalog entry protects it; one swept in between is stored again
+from the source file. The stat cache is saved only after the catalog.
+
+Usage (from backend/):
+    python snapshots.py backup /srv/data
+    python snapshots.py list
+    python snapshots.py restore data_20250101_020000 /tmp/restore
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+import vault_crypto
+import vault_manager
+
+logger = logging.getLogger("BackupTracker")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, "snapshot_cache")
+
+SNAPSHOT_WORKERS = int(os.environ.get("SNAPSHOT_WORKERS", 4))
+
+# Files modified this close to the scan start may change again within the
+# same mtime tick, so they are stored but not trusted from the cache next time
+RACY_WINDOW_NS = 2 * 10**9
+
+CACHE_VERSION = 1
+
+
+def object_key(digest):
+    return f"objects/{digest[:2]}/{digest}.enc"
+
+
+def manifest_key(snapshot_id):
+    return f"snapshots/{snapshot_id}.manifest.enc"
+
+
+def _atomic_write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# ---------- STAT CACHE ----------
+def cache_path(root):
+    root_id = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"{root_id}.json")
+
+
+def load_cache(root):
+    """{relpath: [size, mtime_ns, inode, digest]} from the last scan of `root`."""
+    try:
+        with open(cache_path(root)) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != CACHE_VERSION or data.get("root") != os.path.abspath(root):
+        return {}
+    return data.get("entries", {})
+
+
+def save_cache(root, entries):
+    payload = {"version": CACHE_VERSION, "root": os.path.abspath(root), "entries": entries}
+    _atomic_write(cache_path(root), json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+
+
+# ---------- SCANNER ----------
+def walk_files(root):
+    """Yield (relpath, stat_result) for regular files; symlinks are not followed."""
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = sorted(os.scandir(current), key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    rel = os.path.relpath(entry.path, root).replace(os.sep, "/")
+                    yield rel, entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+        stack.extend(reversed(subdirs))
+
+
+def _store_file(path):
+    """Read, hash and (if new) encrypt one file. Returns (digest, size, new_object_bytes, stat_after)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    after = os.stat(path, follow_symlinks=False)
+    digest = hashlib.sha256(data).hexdigest()
+    backend = storage.get_backend()
+    # Touched, not just checked: an old unreferenced object is a GC candidate
+    if backend.touch(object_key(digest)):
+        return digest, len(data), 0, after
+    encrypted = vault_crypto.store(object_key(digest), data, backend)
+    return digest, len(data), len(encrypted), after
+
+
+def create_snapshot(root, workers=SNAPSHOT_WORKERS):
+    """Back up `root` incrementally; returns the catalog entry for the new snapshot."""
+    root = os.path.abspath(root)
+    if not os.path.isdir(root):
+        raise NotADirectoryError(root)
+
+    scan_start = time.time_ns()
+    started = time.perf_counter()
+    cache = load_cache(root)
+    new_cache = {}
+    files = []
+    hits = []
+    changed = []
+    backend = storage.get_backend()
+
+    for rel, st in walk_files(root):
+        cached = cache.get(rel)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns and cached[2] == st.st_ino:
+            hits.append((rel, st, cached))
+        else:
+            changed.append((rel, st))
+
+    new_objects = new_bytes = hashed_bytes = 0
+    # Objects this snapshot did not write itself; a GC sweep may race for them
+    reused = set()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        touched = pool.map(lambda hit: backend.touch(object_key(hit[2][3])), hits)
+        for (rel, st, cached), present in zip(hits, touched):
+            if not present:
+                changed.append((rel, st))  # swept since the cache was written; store it again
+                continue
+            files.append({"path": rel, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                          "mode": st.st_mode & 0o777, "digest": cached[3]})
+            new_cache[rel] = cached
+            reused.add(rel)
+
+        futures = [(rel, st, pool.submit(_store_file, os.path.join(root, rel))) for rel, st in changed]
+        for rel, st, fut in futures:
+            try:
+                digest, size, stored, after = fut.result()
+            except OSError:
+                # Vanished or unreadable since the scan; leave it out of this snapshot
+                continue
+            hashed_bytes += size
+            if stored:
+                new_objects += 1
+                new_bytes += stored
+            else:
+                reused.add(rel)
+            files.append({"path": rel, "size": size, "mtime_ns": after.st_mtime_ns,
+                          "mode": after.st_mode & 0o777, "digest": digest})
+            stable = (after.st_size == size and after.st_mtime_ns == st.st_mtime_ns
+                      and after.st_mtime_ns < scan_start - RACY_WINDOW_NS)
+            if stable:
+                new_cache[rel] = [size, after.st_mtime_ns, after.st_ino, digest]
+
+    files.sort(key=lambda f: f["path"])
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    name = os.path.basename(root.rstrip(os.sep)) or "root"
+    snapshot_id = f"{name}_{timestamp}"
+    suffix = 1
+    while backend.exists(manifest_key(snapshot_id)):
+        suffix += 1  # two runs within the same second
+        snapshot_id = f"{name}_{timestamp}_{suffix}"
+
+    manifest = {"snapshot_id": snapshot_id, "source": root, "timestamp": timestamp, "files": files}
+    encrypted_manifest, manifest_meta = vault_crypto.encrypt(json.dumps(manifest).encode("utf-8"))
+    backend.put(manifest_key(snapshot_id), encrypted_manifest, manifest_meta)
+
+    entry = {
+        "type": "snapshot",
+        "snapshot_id": snapshot_id,
+        "source": root,
+        "timestamp": timestamp,
+        "manifest": manifest_key(snapshot_id),
+        "sha256": hashlib.sha256(encrypted_manifest).hexdigest(),
+        "files": len(files),
+        "bytes": sum(f["size"] for f in files),
+        "changed_files": len(changed),
+        "hashed_bytes": hashed_bytes,
+        "removed_files": len(set(cache) - {f["path"] for f in files}),
+        "new_objects": new_objects,
+        "new_object_bytes": new_bytes,
+        "duration_s": round(time.perf_counter() - started, 3),
+    }
+    vault_manager.save_metadata(entry)
+    _restore_swept(root, [f for f in files if f["path"] in reused], backend)
+    # Only once the catalog references its objects: a cache written earlier
+    # could outlive a failed run and vouch for objects GC has since swept
+    save_cache(root, new_cache)
+    return entry
+
+
+def _restore_swept(root, files, backend):
+    """Store again any reused object a concurrent GC sweep deleted before the catalog referenced it."""
+    for f in files:
+        key = object_key(f["digest"])
+        if backend.exists(key):
+            continue
+        try:
+            with open(os.path.join(root, f["path"]), "rb") as src:
+                data = src.read()
+        except OSError:
+            data = None
+        if data is None or hashlib.sha256(data).hexdigest() != f["digest"]:
+            logger.error("Snapshot object %s for %s was swept and the file has changed", key, f["path"])
+            continue
+        vault_crypto.store(key, data, backend)
+        logger.warning("Snapshot object %s was swept during the snapshot; stored again", key)
+
+
+# ---------- CATALOG / RESTORE ----------
+def list_snapshots(source=None):
+    rows = [e for e in vault_manager.list_vault_files() if e.get("type") == "snapshot"]
+    if source:
+        rows = [e for e in rows if e.get("source") == os.path.abspath(source)]
+    return rows
+
+
+def load_manifest(snapshot_id):
+    for entry in list_snapshots():
+        if entry["snapshot_id"] == snapshot_id:
+            return json.loads(vault_crypto.load(entry["manifest"]))
+    raise KeyError(f"Unknown snapshot {snapshot_id}")
+
+
+def read_object(digest):
+    """Decrypted contents of one stored object, verified against its digest."""
+    data = vault_crypto.load(object_key(digest))
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"Object {digest} failed integrity check")
+    return data
+
+
+def restore_snapshot(snapshot_id, dest):
+    """Write every file of a snapshot under `dest`; returns the number of files restored."""
+    manifest = load_manifest(snapshot_id)
+    dest = os.path.abspath(dest)
+    restored = 0
+    for f in manifest["files"]:
+        target = os.path.abspath(os.path.join(dest, f["path"]))
+        if os.path.commonpath([dest, target]) != dest:
+            continue  # never write outside dest, whatever the manifest says
+        _atomic_write(target, read_object(f["digest"]))
+        os.chmod(target, f["mode"])
+        os.utime(target, ns=(f["mtime_ns"], f["mtime_ns"]))
+        restored += 1
+    return restored
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incremental vault snapshots")
+    sub = parser.add_subparsers(dest="command", required=True)
+    backup = sub.add_parser("backup", help="snapshot a directory")
+    backup.add_argument("source")
+    sub.add_parser("list", help="list snapshots in the catalog")
+    restore = sub.add_parser("restore", help="restore a snapshot into a directory")
+    restore.add_argument("snapshot_id")
+    restore.add_argument("dest")
+    args = parser.parse_args(argv)
+
+    if args.command == "backup":
+        print(json.dumps(create_snapshot(args.source), indent=2))
+    elif args.command == "list":
+        print(json.dumps(list_snapshots(), indent=2))
+    else:
+        print(f"Restored {restore_snapshot(args.snapshot_id, args.dest)} files to {args.dest}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,608 @@
+# storage.py
+"""
+Vault storage backends.
+
+Everything the vault writes (encrypted files, .hash sidecars, snapshot
+objects and manifests) goes through one StorageBackend, selected by
+VAULT_BACKEND:
+
+    local      files under VAULT_DIR (default backend/vault)
+    s3         any S3-compatible service via boto3 (S3_BUCKET, S3_PREFIX,
+               S3_ENDPOINT_URL for MinIO/Ceph/etc.)
+    memory-s3  S3Backend on MemoryS3Client, an in-process stand-in for
+               tests and local runs without a bucket
+
+Objects larger than VAULT_PART_SIZE_MB are uploaded as multipart uploads
+and downloaded as ranged GETs, VAULT_TRANSFER_CONCURRENCY parts at a time.
+Keys are "/"-separated relative paths (e.g. "objects/ab/<digest>.enc").
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import itertools
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Single definition shared by app.py, vault_manager.py and snapshots.py
+VAULT_DIR = os.path.abspath(os.environ.get("VAULT_DIR", os.path.join(BASE_DIR, "vault")))
+
+VAULT_BACKEND = os.environ.get("VAULT_BACKEND", "local")
+PART_SIZE = int(float(os.environ.get("VAULT_PART_SIZE_MB", 8)) * 1024 * 1024)
+CONCURRENCY = int(os.environ.get("VAULT_TRANSFER_CONCURRENCY", 4))
+CHUNK_SIZE = 1024 * 1024
+
+ObjectInfo = namedtuple("ObjectInfo", "key size modified metadata")
+
+
+def _check_key(key):
+    parts = key.split("/")
+    if not key or key.startswith("/") or any(p in ("", ".", "..") for p in parts):
+        raise ValueError(f"Invalid storage key: {key!r}")
+    return key
+
+
+class StorageBackend:
+    """Interface; missing objects raise FileNotFoundError like local files do."""
+
+    def put(self, key, data, metadata=None):
+        raise NotImplementedError
+
+    def put_stream(self, key, chunks, metadata=None):
+        """Write an object from an iterable of byte chunks; backends override to avoid joining them."""
+        self.put(key, b"".join(chunks), metadata)
+
+    def create(self, key, data):
+        """Write `key` only if it does not exist yet; returns False if it does.
+
+        The one atomic check-and-write every backend offers, for coordinating
+        workers that share nothing but the storage (see chunked_upload).
+        """
+        raise NotImplementedError
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def iter_chunks(self, key, chunk_size=CHUNK_SIZE):
+        """Stream an object without holding all of it in memory."""
+        raise NotImplementedError
+
+    def stat(self, key):
+        """ObjectInfo, or None if the object does not exist."""
+        raise NotImplementedError
+
+    def list(self, prefix="", recursive=True):
+        """ObjectInfo for each key under `prefix`; recursive=False stops at the next "/"."""
+        raise NotImplementedError
+
+    def update_metadata(self, key, metadata):
+        """Replace an object's metadata without rewriting its data."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.delete(key)
+
+    def exists(self, key):
+        return self.stat(key) is not None
+
+    def touch(self, key):
+        """Refresh an object's modification time so GC grace periods count from now.
+        Returns False if the object does not exist."""
+        info = self.stat(key)
+        if info is None:
+            return False
+        try:
+            self.update_metadata(key, info.metadata or {})
+        except FileNotFoundError:
+            return False
+        return True
+
+    def generation(self):
+        """Token that changes whenever a top-level key is added, replaced or removed;
+        None when the backend cannot tell cheaply (read caches then skip it)."""
+        return None
+
+    def sha256(self, key):
+        sha = hashlib.sha256()
+        for block in self.iter_chunks(key):
+            sha.update(block)
+        return sha.hexdigest()
+
+
+# ---------- LOCAL FILESYSTEM ----------
+class LocalBackend(StorageBackend):
+    # Metadata lives next to the object; never listed as an object itself
+    META_SUFFIX = ".meta.json"
+
+    def __init__(self, root=VAULT_DIR):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, *_check_key(key).split("/"))
+
+    def put(self, key, data, metadata=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        self._commit(tmp, path, metadata)
+
+    def put_stream(self, key, chunks, metadata=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self._commit(tmp, path, metadata)
+
+    def create(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return True
+
+    def _commit(self, tmp, path, metadata):
+        meta_path = path + self.META_SUFFIX
+        if metadata:
+            with open(tmp + self.META_SUFFIX, "w") as f:
+                json.dump(metadata, f)
+        if not os.path.exists(path):
+            # New key: a sidecar without data is invisible, so it goes first and
+            # the object never shows up without its metadata
+            if metadata:
+                os.replace(tmp + self.META_SUFFIX, meta_path)
+            os.replace(tmp, path)
+            return
+        # Overwrite: data first, so a sidecar never describes data not yet in place
+        os.replace(tmp, path)
+        if metadata:
+            os.replace(tmp + self.META_SUFFIX, meta_path)
+        elif os.path.exists(meta_path):
+            os.remove(meta_path)
+
+    def get(self, key):
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def generation(self):
+        # Every put/delete ends in a rename or unlink in the root directory
+        st = os.stat(self.root)
+        return st.st_ino, st.st_mtime_ns
+
+    def iter_chunks(self, key, chunk_size=CHUNK_SIZE):
+        with open(self._path(key), "rb") as f:
+            for block in iter(lambda: f.read(chunk_size), b""):
+                yield block
+
+    def _metadata(self, path):
+        try:
+            with open(path + self.META_SUFFIX) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def stat(self, key):
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        return ObjectInfo(key, st.st_size, st.st_mtime, self._metadata(path))
+
+    def list(self, prefix="", recursive=True):
+        # Start the walk at the deepest directory the prefix names
+        start = prefix.rsplit("/", 1)[0] if "/" in prefix else ""
+        base = self._path(start) if start else self.root
+        rows = []
+        for dirpath, dirnames, filenames in os.walk(base):
+            rel_dir = os.path.relpath(dirpath, self.root).replace(os.sep, "/")
+            rel_dir = "" if rel_dir == "." else rel_dir + "/"
+            if not recursive:
+                dirnames[:] = []
+            else:
+                dirnames.sort()
+            for name in sorted(filenames):
+                key = rel_dir + name
+                if name.endswith(self.META_SUFFIX) or name.endswith(".tmp") or not key.startswith(prefix):
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                except FileNotFoundError:
+                    continue
+                rows.append(ObjectInfo(key, st.st_size, st.st_mtime, None))
+        return rows
+
+    def touch(self, key):
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def update_metadata(self, key, metadata):
+        path = self._path(key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(key)
+        tmp = f"{path}{self.META_SUFFIX}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(metadata, f)
+        os.replace(tmp, path + self.META_SUFFIX)
+
+    def delete(self, key):
+        path = self._path(key)
+        for p in (path, path + self.META_SUFFIX):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+
+# ---------- S3-COMPATIBLE ----------
+def _is_missing(exc):
+    code = str(getattr(exc, "response", {}).get("Error", {}).get("Code", ""))
+    return isinstance(exc, FileNotFoundError) or code in ("404", "NoSuchKey", "NotFound")
+
+
+class S3Backend(StorageBackend):
+    def __init__(self, bucket, client=None, prefix="", part_size=PART_SIZE, concurrency=CONCURRENCY):
+        if client is None:
+            import boto3  # only needed for VAULT_BACKEND=s3
+            client = boto3.client("s3", endpoint_url=os.environ.get("S3_ENDPOINT_URL") or None)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.part_size = part_size
+        self.concurrency = max(1, concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="s3-transfer")
+
+    def _key(self, key):
+        return self.prefix + _check_key(key)
+
+    def put(self, key, data, metadata=None):
+        full = self._key(key)
+        meta = {k: str(v) for k, v in (metadata or {}).items()}
+        if len(data) <= self.part_size:
+            self.client.put_object(Bucket=self.bucket, Key=full, Body=data, Metadata=meta)
+            return
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=full, Metadata=meta)["UploadId"]
+        view = memoryview(data)
+
+        def upload(number):
+            start = (number - 1) * self.part_size
+            resp = self.client.upload_part(
+                Bucket=self.bucket, Key=full, UploadId=upload_id, PartNumber=number,
+                Body=bytes(view[start:start + self.part_size]),
+            )
+            return {"ETag": resp["ETag"], "PartNumber": number}
+
+        count = -(-len(data) // self.part_size)
+        try:
+            parts = list(self._pool.map(upload, range(1, count + 1)))
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=full, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+        except Exception:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=full, UploadId=upload_id)
+            raise
+
+    def create(self, key, data):
+        # Conditional write: S3 answers 412 if the key exists (409 if a racing
+        # conditional write is still in flight)
+        try:
+            self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data, IfNoneMatch="*")
+        except Exception as e:
+            code = str(getattr(e, "response", {}).get("Error", {}).get("Code", ""))
+            if code in ("412", "PreconditionFailed", "409", "ConditionalRequestConflict"):
+                return False
+            raise
+        return True
+
+    def put_stream(self, key, chunks, metadata=None):
+        full = self._key(key)
+        meta = {k: str(v) for k, v in (metadata or {}).items()}
+        chunks = iter(chunks)
+        buf = bytearray()
+
+        def fill():
+            # Next part_size bytes; fewer only at the end of the stream
+            while len(buf) < self.part_size:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                buf.extend(chunk)
+            part = bytes(buf[:self.part_size])
+            del buf[:self.part_size]
+            return part
+
+        first, nxt = fill(), fill()
+        if not nxt:
+            self.client.put_object(Bucket=self.bucket, Key=full, Body=first, Metadata=meta)
+            return
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=full, Metadata=meta)["UploadId"]
+
+        def upload(number, body):
+            resp = self.client.upload_part(
+                Bucket=self.bucket, Key=full, UploadId=upload_id, PartNumber=number, Body=body,
+            )
+            return {"ETag": resp["ETag"], "PartNumber": number}
+
+        try:
+            parts, pending = [], deque()
+            number, body = 1, first
+            while body:
+                # Bounded: at most `concurrency` parts buffered or in flight
+                pending.append(self._pool.submit(upload, number, body))
+                if len(pending) >= self.concurrency:
+                    parts.append(pending.popleft().result())
+                number, body = number + 1, nxt
+                nxt = fill() if nxt else b""
+            parts.extend(f.result() for f in pending)
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=full, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+        except Exception:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=full, UploadId=upload_id)
+            raise
+
+    def _get_range(self, full, start, end):
+        resp = self.client.get_object(Bucket=self.bucket, Key=full, Range=f"bytes={start}-{end}")
+        return resp["Body"].read()
+
+    def _ranges(self, size, part_size):
+        return [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+    def get(self, key):
+        info = self.stat(key)
+        if info is None:
+            raise FileNotFoundError(key)
+        full = self._key(key)
+        if info.size <= self.part_size:
+            return self.client.get_object(Bucket=self.bucket, Key=full)["Body"].read()
+        ranges = self._ranges(info.size, self.part_size)
+        return b"".join(self._pool.map(lambda r: self._get_range(full, *r), ranges))
+
+    def iter_chunks(self, key, chunk_size=CHUNK_SIZE):
+        info = self.stat(key)
+        if info is None:
+            raise FileNotFoundError(key)
+        full = self._key(key)
+        part = max(chunk_size, self.part_size)
+        pending = deque()
+        # Bounded read-ahead: at most `concurrency` ranged GETs in flight
+        for start, end in self._ranges(info.size, part):
+            pending.append(self._pool.submit(self._get_range, full, start, end))
+            if len(pending) >= self.concurrency:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def stat(self, key):
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except Exception as e:
+            if _is_missing(e):
+                return None
+            raise
+        modified = head.get("LastModified")
+        modified = modified.timestamp() if hasattr(modified, "timestamp") else modified
+        return ObjectInfo(key, head["ContentLength"], modified, head.get("Metadata", {}))
+
+    def list(self, prefix="", recursive=True):
+        kwargs = {"Bucket": self.bucket, "Prefix": self.prefix + prefix}
+        if not recursive:
+            kwargs["Delimiter"] = "/"
+        rows = []
+        while True:
+            resp = self.client.list_objects_v2(**kwargs)
+            for obj in resp.get("Contents", []):
+                modified = obj.get("LastModified")
+                modified = modified.timestamp() if hasattr(modified, "timestamp") else modified
+                rows.append(ObjectInfo(obj["Key"][len(self.prefix):], obj["Size"], modified, None))
+            if not resp.get("IsTruncated"):
+                return rows
+            kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+
+    def update_metadata(self, key, metadata):
+        # Server-side copy onto itself: no object data crosses the network
+        full = self._key(key)
+        try:
+            self.client.copy_object(
+                Bucket=self.bucket, Key=full, CopySource={"Bucket": self.bucket, "Key": full},
+                Metadata={k: str(v) for k, v in metadata.items()}, MetadataDirective="REPLACE",
+            )
+        except Exception as e:
+            if _is_missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def delete_many(self, keys):
+        keys = [self._key(k) for k in keys]
+        for i in range(0, len(keys), 1000):  # DeleteObjects limit
+            batch = [{"Key": k} for k in keys[i:i + 1000]]
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": batch, "Quiet": True})
+
+
+# ---------- IN-MEMORY S3 STAND-IN ----------
+class MemoryS3Error(Exception):
+    """Carries a botocore-style `response` so S3Backend handles it like ClientError."""
+
+    def __init__(self, code, message=""):
+        super().__init__(f"{code}: {message}")
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+
+class _Body:
+    def __init__(self, data):
+        self._data = data
+
+    def read(self):
+        return self._data
+
+
+class MemoryS3Client:
+    """The subset of the boto3 S3 client API that S3Backend uses, kept in memory."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objects = {}   # (bucket, key) -> (data, metadata, mtime)
+        self._uploads = {}   # upload_id -> (bucket, key, metadata, {part: data})
+        self._ids = itertools.count(1)
+        self.calls = {}      # operation -> count, for tests and benchmarks
+
+    def _count(self, op):
+        self.calls[op] = self.calls.get(op, 0) + 1
+
+    def _obj(self, Bucket, Key):
+        try:
+            return self._objects[(Bucket, Key)]
+        except KeyError:
+            raise MemoryS3Error("NoSuchKey", Key) from None
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, IfNoneMatch=None):
+        with self._lock:
+            self._count("put_object")
+            if IfNoneMatch == "*" and (Bucket, Key) in self._objects:
+                raise MemoryS3Error("PreconditionFailed", Key)
+            self._objects[(Bucket, Key)] = (bytes(Body), dict(Metadata or {}), time.time())
+        return {"ETag": hashlib.md5(Body).hexdigest()}
+
+    def get_object(self, Bucket, Key, Range=None):
+        with self._lock:
+            self._count("get_object")
+            data, meta, _ = self._obj(Bucket, Key)
+        if Range:
+            start, end = Range[len("bytes="):].split("-")
+            data = data[int(start):int(end) + 1]
+        return {"Body": _Body(data), "ContentLength": len(data), "Metadata": dict(meta)}
+
+    def head_object(self, Bucket, Key):
+        with self._lock:
+            self._count("head_object")
+            try:
+                data, meta, mtime = self._obj(Bucket, Key)
+            except MemoryS3Error:
+                raise MemoryS3Error("404", Key) from None
+        return {"ContentLength": len(data), "Metadata": dict(meta), "LastModified": mtime}
+
+    def copy_object(self, Bucket, Key, CopySource, Metadata=None, MetadataDirective="COPY"):
+        with self._lock:
+            self._count("copy_object")
+            data, meta, _ = self._obj(CopySource["Bucket"], CopySource["Key"])
+            if MetadataDirective == "REPLACE":
+                meta = dict(Metadata or {})
+            self._objects[(Bucket, Key)] = (data, meta, time.time())
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        with self._lock:
+            self._count("delete_object")
+            self._objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete):
+        with self._lock:
+            self._count("delete_objects")
+            for obj in Delete["Objects"]:
+                self._objects.pop((Bucket, obj["Key"]), None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter=None, ContinuationToken=None, MaxKeys=1000):
+        with self._lock:
+            self._count("list_objects_v2")
+            keys = sorted(k for b, k in self._objects if b == Bucket and k.startswith(Prefix))
+            if Delimiter:
+                keys = [k for k in keys if Delimiter not in k[len(Prefix):]]
+            start = int(ContinuationToken or 0)
+            page = keys[start:start + MaxKeys]
+            contents = [{"Key": k, "Size": len(self._objects[(Bucket, k)][0]),
+                         "LastModified": self._objects[(Bucket, k)][2]} for k in page]
+        truncated = start + MaxKeys < len(keys)
+        resp = {"Contents": contents, "IsTruncated": truncated}
+        if truncated:
+            resp["NextContinuationToken"] = str(start + MaxKeys)
+        return resp
+
+    def create_multipart_upload(self, Bucket, Key, Metadata=None):
+        with self._lock:
+            self._count("create_multipart_upload")
+            upload_id = str(next(self._ids))
+            self._uploads[upload_id] = (Bucket, Key, dict(Metadata or {}), {})
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with self._lock:
+            self._count("upload_part")
+            self._uploads[UploadId][3][PartNumber] = bytes(Body)
+        return {"ETag": hashlib.md5(Body).hexdigest()}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        with self._lock:
+            self._count("complete_multipart_upload")
+            bucket, key, meta, parts = self._uploads.pop(UploadId)
+            data = b"".join(parts[p["PartNumber"]] for p in MultipartUpload["Parts"])
+            self._objects[(bucket, key)] = (data, meta, time.time())
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        with self._lock:
+            self._count("abort_multipart_upload")
+            self._uploads.pop(UploadId, None)
+        return {}
+
+
+# ---------- SELECTION ----------
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(kind=VAULT_BACKEND):
+    if kind == "local":
+        return LocalBackend(VAULT_DIR)
+    if kind == "s3":
+        return S3Backend(os.environ["S3_BUCKET"], prefix=os.environ.get("S3_PREFIX", ""))
+    if kind == "memory-s3":
+        return S3Backend("vault", client=MemoryS3Client())
+    raise ValueError(f"Unknown VAULT_BACKEND {kind!r} (expected local, s3 or memory-s3)")
+
+
+def get_backend():
+    """Process-wide backend, created on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend):
+    """Swap the backend (tests, benchmarks); returns the previous one."""
+    global _backend
+    previous, _backend = _backend, backend
+    return previous
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# Backend modules import each other as top-level modules (see app.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def vault(tmp_path, monkeypatch):
+    """Local storage backend, master keys and catalog under tmp_path."""
+    import storage
+    import snapshots
+    import vault_crypto
+    import vault_manager
+
+    monkeypatch.setattr(vault_crypto, "KEYRING_PATH", str(tmp_path / "vault_master_keys.json"))
+    monkeypatch.setattr(vault_crypto, "LEGACY_KEY_PATH", str(tmp_path / "vault_key.key"))
+    monkeypatch.setattr(vault_crypto, "_keyring", None)
+    monkeypatch.setattr(vault_manager, "METADATA_FILE", str(tmp_path / "vault_metadata.json"))
+    monkeypatch.setattr(snapshots, "CACHE_DIR", str(tmp_path / "snapshot_cache"))
+    backend = storage.LocalBackend(str(tmp_path / "vault"))
+    previous = storage.set_backend(backend)
+    yield backend
+    storage.set_backend(previous)
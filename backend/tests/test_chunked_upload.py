@@ -0,0 +1,128 @@
+import io
+import os
+import hashlib
+import tarfile
+import zipfile
+
+import pytest
+
+import bulk_restore
+import chunked_upload
+import storage
+import vault_crypto
+from chunked_upload import UploadError
+
+PAYLOAD = bytes(range(256)) * 5  # 1280 bytes, 10 parts of 128
+
+
+@pytest.fixture
+def upload(vault, monkeypatch):
+    monkeypatch.setattr(chunked_upload, "PART_SIZE", 128)
+    return chunked_upload.init_upload("report.bin", size=len(PAYLOAD), backend=vault)
+
+
+def send(upload_id, offset, backend, data=None):
+    data = PAYLOAD[offset:offset + 128] if data is None else data
+    return chunked_upload.put_part(upload_id, offset, data, hashlib.sha256(data).hexdigest(), backend)
+
+
+def test_resume_from_next_offset(vault, upload):
+    uid = upload["upload_id"]
+    for offset in range(0, 512, 128):
+        send(uid, offset, vault)
+    # Any worker can pick up from here; the session on storage is all it needs
+    session, _ = chunked_upload.load_session(uid, vault)
+    assert chunked_upload.status(session)["next_offset"] == 512
+
+    with pytest.raises(UploadError) as err:
+        send(uid, 768, vault)
+    assert err.value.status == 409 and err.value.extra == {"next_offset": 512}
+
+    for offset in range(512, len(PAYLOAD), 128):
+        send(uid, offset, vault)
+    done = chunked_upload.complete_upload(uid, vault)
+    assert done["size"] == len(PAYLOAD)
+    assert vault_crypto.load(done["filename"], vault) == PAYLOAD
+    assert not vault.list(f"uploads/{uid}/")
+
+
+def test_retried_part_is_idempotent_and_checksum_enforced(vault, upload):
+    uid = upload["upload_id"]
+    first = send(uid, 0, vault)
+    assert send(uid, 0, vault) == first
+    with pytest.raises(UploadError) as err:
+        chunked_upload.put_part(uid, 128, PAYLOAD[128:256], "0" * 64, vault)
+    assert err.value.status == 400
+    with pytest.raises(UploadError) as err:
+        chunked_upload.complete_upload(uid, vault)
+    assert err.value.status == 409
+
+
+def test_upload_lock_is_shared_through_storage(vault, upload, monkeypatch):
+    uid = upload["upload_id"]
+    monkeypatch.setattr(chunked_upload, "LOCK_WAIT_SECONDS", 0.1)
+    # Another worker (process or host) holds the lock
+    assert vault.create(chunked_upload.lock_key(uid), b"other")
+    with pytest.raises(UploadError) as err:
+        send(uid, 0, vault)
+    assert err.value.status == 423
+
+    # ... and died: its lock is broken once stale
+    os.utime(vault._path(chunked_upload.lock_key(uid)), (0, 0))
+    assert send(uid, 0, vault)["next_offset"] == 128
+    assert not vault.exists(chunked_upload.lock_key(uid))
+
+
+def test_s3_create_is_conditional():
+    backend = storage.S3Backend("bucket", client=storage.MemoryS3Client())
+    assert backend.create("uploads/x/lock", b"a")
+    assert not backend.create("uploads/x/lock", b"b")
+    assert backend.get("uploads/x/lock") == b"a"
+
+
+def test_rotation_mid_upload(vault, upload):
+    uid = upload["upload_id"]
+    send(uid, 0, vault)
+    rotation = vault_crypto.rotate_master_key()
+    assert vault.stat(chunked_upload.session_key(uid)).metadata["kid"] == rotation["active_key"]
+
+    for offset in range(128, len(PAYLOAD), 128):
+        send(uid, offset, vault)
+    done = chunked_upload.complete_upload(uid, vault)
+    meta = vault.stat(done["filename"]).metadata
+    assert meta["kid"] == rotation["active_key"]
+    assert int(meta["size"]) == len(PAYLOAD)
+    assert vault_crypto.load(done["filename"], vault) == PAYLOAD
+
+
+def test_part_keeps_a_rewrap_that_raced_it(vault, upload, monkeypatch):
+    uid = upload["upload_id"]
+    loaded = chunked_upload.load_session
+
+    def load_then_rotate(upload_id, backend=None):
+        # Rotation re-wraps the header after this request read the session
+        result = loaded(upload_id, backend)
+        vault_crypto.rotate_master_key()
+        return result
+
+    monkeypatch.setattr(chunked_upload, "load_session", load_then_rotate)
+    send(uid, 0, vault)
+    header = vault.stat(chunked_upload.session_key(uid)).metadata
+    assert header["kid"] == vault_crypto.get_keyring().active
+
+
+def test_streaming_restore_of_a_chunked_upload(vault, upload):
+    uid = upload["upload_id"]
+    for offset in range(0, len(PAYLOAD), 128):
+        send(uid, offset, vault)
+    name = chunked_upload.complete_upload(uid, vault)["filename"]
+
+    size, chunks = vault_crypto.iter_decrypt(name, vault)
+    parts = list(chunks)
+    assert size == len(PAYLOAD) and len(parts) == 10 and b"".join(parts) == PAYLOAD
+
+    items = bulk_restore.select_files([name], vault)
+    tar = tarfile.open(fileobj=io.BytesIO(b"".join(bulk_restore.stream_archive(items, "tar"))))
+    assert tar.extractfile(name.replace(".enc", "")).read() == PAYLOAD
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(bulk_restore.stream_archive(items, "zip"))))
+    assert archive.read(name.replace(".enc", "")) == PAYLOAD
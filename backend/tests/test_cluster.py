@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+import cluster
+from database import db
+
+
+class FakeClock:
+    def __init__(self, start):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds if isinstance(self.now, float) else timedelta(seconds=seconds)
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'lease.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+
+
+@pytest.fixture
+def clocks():
+    # Database clock shared by all workers, one monotonic clock per worker
+    return FakeClock(datetime(2025, 1, 1, 12, 0, 0)), FakeClock(1000.0), FakeClock(5000.0)
+
+
+def lease(worker_id, db_clock, mono):
+    return cluster.LeaderLease(worker_id=worker_id, ttl=30, margin=5, clock=db_clock, monotonic=mono)
+
+
+def test_only_one_worker_holds_the_lease(app, clocks):
+    db_clock, mono_a, mono_b = clocks
+    a, b = lease("a", db_clock, mono_a), lease("b", db_clock, mono_b)
+    assert a.heartbeat() and a.is_leader
+    assert not b.heartbeat() and not b.is_leader
+    # Renewal keeps it with the holder past the original expiry
+    for _ in range(5):
+        db_clock.advance(10)
+        mono_a.advance(10)
+        assert a.heartbeat()
+        assert not b.heartbeat()
+
+
+def test_takeover_after_leader_stops_renewing(app, clocks):
+    db_clock, mono_a, mono_b = clocks
+    a, b = lease("a", db_clock, mono_a), lease("b", db_clock, mono_b)
+    a.heartbeat()
+
+    db_clock.advance(29)
+    assert not b.heartbeat()
+    db_clock.advance(1)
+    assert b.heartbeat() and b.is_leader
+    # The old holder cannot renew once the lease has moved on
+    assert not a.heartbeat() and not a.is_leader
+
+
+def test_leadership_lapses_locally_before_the_lease_expires(app, clocks):
+    db_clock, mono_a, _ = clocks
+    a = lease("a", db_clock, mono_a)
+    a.heartbeat()
+
+    # No successful renewal (e.g. a hung DB call): stop at ttl - margin
+    mono_a.advance(24.9)
+    assert a.is_leader
+    mono_a.advance(0.2)
+    assert not a.is_leader
+
+
+def test_release_hands_over_immediately(app, clocks):
+    db_clock, mono_a, mono_b = clocks
+    a, b = lease("a", db_clock, mono_a), lease("b", db_clock, mono_b)
+    a.heartbeat()
+    a.release()
+    assert not a.is_leader
+    assert b.heartbeat()
+
+
+def test_expiry_uses_database_time(app):
+    a = cluster.LeaderLease(worker_id="a", ttl=30)
+    assert a.heartbeat()
+    row = db.session.get(cluster.SchedulerLease, cluster.LEASE_NAME)
+    assert abs((row.expires_at - cluster.db_now()).total_seconds() - 30) <= 1
@@ -0,0 +1,43 @@
+import random
+
+import pytest
+
+from anomaly_detector.detectors import RollingMADDetector
+
+
+def flagged(detector, values):
+    return sum(detector.update(v)[0] for v in values)
+
+
+def io_series(zero_share, n=2000, seed=7):
+    rng = random.Random(seed)
+    return [0.0 if rng.random() < zero_share else rng.lognormvariate(10, 1) for _ in range(n)]
+
+
+@pytest.mark.parametrize("zero_share", [0.0, 0.5, 0.7, 0.9])
+def test_zero_heavy_series_has_bounded_false_positives(zero_share):
+    # Same settings as the I/O metrics in detector_config.json
+    det = RollingMADDetector(window=120, k=6.0)
+    assert flagged(det, io_series(zero_share)) <= 2000 * 0.02
+
+
+def test_spike_on_zero_heavy_series_is_still_flagged():
+    det = RollingMADDetector(window=120, k=6.0)
+    flagged(det, io_series(0.7))
+    hit, score = det.update(5e7)
+    assert hit and score > 6.0
+
+
+def test_min_scale_floors_an_all_zero_series():
+    det = RollingMADDetector(window=20, k=6.0, min_scale=4096)
+    flagged(det, [0.0] * 50)
+    assert not det.update(4096 * 5)[0]
+    assert det.update(4096 * 10)[0]
+
+
+def test_collapsed_estimate_is_reseeded():
+    det = RollingMADDetector(window=20, k=3.5)
+    flagged(det, [1.0] * 20)
+    # The level moves for good: flags stop once the detector re-seeds on it
+    hits = [det.update(1000.0 + (i % 3))[0] for i in range(200)]
+    assert any(hits[:10]) and not any(hits[-100:])
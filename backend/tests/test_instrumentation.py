@@ -0,0 +1,18 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+import instrumentation
+
+
+def test_failed_statement_is_recorded_and_its_start_dropped():
+    instrumentation.instrument_sqlalchemy()
+    engine = create_engine("sqlite://")
+    errors = instrumentation.DB_ERRORS._values.get(("SELECT",), 0)
+    with engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text("SELECT * FROM missing_table"))
+        assert not conn.info.get("_metrics_start")
+        conn.execute(text("SELECT 1"))
+        assert not conn.info.get("_metrics_start")
+    assert instrumentation.DB_ERRORS._values[("SELECT",)] == errors + 1
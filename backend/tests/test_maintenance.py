@@ -0,0 +1,142 @@
+import csv
+import time
+import threading
+from datetime import datetime
+
+import pytest
+
+import maintenance
+from anomaly_detector.csv_lock import locked
+
+HEADER = ["timestamp", "host", "cpu"]
+
+
+@pytest.fixture
+def fleet(tmp_path, monkeypatch):
+    raw = tmp_path / "fleet_metrics.csv"
+    monkeypatch.setattr(maintenance, "ROLLUP_DIR", str(tmp_path / "rollups"))
+    monkeypatch.setattr(maintenance, "STATE_PATH", str(tmp_path / "rollups" / "state.json"))
+    monkeypatch.setattr(maintenance, "SOURCES", [(str(raw), "fleet")])
+    # Keep the real anomaly and incident logs out of it
+    monkeypatch.setattr(maintenance, "compact_anomaly_log", lambda now: (0, 0))
+    monkeypatch.setattr(maintenance, "expire_incidents", lambda now: (0, 0))
+    monkeypatch.setattr(maintenance, "ROLLUP_SETTLE_SECONDS", 120)
+    with open(raw, "w", newline="") as f:
+        csv.writer(f).writerow(HEADER)
+    return raw
+
+
+def append(path, rows):
+    with open(path, "a", newline="") as f:
+        csv.writer(f).writerows(rows)
+
+
+def minute_rows():
+    return {(r["bucket"], r["host"]): r["samples"] for r in maintenance.read_rollup("fleet", "1m")}
+
+
+def run(monkeypatch, now, raw_days=7):
+    monkeypatch.setattr(maintenance, "RAW_RETENTION_DAYS", raw_days)
+    return maintenance.run_maintenance(datetime.strptime(now, maintenance.TS_FORMAT))
+
+
+def test_late_host_is_rolled_up_after_others_move_ahead(fleet, monkeypatch):
+    append(fleet, [["2025-01-01 10:20:00", "a", "10"], ["2025-01-01 10:21:00", "a", "20"]])
+    run(monkeypatch, "2025-01-01 10:30:00")
+    assert minute_rows() == {("2025-01-01 10:20", "a"): 1, ("2025-01-01 10:21", "a"): 1}
+
+    # Host b replays its spool from before host a's watermark
+    append(fleet, [["2025-01-01 10:05:00", "b", "30"], ["2025-01-01 10:05:30", "b", "50"]])
+    run(monkeypatch, "2025-01-01 10:31:00")
+    rows = maintenance.read_rollup("fleet", "1m", host="b")
+    assert [(r["bucket"], r["samples"], r["cpu_avg"], r["cpu_max"]) for r in rows] == [
+        ("2025-01-01 10:05", 2, 40.0, 50.0)
+    ]
+    # Nothing is rolled up twice
+    assert len(maintenance.read_rollup("fleet", "1m")) == 3
+
+
+def test_unsettled_minutes_wait_for_in_flight_rows(fleet, monkeypatch):
+    append(fleet, [["2025-01-01 10:29:00", "a", "10"]])
+    run(monkeypatch, "2025-01-01 10:30:00")
+    assert minute_rows() == {}
+
+    append(fleet, [["2025-01-01 10:29:30", "a", "30"]])
+    run(monkeypatch, "2025-01-01 10:40:00")
+    assert minute_rows() == {("2025-01-01 10:29", "a"): 2}
+
+
+def test_retention_keeps_rows_not_yet_rolled_up(fleet, monkeypatch):
+    append(fleet, [["2025-01-01 10:00:00", "a", "10"]])
+    run(monkeypatch, "2025-01-01 10:30:00")
+    # Late rows older than raw retention are rolled up before being dropped
+    append(fleet, [["2024-12-20 08:00:00", "b", "70"]])
+    summary = run(monkeypatch, "2025-01-01 10:45:00", raw_days=7)
+    assert ("2024-12-20 08:00", "b") in minute_rows()
+    assert summary["fleet"]["raw_expired"] == 1
+
+
+def test_hour_waits_for_each_hosts_minutes(fleet, monkeypatch):
+    append(fleet, [["2025-01-01 09:10:00", "a", "10"], ["2025-01-01 10:10:00", "a", "10"]])
+    run(monkeypatch, "2025-01-01 11:30:00")
+    append(fleet, [["2025-01-01 09:50:00", "b", "40"]])
+    run(monkeypatch, "2025-01-01 11:31:00")
+    # b's 09:xx hour stays open until b's minutes pass it
+    assert {(r["bucket"], r["host"]) for r in maintenance.read_rollup("fleet", "1h")} == {
+        ("2025-01-01 09", "a")
+    }
+    append(fleet, [["2025-01-01 10:20:00", "b", "40"]])
+    run(monkeypatch, "2025-01-01 11:32:00")
+    assert ("2025-01-01 09", "b") in {(r["bucket"], r["host"]) for r in maintenance.read_rollup("fleet", "1h")}
+
+
+def test_legacy_fleet_watermark_applies_to_every_host(fleet, monkeypatch, tmp_path):
+    (tmp_path / "rollups").mkdir()
+    maintenance._save_state({"fleet_1m": "2025-01-01 10:10"})
+    append(fleet, [["2025-01-01 10:05:00", "a", "10"], ["2025-01-01 10:15:00", "a", "10"]])
+    run(monkeypatch, "2025-01-01 10:30:00")
+    assert minute_rows() == {("2025-01-01 10:15", "a"): 1}
+
+
+def test_rollup_resumes_at_first_unsettled_row(fleet, monkeypatch):
+    append(fleet, [["2025-01-01 10:20:00", "a", "10"]])
+    pending = fleet.stat().st_size
+    append(fleet, [["2025-01-01 10:29:00", "a", "20"], ["2025-01-01 10:21:00", "b", "30"]])
+    run(monkeypatch, "2025-01-01 10:30:00")
+    assert minute_rows() == {("2025-01-01 10:20", "a"): 1, ("2025-01-01 10:21", "b"): 1}
+    assert maintenance._load_state()["fleet_scan"]["offset"] == pending
+
+    append(fleet, [["2025-01-01 10:29:40", "a", "40"]])
+    run(monkeypatch, "2025-01-01 10:40:00")
+    assert minute_rows()[("2025-01-01 10:29", "a")] == 2
+    assert maintenance._load_state()["fleet_scan"]["offset"] == fleet.stat().st_size
+
+
+def test_retention_rewrite_moves_the_resume_offset(fleet, monkeypatch):
+    append(fleet, [["2024-12-01 10:00:00", "a", "10"], ["2025-01-01 10:29:00", "a", "20"]])
+    run(monkeypatch, "2025-01-01 10:30:00")
+    scan = maintenance._load_state()["fleet_scan"]
+    assert scan["inode"] == fleet.stat().st_ino
+    with open(fleet, "rb") as f:
+        f.seek(scan["offset"])
+        assert f.readline().startswith(b"2025-01-01 10:29:00")
+
+
+def test_rewrite_waits_for_writers_and_keeps_their_rows(tmp_path):
+    path = tmp_path / "log.csv"
+    with open(path, "w", newline="") as f:
+        csv.writer(f).writerows([HEADER, ["2024-01-01 00:00:00", "a", "1"], ["2025-01-01 00:00:00", "a", "2"]])
+
+    result = []
+    with locked(str(path)):
+        rewrite = threading.Thread(target=lambda: result.append(
+            maintenance.rewrite_csv(str(path), lambda r: r["timestamp"] >= "2025")))
+        rewrite.start()
+        time.sleep(0.2)
+        assert rewrite.is_alive()  # filtered, now blocked before the swap
+        append(path, [["2025-01-01 00:01:00", "b", "3"]])
+    rewrite.join(5)
+
+    assert result == [(1, 1)]
+    with open(path, newline="") as f:
+        assert [r["host"] for r in csv.DictReader(f)] == ["a", "b"]
@@ -0,0 +1,145 @@
+import os
+import time
+from datetime import datetime
+
+import retention
+import snapshots
+
+NOW = datetime(2025, 6, 15, 12, 0, 0)
+
+
+def ts(*args):
+    return datetime(*args).strftime(retention.TS_FORMAT)
+
+
+def upload(backend, name, when, sidecar=True):
+    key = f"{name}_{when}.enc"
+    backend.put(key, b"ciphertext")
+    if sidecar:
+        backend.put(key + ".hash", b"0" * 64)
+    return key
+
+
+def keys(backend):
+    return sorted(o.key for o in backend.list())
+
+
+def test_keep_last_always_keeps_newest():
+    stamps = [datetime(2025, 1, d) for d in (5, 4, 3, 2, 1)]
+    assert retention.select_keep(stamps, {"keep_last": 2}) == {0, 1}
+    assert retention.select_keep(stamps, {}) == {0}
+    assert retention.select_keep([], {"keep_last": 3}) == set()
+
+
+def test_gfs_keeps_newest_per_period():
+    # Newest first: two per day for three days, then one in the previous month
+    stamps = [datetime(2025, 3, 3, 18), datetime(2025, 3, 3, 6),
+              datetime(2025, 3, 2, 18), datetime(2025, 3, 2, 6),
+              datetime(2025, 3, 1, 18), datetime(2025, 2, 10, 9)]
+    assert retention.select_keep(stamps, {"gfs": {"daily": 2}}) == {0, 2}
+    assert retention.select_keep(stamps, {"gfs": {"monthly": 2}}) == {0, 5}
+    assert retention.select_keep(stamps, {"keep_last": 1, "gfs": {"daily": 3, "monthly": 2}}) == {0, 2, 4, 5}
+
+
+def test_policy_lookup_prefers_name_then_longest_prefix():
+    config = {
+        "default": {"keep_last": 9},
+        "policies": [
+            {"prefix": "rep", "keep_last": 1},
+            {"prefix": "report", "keep_last": 2},
+            {"name": "report.csv", "keep_last": 3},
+        ],
+    }
+    assert retention.policy_for("report.csv", config)["keep_last"] == 3
+    assert retention.policy_for("report.txt", config)["keep_last"] == 2
+    assert retention.policy_for("other", config)["keep_last"] == 9
+    assert retention.policy_for("other", {"policies": []}) is None
+
+
+def test_gc_deletes_expired_versions_and_sidecars(vault):
+    old = upload(vault, "a.txt", ts(2025, 1, 1))
+    mid = upload(vault, "a.txt", ts(2025, 2, 1))
+    new = upload(vault, "a.txt", ts(2025, 3, 1))
+    untouched = upload(vault, "b.txt", ts(2024, 1, 1))
+    vault.put("notes.txt", b"not a timestamped upload")
+    vault.put("gone.txt_20240101_000000.enc.hash", b"orphan")
+    config = {"policies": [{"name": "a.txt", "keep_last": 2}]}
+
+    report = retention.run_gc(dry_run=True, backend=vault, config=config, now=NOW)
+    assert report["groups"]["a.txt"]["expired"] == [old]
+    assert report["groups"]["a.txt"]["kept"] == [new, mid]
+    assert "b.txt" not in report["groups"]
+    assert old in keys(vault)
+
+    report = retention.run_gc(dry_run=False, backend=vault, config=config, now=NOW)
+    assert report["expired_versions"] == 1
+    assert keys(vault) == sorted([mid, mid + ".hash", new, new + ".hash",
+                                  untouched, untouched + ".hash", "notes.txt"])
+
+
+def test_gc_without_policies_deletes_nothing(vault):
+    upload(vault, "a.txt", ts(2025, 1, 1))
+    upload(vault, "a.txt", ts(2025, 2, 1))
+    before = keys(vault)
+    report = retention.run_gc(dry_run=False, backend=vault, config={}, now=NOW)
+    assert report["expired_versions"] == 0
+    assert keys(vault) == before
+
+
+def test_sweep_keeps_referenced_and_young_objects(vault, tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "kept.txt").write_bytes(b"still referenced")
+    entry = snapshots.create_snapshot(str(src))
+    referenced = snapshots.object_key(snapshots.load_manifest(entry["snapshot_id"])["files"][0]["digest"])
+
+    stale = "objects/ff/" + "f" * 64 + ".enc"
+    young = "objects/ee/" + "e" * 64 + ".enc"
+    vault.put(stale, b"x")
+    vault.put(young, b"x")
+    long_ago = time.time() - 3 * 24 * 3600
+    for key in (stale, referenced):
+        os.utime(vault._path(key), (long_ago, long_ago))
+
+    report = retention.run_gc(dry_run=False, backend=vault, config={}, now=datetime.now())
+    assert report["unreferenced_objects"] == 1
+    remaining = keys(vault)
+    assert stale not in remaining
+    assert referenced in remaining and young in remaining
+
+
+def test_expired_snapshot_releases_its_objects(vault, tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "f.txt").write_bytes(b"first version")
+    first = snapshots.create_snapshot(str(src))
+    first_obj = snapshots.object_key(snapshots.load_manifest(first["snapshot_id"])["files"][0]["digest"])
+    # Two snapshots in the same second get a suffixed id; make the newer one clearly newer
+    (src / "f.txt").write_bytes(b"second version")
+    time.sleep(1.1)
+    snapshots.create_snapshot(str(src))
+    long_ago = time.time() - 3 * 24 * 3600
+    os.utime(vault._path(first_obj), (long_ago, long_ago))
+
+    config = {"policies": [{"prefix": "/", "keep_last": 1}]}
+    report = retention.run_gc(dry_run=False, backend=vault, config=config, now=datetime.now())
+    assert report["expired_versions"] == 1
+    assert first_obj not in keys(vault)
+    assert first["snapshot_id"] not in [e["snapshot_id"] for e in snapshots.list_snapshots()]
+
+
+def test_same_second_snapshots_order_by_suffix(vault, tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "f.txt").write_bytes(b"v1")
+    monkeypatch.setattr(snapshots, "datetime", type("frozen", (), {"now": staticmethod(lambda: datetime(2025, 1, 1))}))
+    ids = []
+    for n in range(1, 12):
+        (src / "f.txt").write_bytes(b"v%d" % n)
+        ids.append(snapshots.create_snapshot(str(src))["snapshot_id"])
+    assert ids[1].endswith("_2") and ids[10].endswith("_11")
+
+    groups, _ = retention.collect_versions(vault)
+    assert [v["id"] for v in groups[str(src)]] == ids[::-1]
+    report, _ = retention.plan(vault, {"policies": [{"prefix": "/", "keep_last": 1}]})
+    assert report["groups"][str(src)]["kept"] == [ids[-1]]
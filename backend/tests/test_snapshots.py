@@ -0,0 +1,49 @@
+import os
+import time
+
+import pytest
+
+import snapshots
+import vault_manager
+
+
+@pytest.fixture
+def tree(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.txt").write_bytes(b"alpha")
+    # Older than the racy window, so the next scan trusts the stat cache
+    old = time.time() - 60
+    os.utime(src / "a.txt", (old, old))
+    return src
+
+
+def object_of(entry, path="a.txt"):
+    files = snapshots.load_manifest(entry["snapshot_id"])["files"]
+    return snapshots.object_key(next(f["digest"] for f in files if f["path"] == path))
+
+
+def test_cache_hit_object_swept_since_last_run_is_stored_again(vault, tree):
+    key = object_of(snapshots.create_snapshot(str(tree)))
+    vault.delete(key)
+
+    entry = snapshots.create_snapshot(str(tree))
+    assert entry["new_objects"] == 1
+    assert snapshots.read_object(key.rsplit("/", 1)[1][:-4]) == b"alpha"
+
+
+def test_cache_hit_objects_are_touched(vault, tree):
+    key = object_of(snapshots.create_snapshot(str(tree)))
+    os.utime(vault._path(key), (0, 0))
+    snapshots.create_snapshot(str(tree))
+    assert vault.stat(key).modified > time.time() - 60
+
+
+def test_cache_is_not_saved_when_the_catalog_write_fails(vault, tree, monkeypatch):
+    def fail(entry):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(vault_manager, "save_metadata", fail)
+    with pytest.raises(OSError):
+        snapshots.create_snapshot(str(tree))
+    assert snapshots.load_cache(str(tree)) == {}
@@ -0,0 +1,360 @@
+# vault_crypto.py
+"""
+Envelope encryption for vault objects.
+
+Every object is encrypted with its own random Fernet data key (DEK). The
+DEK is wrapped by the active master key and stored in the object's
+metadata next to the master key id:
+
+    {"enc": "envelope-v1", "kid": "<master key id>", "dek": "<wrapped DEK>"}
+
+Rotating the master key therefore only re-wraps these small headers
+(rewrap_objects, run in parallel) instead of re-encrypting every object.
+
+Master keys live in vault_master_keys.json. Until the first rotation the
+keyring is just vault_key.key. Objects written before envelope encryption
+carry no "dek" and are still decrypted with that original key.
+
+Usage (from backend/):
+    python vault_crypto.py status
+    python vault_crypto.py rotate [--workers 16] [--migrate-legacy]
+    python vault_crypto.py prune
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LEGACY_KEY_PATH = os.path.join(BASE_DIR, "vault_key.key")
+KEYRING_PATH = os.path.join(BASE_DIR, "vault_master_keys.json")
+
+ENVELOPE_VERSION = "envelope-v1"
+# Ciphertext is newline-separated Fernet tokens under one DEK (resumable uploads)
+FRAMING_LINES = "lines"
+REWRAP_WORKERS = int(os.environ.get("VAULT_REWRAP_WORKERS", 16))
+KEYRING_CHECK_SECONDS = 5
+
+
+def key_id(key):
+    return hashlib.sha256(key).hexdigest()[:12]
+
+
+def _load_legacy_key():
+    from cryptography.fernet import Fernet
+
+    if os.path.exists(LEGACY_KEY_PATH):
+        with open(LEGACY_KEY_PATH, "rb") as f:
+            return f.read().strip()
+    key = Fernet.generate_key()
+    with open(LEGACY_KEY_PATH, "wb") as f:
+        f.write(key)
+    return key
+
+
+class Keyring:
+    """Master keys by id, the active id, and the id of the pre-envelope key."""
+
+    def __init__(self, keys, active, legacy):
+        self.keys = keys
+        self.active = active
+        self.legacy = legacy
+        self._fernets = {}
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or KEYRING_PATH
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            keys = {kid: k.encode() for kid, k in data["keys"].items()}
+            return cls(keys, data["active"], data.get("legacy"))
+        legacy = _load_legacy_key()
+        kid = key_id(legacy)
+        return cls({kid: legacy}, kid, kid)
+
+    def save(self, path=None):
+        path = path or KEYRING_PATH
+        tmp = path + ".tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({
+                "active": self.active,
+                "legacy": self.legacy,
+                "keys": {kid: k.decode() for kid, k in self.keys.items()},
+            }, f, indent=2)
+        os.replace(tmp, path)
+
+    def fernet(self, kid):
+        f = self._fernets.get(kid)
+        if f is None:
+            from cryptography.fernet import Fernet
+            if kid not in self.keys:
+                raise KeyError(f"Master key {kid} is not in the keyring")
+            f = self._fernets[kid] = Fernet(self.keys[kid])
+        return f
+
+    def add_key(self):
+        """Generate a new master key and make it active; returns its id."""
+        from cryptography.fernet import Fernet
+
+        key = Fernet.generate_key()
+        kid = key_id(key)
+        self.keys[kid] = key
+        self.active = kid
+        return kid
+
+
+_keyring = None
+_keyring_mtime = None
+_keyring_checked = 0.0
+_keyring_lock = threading.Lock()
+
+
+def get_keyring():
+    """Process-wide keyring; reloaded when another process rotates the master key."""
+    global _keyring, _keyring_mtime, _keyring_checked
+    now = time.monotonic()
+    if _keyring is not None and now - _keyring_checked < KEYRING_CHECK_SECONDS:
+        return _keyring
+    with _keyring_lock:
+        _keyring_checked = now
+        try:
+            mtime = os.stat(KEYRING_PATH).st_mtime_ns
+        except OSError:
+            mtime = None
+        if _keyring is None or mtime != _keyring_mtime:
+            _keyring = Keyring.load()
+            _keyring_mtime = mtime
+    return _keyring
+
+
+def _invalidate_keyring():
+    global _keyring_checked
+    _keyring_checked = 0.0
+
+
+# ---------- ENCRYPT / DECRYPT ----------
+def wrap_key(dek, keyring=None):
+    keyring = keyring or get_keyring()
+    return keyring.active, keyring.fernet(keyring.active).encrypt(dek).decode()
+
+
+def unwrap_key(metadata, keyring=None):
+    keyring = keyring or get_keyring()
+    return keyring.fernet(metadata["kid"]).decrypt(metadata["dek"].encode())
+
+
+def new_data_key(keyring=None):
+    """Returns (dek, metadata): a fresh data key and its wrapped envelope header."""
+    from cryptography.fernet import Fernet
+
+    dek = Fernet.generate_key()
+    kid, wrapped = wrap_key(dek, keyring)
+    return dek, {"enc": ENVELOPE_VERSION, "kid": kid, "dek": wrapped}
+
+
+def encrypt(data, keyring=None):
+    """Returns (ciphertext, metadata) for a new object."""
+    from cryptography.fernet import Fernet
+
+    dek, metadata = new_data_key(keyring)
+    return Fernet(dek).encrypt(data), metadata
+
+
+def is_envelope(metadata):
+    return bool(metadata) and metadata.get("enc") == ENVELOPE_VERSION and "dek" in metadata
+
+
+def decrypt(ciphertext, metadata=None):
+    """Decrypt an envelope object, or a legacy object encrypted with vault_key.key."""
+    from cryptography.fernet import Fernet
+
+    keyring = get_keyring()
+    if is_envelope(metadata):
+        fernet = Fernet(unwrap_key(metadata, keyring))
+        if metadata.get("framing") == FRAMING_LINES:
+            return b"".join(fernet.decrypt(token) for token in ciphertext.split(b"\n") if token)
+        return fernet.decrypt(ciphertext)
+    return keyring.fernet(keyring.legacy).decrypt(ciphertext)
+
+
+def store(key, data, backend=None, keyring=None):
+    """Encrypt `data` and write it under `key`; returns the ciphertext."""
+    backend = backend or storage.get_backend()
+    ciphertext, metadata = encrypt(data, keyring)
+    backend.put(key, ciphertext, metadata)
+    return ciphertext
+
+
+def load(key, backend=None):
+    backend = backend or storage.get_backend()
+    info = backend.stat(key)
+    if info is None:
+        raise FileNotFoundError(key)
+    return decrypt(backend.get(key), info.metadata)
+
+
+def iter_decrypt(key, backend=None):
+    """(plaintext size, iterator of plaintext chunks) for a stored object.
+
+    Line-framed objects are decrypted one token at a time as the ciphertext
+    streams in, so memory stays at about one upload part; their size is None
+    if the header predates recording it. Any other object is a single token
+    and is decrypted whole. Missing objects and bad keys raise here, before
+    the first chunk.
+    """
+    from cryptography.fernet import Fernet
+
+    backend = backend or storage.get_backend()
+    info = backend.stat(key)
+    if info is None:
+        raise FileNotFoundError(key)
+    meta = info.metadata
+    if not (is_envelope(meta) and meta.get("framing") == FRAMING_LINES):
+        data = decrypt(backend.get(key), meta)
+        return len(data), iter((data,))
+    fernet = Fernet(unwrap_key(meta))
+    size = int(meta["size"]) if meta.get("size") is not None else None
+    return size, _iter_tokens(fernet, backend.iter_chunks(key))
+
+
+def _iter_tokens(fernet, blocks):
+    partial = []
+    for block in blocks:
+        start = 0
+        while True:
+            end = block.find(b"\n", start)
+            if end < 0:
+                partial.append(block[start:])
+                break
+            partial.append(block[start:end])
+            token = b"".join(partial)
+            partial = []
+            if token:
+                yield fernet.decrypt(token)
+            start = end + 1
+    token = b"".join(partial)
+    if token:
+        yield fernet.decrypt(token)
+
+
+# ---------- ROTATION ----------
+def _rewrap_one(backend, keyring, key, migrate_legacy):
+    info = backend.stat(key)
+    if info is None:
+        return "missing"
+    meta = info.metadata or {}
+    if is_envelope(meta):
+        if meta["kid"] == keyring.active:
+            return "current"
+        dek = unwrap_key(meta, keyring)
+        kid, wrapped = wrap_key(dek, keyring)
+        backend.update_metadata(key, {**meta, "kid": kid, "dek": wrapped})
+        return "rewrapped"
+
+    if key.endswith(".hash"):
+        return "plain"  # integrity sidecars are not encrypted
+    if not migrate_legacy:
+        return "legacy"
+    # One-off full re-encryption of a pre-envelope object
+    try:
+        plaintext = keyring.fernet(keyring.legacy).decrypt(backend.get(key))
+    except Exception:
+        return "skipped"  # not a vault ciphertext (e.g. a foreign file)
+    ciphertext = store(key, plaintext, backend, keyring)
+    if backend.exists(key + ".hash"):
+        backend.put(key + ".hash", hashlib.sha256(ciphertext).hexdigest().encode())
+    return "migrated"
+
+
+def rewrap_objects(backend=None, keyring=None, workers=REWRAP_WORKERS, migrate_legacy=False):
+    """Re-wrap every envelope DEK under the active master key, in parallel.
+
+    Returns a Counter of outcomes (current, rewrapped, legacy, migrated, ...).
+    """
+    backend = backend or storage.get_backend()
+    keyring = keyring or get_keyring()
+    keys = [o.key for o in backend.list()]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = pool.map(lambda k: _rewrap_one(backend, keyring, k, migrate_legacy), keys)
+        return Counter(results)
+
+
+def rotate_master_key(workers=REWRAP_WORKERS, migrate_legacy=False):
+    """Activate a new master key and re-wrap all objects under it."""
+    keyring = Keyring.load()
+    old = keyring.active
+    new = keyring.add_key()
+    keyring.save()
+    _invalidate_keyring()
+    started = time.perf_counter()
+    counts = rewrap_objects(keyring=keyring, workers=workers, migrate_legacy=migrate_legacy)
+    return {
+        "previous_key": old,
+        "active_key": new,
+        "objects": dict(counts),
+        "duration_s": round(time.perf_counter() - started, 3),
+    }
+
+
+def key_usage(backend=None, workers=REWRAP_WORKERS):
+    """Counter of master key ids referenced by stored objects ("legacy" for pre-envelope)."""
+    backend = backend or storage.get_backend()
+
+    def kid_of(key):
+        info = backend.stat(key)
+        meta = info.metadata if info else None
+        return meta["kid"] if is_envelope(meta) else "legacy"
+
+    keys = [o.key for o in backend.list() if not o.key.endswith(".hash")]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return Counter(pool.map(kid_of, keys))
+
+
+def prune_master_keys():
+    """Drop retired master keys no object references; the legacy key stays while legacy objects exist."""
+    keyring = Keyring.load()
+    usage = key_usage()
+    keep = {keyring.active} | {kid for kid in usage if kid != "legacy"}
+    if usage.get("legacy"):
+        keep.add(keyring.legacy)
+    removed = [kid for kid in keyring.keys if kid not in keep]
+    for kid in removed:
+        del keyring.keys[kid]
+    if removed:
+        keyring.save()
+    return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vault master key management")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="master keys and how many objects use each")
+    rotate = sub.add_parser("rotate", help="activate a new master key and re-wrap all objects")
+    rotate.add_argument("--workers", type=int, default=REWRAP_WORKERS)
+    rotate.add_argument("--migrate-legacy", action="store_true",
+                        help="also re-encrypt pre-envelope objects (reads and rewrites them)")
+    sub.add_parser("prune", help="remove master keys no object uses any more")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        keyring = Keyring.load()
+        print(json.dumps({"active": keyring.active, "keys": list(keyring.keys),
+                          "objects": dict(key_usage())}, indent=2))
+    elif args.command == "rotate":
+        print(json.dumps(rotate_master_key(args.workers, args.migrate_legacy), indent=2))
+    else:
+        print(json.dumps({"removed": prune_master_keys()}))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,44 +1,32 @@
 import os
 import hashlib
+import threading
+from contextlib import contextmanager
 from cryptography.fernet import Fernet
 from datetime import datetime
 import json
 
+try:
+    import fcntl
+except ImportError:  # Windows: the thread lock alone
+    fcntl = None
+
 from flask import jsonify, send_file
 
+import storage
+import vault_crypto
+
 
-# Set consistent vault path (absolute)
+# ---------- CONFIG ----------
+# Absolute paths, shared with app.py, so results no longer depend on the cwd
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-VAULT_DIR = os.path.join(BASE_DIR, "vault")
+VAULT_DIR = storage.VAULT_DIR
 DECRYPT_DIR = os.path.join(BASE_DIR, "restored")
+KEY_FILE = os.path.join(BASE_DIR, "vault_key.key")
+METADATA_FILE = os.path.join(BASE_DIR, "vault_metadata.json")
 
-# Ensure folders exist
-os.makedirs(VAULT_DIR, exist_ok=True)
 os.makedirs(DECRYPT_DIR, exist_ok=True)
 
-# Example key (replace this with your own key management logic)
-KEY_PATH = os.path.join(BASE_DIR, "vault_key.key")
-if os.path.exists(KEY_PATH):
-    with open(KEY_PATH, "rb") as f:
-        key = f.read()
-else:
-    key = Fernet.generate_key()
-    with open(KEY_PATH, "wb") as f:
-        f.write(key)
-
-fernet = Fernet(key)
-
-
-
-
-# ---------- CONFIG ----------
-VAULT_DIR = "vault"
-KEY_FILE = "vault_key.key"
-METADATA_FILE = "vault_metadata.json"
-
-# Ensure vault directory exists
-os.makedirs(VAULT_DIR, exist_ok=True)
-
 # ---------- KEY MANAGEMENT ----------
 def generate_key():
     """Generate a symmetric encryption key (AES-128 via Fernet)."""
@@ -53,8 +41,8 @@ def load_key():
         return generate_key()
     return open(KEY_FILE, 'rb').read()
 
-# Load encryption key
-fernet = Fernet(load_key())
+# Objects are encrypted per-object via vault_crypto (envelope encryption);
+# load_key() returns the original master key, still used for legacy objects
 
 # ---------- FILE OPERATIONS ----------
 def encrypt_and_store(file_path):
@@ -65,14 +53,12 @@ def encrypt_and_store(file_path):
     with open(file_path, 'rb') as f:
         data = f.read()
 
-    encrypted = fernet.encrypt(data)
+    encrypted, crypto_meta = vault_crypto.encrypt(data)
     file_name = os.path.basename(file_path)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     encrypted_name = f"{file_name}_{timestamp}.enc"
 
-    encrypted_path = os.path.join(VAULT_DIR, encrypted_name)
-    with open(encrypted_path, 'wb') as ef:
-        ef.write(encrypted)
+    storage.get_backend().put(encrypted_name, encrypted, crypto_meta)
 
     # Generate hash for integrity verification
     file_hash = hashlib.sha256(encrypted).hexdigest()
@@ -89,17 +75,15 @@ def encrypt_and_store(file_path):
 
 def decrypt_file(filename):
     """Locate, decrypt, and save restored file"""
-    filepath = os.path.join(VAULT_DIR, filename)
-    if not os.path.exists(filepath):
-        print(f"[DEBUG] File not found at: {filepath}")
+    backend = storage.get_backend()
+    if not backend.exists(filename):
+        print(f"[DEBUG] File not found in vault: {filename}")
         return None
 
     restored_path = os.path.join(DECRYPT_DIR, filename.replace(".enc", "_restored.txt"))
 
     try:
-        with open(filepath, "rb") as enc_file:
-            encrypted_data = enc_file.read()
-            decrypted_data = fernet.decrypt(encrypted_data)
+        decrypted_data = vault_crypto.load(filename, backend)
 
         with open(restored_path, "wb") as dec_file:
             dec_file.write(decrypted_data)
@@ -112,20 +96,49 @@ def decrypt_file(filename):
         return None
 
 # ---------- METADATA MANAGEMENT ----------
-def save_metadata(entry):
-    if not os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, 'w') as f:
-            json.dump([], f)
+_metadata_lock = threading.Lock()
+
+@contextmanager
+def _catalog_lock():
+    """Serialize catalog rewrites across threads and processes (API workers, CLI runs)."""
+    with _metadata_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(METADATA_FILE + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
 
-    with open(METADATA_FILE, 'r') as f:
-        data = json.load(f)
-    data.append(entry)
+def save_metadata(entry):
+    # Serialized and atomic: uploads and snapshot runs may append concurrently
+    with _catalog_lock():
+        data = list_vault_files()
+        data.append(entry)
 
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+        tmp = METADATA_FILE + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp, METADATA_FILE)
 
 def list_vault_files():
     if not os.path.exists(METADATA_FILE):
         return []
     with open(METADATA_FILE, 'r') as f:
         return json.load(f)
+
+def remove_metadata(predicate):
+    """Drop every catalog entry for which predicate(entry) is true; returns how many."""
+    with _catalog_lock():
+        data = list_vault_files()
+        kept = [e for e in data if not predicate(e)]
+        if len(kept) == len(data):
+            return 0
+
+        tmp = METADATA_FILE + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(kept, f, indent=4)
+        os.replace(tmp, METADATA_FILE)
+        return len(data) - len(kept)